@@ -0,0 +1,101 @@
+"""Write contention on one community post: inline fields vs sharded counters.
+
+``python -m benchmarks.engagement_contention --writes 500 --concurrency 32``
+hammers a single post with likes and comments from a thread pool, first the
+old way (``Increment`` and ``ArrayUnion`` on the post document) and then
+through ``engagement`` (comment documents and sharded counters), and prints
+throughput, latency percentiles and errors for each.
+
+It runs against the Firestore emulator when ``FIRESTORE_EMULATOR_HOST`` is
+set. The emulator does not enforce the per-document write rate, so for real
+numbers point ``--project`` at a staging project; never at production.
+"""
+import argparse
+import os
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import firestore
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000
+
+
+def run(name, writes, concurrency, like, comment):
+    latencies = []
+    errors = Counter()
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            # One comment for every four likes, roughly what the feed sees
+            if i % 5 == 4:
+                comment(i)
+            else:
+                like()
+        except Exception as e:
+            errors[type(e).__name__] += 1
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(writes)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{name:8} {writes} writes, concurrency {concurrency}: {elapsed:.2f}s, "
+          f"{len(latencies) / elapsed:.1f} ok/s, "
+          f"p50 {_percentile(latencies, 50):.0f}ms p95 {_percentile(latencies, 95):.0f}ms "
+          f"p99 {_percentile(latencies, 99):.0f}ms, errors {dict(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writes', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--project', help='staging project to run against instead of the emulator')
+    args = parser.parse_args()
+
+    if not args.project and not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        parser.error('set FIRESTORE_EMULATOR_HOST or pass --project')
+    client = firestore.Client(project=args.project or 'krishimitra-bench')
+
+    from website import engagement
+    engagement.db = client
+
+    posts = client.collection('bench_community_posts')
+    engagement.COLLECTION = posts.id
+
+    inline = posts.document(f"inline-{uuid.uuid4().hex[:8]}")
+    inline.set({'title': 'inline', 'likes': 0, 'comments': [], 'comment_count': 0})
+
+    def inline_like():
+        inline.update({'likes': firestore.Increment(1)})
+
+    def inline_comment(i):
+        inline.update({
+            'comments': firestore.ArrayUnion([{'author': 'bench', 'text': f"comment {i}"}]),
+            'comment_count': firestore.Increment(1),
+        })
+
+    sharded = posts.document(f"sharded-{uuid.uuid4().hex[:8]}")
+    sharded.set({'title': 'sharded'})
+
+    run('inline', args.writes, args.concurrency, inline_like, inline_comment)
+    run('sharded', args.writes, args.concurrency,
+        lambda: engagement.like(sharded.id),
+        lambda i: engagement.add_comment(sharded.id, 'bench', f"comment {i}"))
+
+    counts = engagement.get_counts([sharded.id])[sharded.id]
+    print(f"inline post: {inline.get().to_dict()['likes']} likes; "
+          f"sharded post: {counts['likes']} likes, {counts['comments']} comments")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Mandi price ingestion and query benchmark.
+
+``python -m benchmarks.mandi --rows 2000000 --queries 500``
+
+Writes a synthetic Agmarknet file (data.gov.in layout, several varieties
+per commodity, market and day) to a temporary directory, ingests it into
+a fresh store, ingests a second file that re-publishes the last week, and
+then times trend, comparison and fair-price hint lookups against the
+memory-mapped store.
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+COMMODITIES = ['Tomato', 'Onion', 'Potato', 'Wheat', 'Rice', 'Paddy(Dhan)(Common)', 'Maize', 'Mustard',
+               'Bhindi(Ladies Finger)', 'Green Chilli', 'Cotton', 'Soyabean', 'Gram', 'Banana', 'Apple']
+STATES = {
+    'Maharashtra': ['Pune', 'Nashik', 'Nagpur', 'Solapur'],
+    'Punjab': ['Ludhiana', 'Amritsar', 'Jalandhar'],
+    'Madhya Pradesh': ['Indore', 'Bhopal', 'Ujjain'],
+    'Gujarat': ['Rajkot', 'Ahmedabad', 'Surat'],
+}
+HEADER = ['State', 'District', 'Market', 'Commodity', 'Variety', 'Grade', 'Arrival_Date',
+          'Min_x0020_Price', 'Max_x0020_Price', 'Modal_x0020_Price']
+
+
+def markets():
+    out = []
+    for state, districts in STATES.items():
+        for district in districts:
+            out += [(state, district, f"{district} APMC"), (state, district, f"{district} (Gunj)")]
+    return out
+
+
+def write_file(path, rows, rng, last_day, days):
+    """Write about ``rows`` rows covering ``days`` days up to ``last_day``."""
+    places = markets()
+    per_day = len(COMMODITIES) * len(places) * 2  # two varieties
+    days = min(days, max(1, rows // per_day))
+    base = {name: rng.randint(800, 6000) for name in COMMODITIES}
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        written = 0
+        for offset in range(days - 1, -1, -1):
+            day = (last_day - timedelta(days=offset)).strftime('%d/%m/%Y')
+            for commodity in COMMODITIES:
+                for state, district, market in places:
+                    if rng.random() < 0.2:
+                        continue  # not every market reports every day
+                    for variety in ('Local', 'Other'):
+                        modal = base[commodity] * rng.uniform(0.8, 1.2)
+                        writer.writerow([state, district, market, commodity, variety, 'FAQ', day,
+                                         round(modal * 0.9), round(modal * 1.1), round(modal)])
+                        written += 1
+    return written
+
+
+def _timed(fn, queries):
+    start = time.perf_counter()
+    for i in range(queries):
+        fn(i)
+    return (time.perf_counter() - start) / queries * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='krishimitra-mandi-')
+    os.environ['MANDI_DATA_DIR'] = os.path.join(workdir, 'store')
+    os.environ.setdefault('DATA_BACKEND', 'memory')  # the version bump after an ingest
+    from website import mandi
+
+    rng = random.Random(0)
+    today = date.today()
+    history, update = os.path.join(workdir, 'history.csv'), os.path.join(workdir, 'update.csv')
+    start = time.perf_counter()
+    written = write_file(history, args.rows, rng, today, args.days)
+    write_file(update, args.rows, rng, today, 7)
+    print(f"wrote {written} rows in {time.perf_counter() - start:.1f}s "
+          f"({os.path.getsize(history) / 1e6:.0f} MB)")
+
+    for path in (history, update):
+        start = time.perf_counter()
+        read, skipped, stored = mandi.ingest([path], mandi.DATA_DIR)
+        elapsed = time.perf_counter() - start
+        print(f"ingest {os.path.basename(path)}: {read} rows in {elapsed:.1f}s "
+              f"({read / max(elapsed, 1e-9) / 1e6:.2f}M rows/s), store holds {stored}")
+
+    places = markets()
+    start = time.perf_counter()
+    mandi.current().hints()
+    print(f"hints built in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    results = {
+        'trend (all markets)': lambda i: mandi.trend(COMMODITIES[i % len(COMMODITIES)], days=365),
+        'trend (one market)': lambda i: mandi.trend(COMMODITIES[i % len(COMMODITIES)],
+                                                    places[i % len(places)][2], days=90),
+        'compare': lambda i: mandi.compare(COMMODITIES[i % len(COMMODITIES)], places[i % len(places)][2]),
+        'price hints (20)': lambda i: [mandi.price_hint(f"Fresh {COMMODITIES[(i + j) % len(COMMODITIES)]}",
+                                                        places[j % len(places)][1], 'kg') for j in range(20)],
+    }
+    for name, fn in results.items():
+        print(f"{name:22} {_timed(fn, args.queries):8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Load-test the model client against the local stub server.
+
+``python -m benchmarks.model_client_load --requests 200 --concurrency 32``
+starts the stub in-process (unless ``--url`` is given), fires the requests
+from a thread pool and prints throughput and ``model_client.metrics()``.
+"""
+import argparse
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--delay', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--url', help='use an already running server instead of the in-process stub')
+    args = parser.parse_args()
+
+    if not args.url:
+        from benchmarks.stub_model_server import serve
+        server = serve(port=0, delay=args.delay, jitter=args.delay / 4, error_rate=args.error_rate, background=True)
+        args.url = f"http://127.0.0.1:{server.server_port}"
+    # model_client reads its base URL at import time
+    os.environ['GEMINI_BASE_URL'] = args.url
+    from website import model_client
+
+    payload = {'contents': [{'parts': [{'text': 'ping'}]}]}
+    outcomes = Counter()
+
+    def one(_):
+        try:
+            model_client.generate_content(payload, 'stub-key')
+            outcomes['ok'] += 1
+        except model_client.ModelUnavailable:
+            outcomes['rejected'] += 1
+        except model_client.ModelError:
+            outcomes['error'] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}: {elapsed:.2f}s, "
+          f"{args.requests / elapsed:.1f} req/s, {dict(outcomes)}")
+    print(model_client.metrics())
+
+
+if __name__ == '__main__':
+    main()
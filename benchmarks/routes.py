@@ -0,0 +1,343 @@
+"""Route-level benchmark with Firestore read budgets.
+
+``python -m benchmarks.routes --scales 1000,10000,100000 --requests 200 --concurrency 8``
+
+For each scale the app runs against the in-memory datastore
+(``DATA_BACKEND=memory``) seeded with that many users, listings and
+community posts, and ``analyze_crop`` talks to the stub model server.
+Each route is driven from a thread pool of logged-in test clients.
+The report covers throughput, p50/p95/p99 latency, and the Firestore
+documents read and written per request, counted by ``datastore.track()``.
+
+A route fails when any request reads more documents than its entry in
+``BUDGETS``. The budgets don't grow with scale, so a route that starts
+scanning a collection fails at 10k even if it is fast at 1k. The run
+exits non-zero on any failure.
+
+Reads are the number that carries over to production. The latencies
+include the in-process fake, which scans whole collections, so compare
+them between runs rather than with production.
+
+Each scale runs in its own process so the app starts from a clean slate.
+``--no-search-index`` keeps the in-memory listing index off, so the
+marketplace routes exercise the Firestore query path.
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+# Maximum documents read by one request, at any scale
+BUDGETS = {
+    'home': 20,
+    'login': 1,
+    'marketplace': 25,
+    'marketplace_search': 125,
+    'marketplace_near': 110,
+    'my_farm': 50,
+    'community': 50,
+    'create_post': 0,
+    'analyze_crop': 0,
+    'api_listings': 31,
+    'api_listings_delta': 35,
+    'api_posts': 60,
+    'api_batch': 25,
+}
+# Writes queued offline and sent in one /api/v1/batch request on reconnect
+BATCH_OPS = 20
+
+CROPS = ['Tomato', 'Onion', 'Potato', 'Wheat', 'Basmati Rice', 'Maize', 'Mustard', 'Urea', 'DAP', 'Tractor']
+CATEGORIES = ['Crops', 'Fertilizer', 'Tools', 'Rentals']
+LOCATIONS = ['Pune', 'Nashik', 'Indore', 'Ludhiana', 'Karnal', 'Guntur', 'Rajkot', 'Hisar']
+PASSWORD = 'bench'
+
+
+def phone(i):
+    return f"+91{9000000000 + i}"
+
+
+def seed(db, scale, rng):
+    """Write ``scale`` users, listings and posts, plus some engagement."""
+    from website import listings, scores, stats
+
+    now = datetime.now(timezone.utc)
+    batch = db.batch()
+
+    def write(ref, data):
+        nonlocal batch
+        batch.set(ref, data)
+        if len(batch) == 500:
+            batch.commit()
+            batch = db.batch()
+
+    for i in range(scale):
+        write(db.collection('users').document(phone(i)), {
+            'phone_number': phone(i),
+            'password': PASSWORD,
+            'full_name': f"Farmer {i}",
+            'role': 'Farmer',
+            'created_at': now - timedelta(days=rng.randint(0, 365)),
+        })
+
+        name = f"{rng.choice(['Fresh', 'Organic', 'Desi'])} {rng.choice(CROPS)}"
+        location = rng.choice(LOCATIONS)
+        item = {
+            'name': name,
+            'price': rng.randint(10, 500),
+            'unit': 'kg',
+            'location': location,
+            'category': rng.choice(CATEGORIES),
+            'description': f"Batch {i}",
+            'seller': f"Farmer {i}",
+            'seller_phone': phone(rng.randrange(scale)),
+            'image': '/static/uploads/sample.webp',
+            'thumb': '/static/uploads/sample.webp',
+            'created_at': now - timedelta(minutes=i),
+            'updated_at': now - timedelta(minutes=i),
+        }
+        item.update(listings.index_fields(name, location))
+        write(db.collection('marketplace_items').document(f"item{i}"), item)
+
+        post_id = f"post{i}"
+        author = rng.randrange(max(1, scale // 4))  # some farmers post a lot
+        posted = now - timedelta(minutes=i)
+        write(db.collection('community_posts').document(post_id), {
+            'author': f"Farmer {author}",
+            'author_id': phone(author),
+            'title': f"Question {i}",
+            'content': 'How do I treat leaf curl?',
+            'tag': 'General',
+            'timestamp': posted,
+            'avatar': '',
+        })
+        write(db.collection(scores.ACTIVITY).document(post_id), {
+            'type': 'post', 'user_id': phone(author), 'name': f"Farmer {author}", 'at': posted,
+        })
+        if i % 10 == 0:
+            write(db.collection('community_posts').document(post_id).collection('counters').document('0'), {
+                'post_id': post_id, 'likes': rng.randint(0, 100), 'comments': 1,
+            })
+            write(db.collection('community_posts').document(post_id).collection('comments').document(), {
+                'author': 'Farmer 0', 'text': 'Neem oil', 'timestamp': '', 'created_at': now,
+            })
+    batch.commit()
+    stats.reconcile()
+    scores.replay()
+
+
+def random_photo(rng):
+    from PIL import Image
+
+    image = Image.effect_noise((64, 64), rng.randint(20, 120)).convert('RGB').resize((640, 480))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=80)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def make_routes(rng, scale, requests):
+    """Route name -> function(client) making one request."""
+    search_words = ['tom', 'wheat', 'rice', 'onion']
+    # A fresh photo per request, so every diagnosis reaches the model
+    photos = iter([random_photo(rng) for _ in range(requests)])
+
+    def marketplace(client):
+        return client.get('/marketplace')
+
+    def marketplace_search(client):
+        return client.get('/marketplace', query_string={
+            'search': rng.choice(search_words),
+            'category': rng.choice(CATEGORIES),
+            'min_price': 50,
+        })
+
+    def login(client):
+        return client.post('/login', json={'phone': phone(rng.randrange(scale)), 'password': PASSWORD})
+
+    def create_post(client):
+        return client.post('/community/post', json={'title': 'Benchmark', 'content': 'Post', 'tag': 'General'})
+
+    def analyze_crop(client):
+        return client.post('/api/analyze-crop', json={'image': next(photos)})
+
+    def api_batch(client):
+        ops = []
+        for n in range(BATCH_OPS):
+            kind = ['like', 'like', 'comment', 'like', 'post'][n % 5] if n else 'listing'
+            data = {'post_id': f"post{rng.randrange(scale)}"}
+            if kind == 'comment':
+                data['comment'] = 'Same problem here'
+            elif kind == 'post':
+                data = {'title': 'Back online', 'content': 'Queued while offline'}
+            elif kind == 'listing':
+                data = {'name': 'Fresh Tomato', 'price': '40', 'unit': 'kg', 'location': 'Pune', 'category': 'Crops'}
+            ops.append({'key': f"bench-{rng.getrandbits(64):016x}", 'type': kind, 'data': data})
+        return client.post('/api/v1/batch', json={'ops': ops})
+
+    def api_listings_delta(client):
+        # A client that last synced a few minutes ago
+        since = int((time.time() - rng.randint(60, 600)) * 1000)
+        return client.get('/api/v1/listings', query_string={'since': since})
+
+    return {
+        'home': lambda client: client.get('/'),
+        'login': login,
+        'marketplace': marketplace,
+        'marketplace_search': marketplace_search,
+        'marketplace_near': lambda client: client.get('/marketplace', query_string={
+            'near': rng.choice(LOCATIONS), 'radius': rng.choice([25, 50, 250])}),
+        'my_farm': lambda client: client.get('/myfarm'),
+        'community': lambda client: client.get('/community'),
+        'create_post': create_post,
+        'analyze_crop': analyze_crop,
+        'api_listings': lambda client: client.get('/api/v1/listings'),
+        'api_listings_delta': api_listings_delta,
+        'api_posts': lambda client: client.get('/api/v1/posts'),
+        'api_batch': api_batch,
+    }
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_route(app, name, request, requests, concurrency, scale):
+    from website import datastore
+
+    rng = random.Random(name)
+    clients = []
+    for _ in range(concurrency):
+        client = app.test_client()
+        client.post('/login', json={'phone': phone(rng.randrange(scale)), 'password': PASSWORD})
+        clients.append(client)
+
+    def one(i):
+        client = clients[i % concurrency]
+        with datastore.track() as usage:
+            start = time.perf_counter()
+            response = request(client)
+            elapsed = time.perf_counter() - start
+        return elapsed, response.status_code, usage.reads, usage.writes
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    reads = [r[2] for r in results]
+    return {
+        'route': name,
+        'requests': requests,
+        'errors': sum(1 for r in results if r[1] >= 500),
+        'throughput': round(requests / wall, 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 1),
+        'reads_mean': round(sum(reads) / len(reads), 1),
+        'reads_max': max(reads),
+        'writes_mean': round(sum(r[3] for r in results) / len(results), 1),
+        'budget': BUDGETS.get(name),
+    }
+
+
+def run_scale(args):
+    """Seed one scale and benchmark every route in this process."""
+    scale = args.scale
+    workdir = tempfile.mkdtemp(prefix='krishimitra-bench-')
+    os.environ.update({
+        'DATA_BACKEND': 'memory',
+        'DIAGNOSIS_CACHE_DB': os.path.join(workdir, 'diagnosis_cache.sqlite3'),
+        'JOBS_DB': os.path.join(workdir, 'jobs.sqlite3'),
+        'GEMINI_API_KEY': 'stub-key',
+        'LOG_REQUESTS': '0',
+    })
+    from benchmarks.stub_model_server import serve
+    server = serve(port=0, delay=args.model_delay, jitter=args.model_delay / 4, background=True)
+    os.environ['GEMINI_BASE_URL'] = f"http://127.0.0.1:{server.server_port}"
+
+    import website
+    from website import search_index
+
+    start = time.perf_counter()
+    seed(website.db, scale, random.Random(scale))
+    seeded = time.perf_counter() - start
+
+    if args.no_search_index:
+        search_index.start = lambda: None
+    app = website.create_app()
+    website.db.flush_listeners()
+    app.config['SESSION_COOKIE_SECURE'] = False  # test client speaks plain http
+
+    rng = random.Random(0)
+    routes = make_routes(rng, scale, args.requests)
+    selected = args.routes.split(',') if args.routes else list(routes)
+    results = [run_route(app, name, routes[name], args.requests, args.concurrency, scale) for name in selected]
+    return {'scale': scale, 'seed_seconds': round(seeded, 1), 'routes': results}
+
+
+def report(run):
+    print(f"\nscale {run['scale']} (seeded in {run['seed_seconds']}s)")
+    print(f"{'route':20} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'reads':>7} {'max':>5} {'budget':>6} {'writes':>7} {'errors':>6}")
+    failures = []
+    for r in run['routes']:
+        over = r['budget'] is not None and r['reads_max'] > r['budget']
+        if over:
+            failures.append(f"{r['route']} read {r['reads_max']} documents at scale {run['scale']} "
+                            f"(budget {r['budget']})")
+        if r['errors']:
+            failures.append(f"{r['route']} had {r['errors']} server errors at scale {run['scale']}")
+        print(f"{r['route']:20} {r['throughput']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} "
+              f"{r['reads_mean']:>7} {r['reads_max']:>5} {str(r['budget']):>6} {r['writes_mean']:>7} "
+              f"{r['errors']:>6}{'  OVER BUDGET' if over else ''}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='1000', help='comma-separated dataset sizes')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', help='comma-separated subset of routes')
+    parser.add_argument('--model-delay', type=float, default=0.2, help='stub model latency in seconds')
+    parser.add_argument('--no-search-index', action='store_true', help='serve the marketplace from queries')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--scale', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scale:
+        # Child process: one scale, results as JSON on the last line of stdout
+        print(json.dumps(run_scale(args)))
+        return
+
+    runs = []
+    for scale in [int(s) for s in args.scales.split(',')]:
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.routes', '--scale', str(scale)] + sys.argv[1:],
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    failures = []
+    for run in runs:
+        failures += report(run)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(runs, f, indent=2)
+    if failures:
+        print('\nBudget failures:')
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Harvest Hero score recomputation benchmark.
+
+``python -m benchmarks.scores --users 100000 --events 1000000``
+
+Times the numpy fold of a year of activity into per-user scores and the
+leaderboard selection on their own, then a replay and an incremental
+recompute against the in-memory datastore (``--stored-events`` of them,
+since the fake scans whole collections) with the reads and writes each
+one costs.
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+
+def events(rng, users, count, days):
+    today = 20000
+    return [(f"+91{9000000000 + int(rng.paretovariate(1.2) * users) % users}", None,
+             today - rng.randrange(days)) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--events', type=int, default=1_000_000)
+    parser.add_argument('--stored-events', type=int, default=20_000)
+    args = parser.parse_args()
+
+    os.environ.update({'DATA_BACKEND': 'memory', 'SCORES_INTERVAL': '0'})
+    from website import datastore, db, scores
+
+    rng = random.Random(0)
+    log = events(rng, args.users, args.events, 365)
+    table = scores._Table()
+    start = time.perf_counter()
+    table.fold(log)
+    print(f"fold {len(log)} events: {(time.perf_counter() - start) * 1000:.0f} ms, {len(table.ids)} users")
+    start = time.perf_counter()
+    table.fold(events(rng, args.users, 5000, 1))
+    print(f"fold 5000 more: {(time.perf_counter() - start) * 1000:.0f} ms")
+    start = time.perf_counter()
+    table.top(20000)
+    print(f"top {scores.LEADERBOARD_SIZE}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    now = datetime.now(timezone.utc) - timedelta(minutes=5)
+    batch = db.batch()
+    for i, (user_id, _, day) in enumerate(events(rng, args.users, args.stored_events, 365)):
+        batch.set(db.collection(scores.ACTIVITY).document(f"post{i}"), {
+            'type': 'post', 'user_id': user_id, 'name': user_id, 'at': now - timedelta(days=20000 - day),
+        })
+        if len(batch) == 450:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+
+    for name, run in (('replay', scores.replay), ('recompute (nothing new)', scores.recompute)):
+        with datastore.track() as usage:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+        counts = usage.as_dict()
+        print(f"{name:24} {elapsed * 1000:8.0f} ms  reads {counts['reads']}  writes {counts['writes']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Compare the in-memory search index against the old linear filter.
+
+Run with ``python -m benchmarks.search_index [num_listings]``.
+"""
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from website.search_index import SearchIndex
+
+CROPS = ['Tomato', 'Onion', 'Potato', 'Wheat', 'Basmati Rice', 'Maize', 'Mustard',
+         'टमाटर', 'प्याज़', 'आलू', 'गेहूं', 'मक्का', 'सरसों', 'Urea', 'DAP', 'Tractor']
+CATEGORIES = ['Crops', 'Fertilizer', 'Tools', 'Rentals']
+LOCATIONS = ['Pune', 'Nashik', 'Indore', 'Ludhiana', 'Karnal', 'Guntur', 'Rajkot', 'Hisar']
+QUERIES = [
+    {'search': 'tom'},
+    {'search': 'wheat', 'category': 'Crops'},
+    {'search': 'rice', 'location': 'karnal', 'min_price': 20, 'max_price': 80},
+    {'location': 'pune'},
+]
+
+
+def make_listings(n, seed=42):
+    rng = random.Random(seed)
+    now = datetime.now()
+    return {
+        f'item{i}': {
+            'name': f"{rng.choice(['Fresh', 'Organic', 'Desi', ''])} {rng.choice(CROPS)}".strip(),
+            'description': f"Grown in {rng.choice(LOCATIONS)}, batch {i}",
+            'category': rng.choice(CATEGORIES),
+            'location': rng.choice(LOCATIONS),
+            'price': rng.randint(10, 500),
+            'created_at': now - timedelta(minutes=i),
+        }
+        for i in range(n)
+    }
+
+
+def linear_filter(items, search='', category='', location='', min_price=None, max_price=None):
+    """The per-request loop ``views.marketplace`` used to run."""
+    out = []
+    for doc_id, item in items.items():
+        if search and search not in item.get('name', '').lower(): continue
+        if category and category != 'All' and category != item.get('category', ''): continue
+        if location and location not in item.get('location', '').lower(): continue
+        price = item.get('price', 0)
+        if min_price and price < min_price: continue
+        if max_price and price > max_price: continue
+        out.append(item)
+    return out
+
+
+def build(items, **kwargs):
+    index = SearchIndex(**kwargs)
+    for doc_id, item in items.items():
+        index.upsert(doc_id, item)
+    return index
+
+
+def measure_build(items, **kwargs):
+    """Return ``(index, seconds, peak bytes)``; memory is traced separately
+    because tracemalloc slows the build down several times."""
+    start = time.perf_counter()
+    index = build(items, **kwargs)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    build(items, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return index, elapsed, peak
+
+
+def timeit(fn, repeat=50):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main(n):
+    items = make_listings(n)
+
+    index, build_time, peak = measure_build(items)
+    print(f"{n} listings: index built in {build_time:.2f}s, peak {peak / 1e6:.1f} MB")
+    bounded, _, bounded_peak = measure_build(items, max_docs=n // 10, index_description=False)
+    print(f"bounded (max_docs={n // 10}, no description): peak {bounded_peak / 1e6:.1f} MB")
+
+    print(f"{'query':<60} {'linear ms':>10} {'index ms':>10}")
+    for query in QUERIES:
+        index.search(**query)  # warm the sorted token lists
+        linear = timeit(lambda: linear_filter(items, **query), repeat=5)
+        indexed = timeit(lambda: index.search(**query))
+        print(f"{str(query):<60} {linear * 1000:>10.2f} {indexed * 1000:>10.3f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,72 @@
+"""Cold-start benchmark.
+
+``python -m benchmarks.startup --runs 5``
+
+Each run starts a fresh interpreter and measures, in milliseconds:
+importing ``website``, ``create_app()``, opening the datastore client and
+the first request to ``/warmup`` and to ``/``. ``--backend firestore``
+measures the real client with the credentials in the environment; the
+default is the in-memory stand-in, which isolates the app's own import and
+setup cost. Services are deferred as under gunicorn (``DEFER_SERVICES=1``).
+
+Process-wide import time is in ``python -X importtime -c 'import website'``.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+_PROBE = r"""
+import json, time
+started = time.perf_counter()
+import website
+imported = time.perf_counter()
+app = website.create_app()
+created = time.perf_counter()
+website.post_fork()
+serviced = time.perf_counter()
+client = app.test_client()
+warm = client.get('/warmup')
+warmed = time.perf_counter()
+client.get('/')
+first = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'services': serviced - created,
+    'client_open': website.db.open_seconds or 0,
+    'warmup': warmed - serviced,
+    'first_request': first - warmed,
+    'total': first - started,
+    'warmup_status': warm.status_code,
+}))
+"""
+
+
+def _run(backend):
+    env = dict(os.environ, DATA_BACKEND=backend, DEFER_SERVICES='1', LOG_REQUESTS='0')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', _PROBE], env=env, cwd=root,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--backend', default='memory', choices=['memory', 'sqlite', 'firestore'])
+    args = parser.parse_args()
+
+    runs = [_run(args.backend) for _ in range(args.runs)]
+    if any(run['warmup_status'] != 200 for run in runs):
+        print(f"warning: /warmup returned {runs[0]['warmup_status']}")
+    phases = [name for name in runs[0] if name != 'warmup_status']
+    print(f"{'phase':<14}{'min ms':>10}{'median ms':>12}{'max ms':>10}")
+    for name in phases:
+        values = sorted(run[name] * 1000 for run in runs)
+        print(f"{name:<14}{values[0]:>10.1f}{values[len(values) // 2]:>12.1f}{values[-1]:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
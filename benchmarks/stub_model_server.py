@@ -0,0 +1,99 @@
+"""Local stand-in for the Gemini generateContent endpoint.
+
+Run with ``python -m benchmarks.stub_model_server --port 8085 --delay 1.5``
+and point the app at it with ``GEMINI_BASE_URL=http://127.0.0.1:8085``.
+``--error-rate`` makes that fraction of calls return HTTP 503, to exercise
+retries and the circuit breaker. ``streamGenerateContent?alt=sse`` is served
+too, with the reply split into chunks spread over the delay.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNKS = 8
+
+DIAGNOSIS = {
+    'name': 'Early Blight',
+    'description': 'Dark concentric spots on older leaves caused by Alternaria solani.',
+    'confidence': 87,
+    'treatments': [
+        'Remove and destroy infected lower leaves.',
+        'Spray Mancozeb 75% WP at 2.5 g per litre of water.',
+        'Apply neem oil (5 ml per litre) every 10 days.',
+        'Avoid overhead irrigation; water at the base.',
+        'Rotate with non-solanaceous crops such as maize.',
+        'Mulch to stop soil splashing onto leaves.',
+        'Use resistant varieties recommended by your KVK.',
+    ],
+}
+
+
+def make_handler(delay, jitter, error_rate):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+
+            streaming = ':streamGenerateContent' in self.path
+            total_delay = max(0, delay + random.uniform(-jitter, jitter))
+            time.sleep(total_delay / CHUNKS if streaming else total_delay)
+
+            if random.random() < error_rate:
+                self._send(503, {'error': {'code': 503, 'message': 'The model is overloaded.'}})
+                return
+            text = '```json\n' + json.dumps(DIAGNOSIS, indent=2) + '\n```'
+            if streaming:
+                self._stream(text, total_delay)
+            else:
+                self._send(200, {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}}]})
+
+        def _stream(self, text, total_delay):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            size = len(text) // CHUNKS + 1
+            for i in range(0, len(text), size):
+                chunk = {'candidates': [{'content': {'parts': [{'text': text[i:i + size]}], 'role': 'model'}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+                self.wfile.flush()
+                time.sleep(total_delay / CHUNKS)
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def serve(port=8085, delay=1.0, jitter=0.3, error_rate=0.0, background=False):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(delay, jitter, error_rate))
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    print(f"Stub model server on http://127.0.0.1:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8085)
+    parser.add_argument('--delay', type=float, default=1.0)
+    parser.add_argument('--jitter', type=float, default=0.3)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    serve(args.port, args.delay, args.jitter, args.error_rate)
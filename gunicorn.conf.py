@@ -0,0 +1,35 @@
+"""gunicorn settings: ``gunicorn main:app`` picks this file up.
+
+The app is imported once in the master (``preload_app``) and workers are
+forked from it, so they share the imported code instead of each importing
+it again. This is only safe because nothing in the master opens a gRPC
+channel or starts a thread: the Firestore client is created lazily
+(website/firebase.py) and listeners and worker threads are started in
+``post_fork`` rather than by ``create_app``.
+"""
+import os
+import threading
+
+os.environ.setdefault('DEFER_SERVICES', '1')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+
+
+def when_ready(server):
+    import website
+    server.log.info('App loaded in master: %s', _format(website.startup_timings))
+
+
+def post_fork(server, worker):
+    import website
+    website.post_fork()
+    # Open the Firestore client before the first request needs it
+    threading.Thread(target=website.db.is_configured, name='warm-db', daemon=True).start()
+    server.log.info('Worker %s started: %s', worker.pid, _format(website.startup_timings))
+
+
+def _format(timings):
+    return ', '.join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timings.items())
@@ -1,51 +1,61 @@
+import time
+
+_import_started = time.perf_counter()
+
 from flask import Flask
 from flask_cors import CORS
-import firebase_admin
-from firebase_admin import credentials, firestore
+from dotenv import load_dotenv
 import os
-import json  # Import json to parse the environment variable
-
-db = None
-
-def initialize_firebase():
-    global db
-    
-    if not firebase_admin._apps:
-        # OPTION 1: Try fetching from Environment Variable (For Render Deployment)
-        firebase_creds = os.environ.get('FIREBASE_CREDENTIALS')
-        
-        if firebase_creds:
-            try:
-                # Parse the JSON string from the environment variable
-                cred_dict = json.loads(firebase_creds)
-                cred = credentials.Certificate(cred_dict)
-                firebase_admin.initialize_app(cred)
-                db = firestore.client()
-                print("Firebase Initialized from Environment Variable")
-                return # Exit function, success
-            except Exception as e:
-                print(f"Failed to initialize from Env Var: {e}")
-
-        # OPTION 2: Fallback to local file (For Local Development)
-        cred_path = os.path.join(os.path.dirname(__file__), 'serviceAccountKey.json')
-
-        if os.path.exists(cred_path):
-            try:
-                cred = credentials.Certificate(cred_path)
-                firebase_admin.initialize_app(cred)
-                db = firestore.client()
-                print("Firebase Initialized from Local File")
-            except Exception as e:
-                print(f"Failed to initialize Firebase from file: {e}")
-        else:
-            # If neither works, print an error (but don't crash app immediately, though DB won't work)
-            print("Error: No Firebase credentials found (Env Var or File).")
-    else:
-        db = firestore.client()
-
-initialize_firebase()
+
+from .firebase import LazyClient, create_client
+
+# Opened on first use in each process (see firebase.py)
+db = LazyClient(create_client)
+os.register_at_fork(after_in_child=db.reset)
+
+# Seconds spent in each startup phase of this process, for /warmup
+startup_timings = {}
+_services_pid = None
+
+def start_services():
+    """Start this process's listeners and worker threads.
+
+    Threads and snapshot listeners don't survive fork(), so under a
+    preloaded gunicorn this runs in each worker (post_fork) instead of in
+    create_app.
+    """
+    global _services_pid
+    if _services_pid == os.getpid():
+        return
+    _services_pid = os.getpid()
+    started = time.perf_counter()
+
+    from . import search_index, jobs, feed, versions, scores
+    search_index.start()
+    feed.start()
+    versions.start()
+    jobs.start()
+    scores.start()
+    startup_timings['services'] = time.perf_counter() - started
+
+def serving_requests():
+    """False while the ``flask`` CLI loads the app for a command other than
+    ``run``: migrations and ingests would otherwise start job workers that
+    claim queued diagnoses and then exit mid-job, and listeners for nothing."""
+    import click
+    ctx = click.get_current_context(silent=True)
+    return ctx is None or ctx.command.name == 'run'
+
+def post_fork():
+    """Per-worker setup for a preloaded app: fresh clients, then services."""
+    db.reset()
+    start_services()
+
+startup_timings['import'] = time.perf_counter() - _import_started
 
 def create_app():
+    started = time.perf_counter()
+    load_dotenv()  # .env for local development
     app = Flask(__name__)
     # It is also good practice to use an Env Var for the Secret Key
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'GHSTGFYUJSGFDVBER')
@@ -58,8 +68,41 @@ def create_app():
 
     from .auth import auth
     from .views import views
+    from .api import api
+    from .health import health
+    from .media import media
+    from .stats import reconcile_command
+    from .listings import backfill_command
+    from .images import optimize_uploads_command
+    from .engagement import migrate_command
+    from .users import migrate_command as migrate_users_command
+    from .mandi import ingest_command as ingest_mandi_command
+    from .scores import recompute_command
+    from .blobs import gc_command as gc_blobs_command
 
     app.register_blueprint(auth, url_prefix='/')
     app.register_blueprint(views, url_prefix='/')
+    app.register_blueprint(api, url_prefix='/api/v1')
+    app.register_blueprint(health, url_prefix='/')
+    app.register_blueprint(media, url_prefix='/')
+
+    app.cli.add_command(reconcile_command)
+    app.cli.add_command(backfill_command)
+    app.cli.add_command(optimize_uploads_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(migrate_users_command)
+    app.cli.add_command(ingest_mandi_command)
+    app.cli.add_command(recompute_command)
+    app.cli.add_command(gc_blobs_command)
+
+    from . import instrumentation, http_cache, compression
+    instrumentation.init_app(app)
+    http_cache.init_app(app)
+    compression.init_app(app)
+
+    startup_timings['create_app'] = time.perf_counter() - started
+    # A preloading server starts them after forking (gunicorn.conf.py)
+    if os.environ.get('DEFER_SERVICES') != '1' and serving_requests():
+        start_services()
 
     return app
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""Versioned JSON API used by the PWA, mounted at ``/api/v1``.
+
+Records are sent as ``fields`` plus ``rows`` of values in that order, with
+only what the client renders. Listings and posts support delta sync
+(see ``sync``):
+
+* without ``since``: newest first; follow ``next`` with ``cursor`` for
+  older records and keep the ``watermark`` of the first page;
+* with ``since=<watermark>``: records created or changed after it, oldest
+  first, plus the ids ``deleted`` since. Follow ``next`` with the same
+  ``since`` until it is null, then keep the new ``watermark``;
+* ``reset: true``: the client is too far behind; drop the local copy and
+  sync from scratch.
+
+Times are milliseconds since the epoch.
+
+``POST /batch`` applies writes queued while offline (see ``outbox``).
+
+``/mandi/...`` serves market price analytics (see ``mandi``); those
+responses change only when prices are ingested and may be cached.
+"""
+from flask import Blueprint, jsonify, request, session
+
+from . import engagement, feed, listings, mandi, outbox, sync
+
+API_VERSION = 1
+DEFAULT_LIMIT = 30
+MAX_LIMIT = 100
+MAX_COUNT_IDS = 60
+MANDI_MAX_AGE = 600
+
+LISTING_FIELDS = ['id', 'updated', 'name', 'price', 'unit', 'location', 'category', 'seller', 'phone', 'thumb']
+POST_FIELDS = ['id', 'time', 'author', 'title', 'content', 'tag', 'avatar', 'likes', 'comments']
+
+api = Blueprint('api', __name__)
+
+
+def _page_args():
+    """Return ``(since, cursor, limit, error_response)``."""
+    try:
+        limit = min(MAX_LIMIT, max(1, int(request.args.get('limit', DEFAULT_LIMIT))))
+        since = request.args.get('since')
+        since = sync.from_millis(since) if since else None
+    except (TypeError, ValueError, OverflowError):
+        return None, None, None, (jsonify({'v': API_VERSION, 'error': 'limit and since must be integers'}), 400)
+    return since, request.args.get('cursor') or None, limit, None
+
+
+def _sync_page(collection, field, fields, to_row, since, cursor, limit):
+    """Run one sync request and shape the common part of the response."""
+    if since is None:
+        docs, next_cursor, watermark = sync.newest(collection, field, fields, cursor, limit)
+        deleted = []
+    else:
+        docs, deleted, next_cursor, watermark = sync.changes(collection, field, fields, since, cursor, limit)
+    body = {
+        'v': API_VERSION,
+        'next': next_cursor,
+        'watermark': sync.to_millis(watermark),
+        'deleted': deleted,
+    }
+    return body, [to_row(doc.id, doc.to_dict()) for doc in docs]
+
+
+def _respond(body):
+    response = jsonify(body)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _listing_row(doc_id, item):
+    return [doc_id, sync.to_millis(item.get('updated_at')), item.get('name'), item.get('price'),
+            item.get('unit'), item.get('location'), item.get('category'), item.get('seller'),
+            item.get('seller_phone'), item.get('thumb') or item.get('image')]
+
+
+@api.route('/listings')
+def listings_feed():
+    since, cursor, limit, error = _page_args()
+    if error:
+        return error
+    try:
+        body, rows = _sync_page(listings.COLLECTION, 'updated_at', listings.CARD_FIELDS, _listing_row,
+                                since, cursor, limit)
+    except sync.ResetRequired:
+        return _respond({'v': API_VERSION, 'reset': True})
+    body.update(fields=LISTING_FIELDS, rows=rows)
+    return _respond(body)
+
+
+@api.route('/posts')
+def posts_feed():
+    since, cursor, limit, error = _page_args()
+    if error:
+        return error
+    try:
+        body, posts = _sync_page(feed.COLLECTION, 'timestamp', feed.FEED_FIELDS,
+                                 lambda doc_id, post: dict(post, id=doc_id), since, cursor, limit)
+    except sync.ResetRequired:
+        return _respond({'v': API_VERSION, 'reset': True})
+    engagement.apply_counts(posts)
+    rows = [[post['id'], sync.to_millis(post.get('timestamp')), post.get('author'), post.get('title'),
+             post.get('content'), post.get('tag'), post.get('avatar'), post['likes'], post['comment_count']]
+            for post in posts]
+    body.update(fields=POST_FIELDS, rows=rows)
+    if not cursor:
+        body['heroes'] = [[hero['full_name'], hero['score']] for hero in feed.get_heroes()]
+    return _respond(body)
+
+
+@api.route('/posts/counts')
+def post_counts():
+    """Fresh like and comment counts for posts the client already has."""
+    ids = [post_id for post_id in request.args.get('ids', '').split(',') if post_id][:MAX_COUNT_IDS]
+    counts = engagement.get_counts(ids)
+    return _respond({
+        'v': API_VERSION,
+        'fields': ['likes', 'comments'],
+        'counts': {post_id: [c['likes'], c['comments']] for post_id, c in counts.items()},
+    })
+
+
+@api.route('/batch', methods=['POST'])
+def batch():
+    """Apply ``{"ops": [...]}``; answers ``{"results": [...]}`` in the same order."""
+    data = request.get_json(silent=True)
+    ops = data.get('ops') if isinstance(data, dict) else None
+    if not isinstance(ops, list) or len(ops) > outbox.MAX_OPS:
+        return jsonify({'v': API_VERSION, 'error': f'ops must be a list of at most {outbox.MAX_OPS} operations'}), 400
+    try:
+        results = outbox.apply(ops, session.get('user'), session.get('user_name'))
+    except Exception as e:
+        # Nothing was applied; the client keeps its queue and retries
+        print(f"Error applying batch: {e}")
+        return jsonify({'v': API_VERSION, 'error': 'Batch not applied, try again later'}), 503
+    return _respond({'v': API_VERSION, 'results': results})
+
+
+def _mandi_response(build):
+    """Answer with ``build()``, or 304 while the price store is unchanged."""
+    store = mandi.current()
+    if store is None:
+        return jsonify({'v': API_VERSION, 'error': 'No mandi prices loaded'}), 404
+    try:
+        body = build()
+    except mandi.UnknownName as e:
+        return jsonify({'v': API_VERSION, 'error': f"No prices for {e.args[0]}"}), 404
+    response = jsonify(dict(body, v=API_VERSION))
+    response.set_etag(f"{store.id}:{request.query_string.decode()}")
+    response.cache_control.public = True
+    response.cache_control.max_age = MANDI_MAX_AGE
+    return response.make_conditional(request)
+
+
+@api.route('/mandi/commodities')
+def mandi_commodities():
+    return _mandi_response(lambda: {'commodities': mandi.commodities()})
+
+
+@api.route('/mandi/markets')
+def mandi_markets():
+    return _mandi_response(lambda: {'markets': mandi.markets(request.args.get('commodity', ''))})
+
+
+@api.route('/mandi/trend')
+def mandi_trend():
+    return _mandi_response(lambda: mandi.trend(
+        request.args.get('commodity', ''), request.args.get('market') or None,
+        days=request.args.get('days', 90, type=int), window=request.args.get('window', 7, type=int)))
+
+
+@api.route('/mandi/compare')
+def mandi_compare():
+    return _mandi_response(lambda: mandi.compare(
+        request.args.get('commodity', ''), request.args.get('market', ''),
+        limit=min(50, request.args.get('limit', 10, type=int))))
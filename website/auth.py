@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify, session
-from . import db
+from . import stats, users
 from firebase_admin import firestore
 
 auth = Blueprint ('auth', __name__)
@@ -14,17 +14,11 @@ def login():
         return jsonify ({'success': False, 'message': 'Missing data'}), 400
     
     try:
-        users_ref= db.collection('users')
-        query = users_ref.where ('phone_number','==',phone).stream()
-
-        user_found = None
-        for doc in query:
-            user_found = doc.to_dict()
-            break
+        user_found = users.fetch(phone)
 
         if user_found:
             if user_found.get('password')== password:
-                session ['user']= phone
+                session ['user']= users.normalize_phone(phone)
                 session ['user_name']= user_found.get('full_name','Farmer')
                 return jsonify ({
                 'success': True,
@@ -51,22 +45,22 @@ def signup():
     if not phone or not password or not full_name:
         return jsonify ({'success': False, 'message': 'Missing required fields'}), 400
 
-    try:
-        users_ref= db.collection('users')
+    if not users.normalize_phone(phone):
+        return jsonify ({'success': False, 'message': 'Invalid phone number'}), 400
 
-        docs= users_ref.where('phone_number','==',phone).stream()
-        if any(docs):
-            return jsonify ({'success': False, 'message': 'User already exists'}),400
-        
+    try:
         new_user={
-            'phone_number': phone,
             'password': password,
             'full_name': full_name,
             'dob': dob,
             'role':'Farmer',
             'created_at': firestore.SERVER_TIMESTAMP
         }
-        users_ref.add(new_user)
+        try:
+            phone = users.create(phone, new_user)
+        except users.UserExists:
+            return jsonify ({'success': False, 'message': 'User already exists'}),400
+        stats.increment('farmers')
 
         session ['user']= phone 
         session['user_name']= full_name
@@ -0,0 +1,235 @@
+"""Content-addressed storage for uploaded files.
+
+A file is stored once under the SHA-256 of its bytes (``<hash>.<ext>``), so
+two identical listing photos share one file and two uploads called
+``photo.jpg`` no longer overwrite each other. ``put`` streams its source to
+a temporary file in chunks while hashing it, then moves it into place, or
+drops it if that content is already stored.
+
+Listings reference files by URL (``/media/<key>``). Each referenced key has
+a ``blobs/<key>`` document whose ``refs`` counter is changed in the same
+batch as the listing write (``retain`` / ``release``). ``collect`` deletes a
+file once nothing refers to it, which ``delete_item`` does straight away;
+``flask gc-blobs`` also sweeps files that were stored but never referenced
+(a listing write that failed after its upload). A file touched within
+``GRACE`` is never deleted, since an upload of the same content may be
+about to reference it.
+
+The store is chosen with ``BLOB_BACKEND``: ``local`` (files under
+``BLOB_DIR``) or ``memory`` (the default with ``DATA_BACKEND=memory``).
+Another backend (object storage) only needs ``put``, ``exists``,
+``delete``, ``age`` and ``keys`` and a way to serve, see ``media``.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+
+import click
+from firebase_admin import firestore
+
+from . import db
+from .firebase import data_backend
+
+COLLECTION = 'blobs'
+CHUNK_SIZE = 1024 * 1024
+GRACE = 3600  # seconds
+KEY_PATTERN = re.compile(r'[0-9a-f]{64}\.[a-z0-9]{1,5}')
+URL_PREFIX = '/media/'
+MIME_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif'}
+
+
+class LocalStore:
+    """Files under ``root``, fanned out as ``ab/<key>``."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, source, extension):
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.root, prefix='.upload-', delete=False) as tmp:
+            try:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+        key = f"{digest.hexdigest()}.{extension}"
+        path = self.path(key)
+        if os.path.exists(path):
+            os.unlink(tmp.name)
+            os.utime(path)  # keep it out of a running collection
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp.name, 0o644)
+            os.replace(tmp.name, path)
+        return key
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def age(self, key):
+        """Seconds since the file was last stored, or None if it isn't."""
+        try:
+            return time.time() - os.path.getmtime(self.path(key))
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self):
+        if not os.path.isdir(self.root):
+            return
+        for fanout in os.listdir(self.root):
+            folder = os.path.join(self.root, fanout)
+            if os.path.isdir(folder):
+                yield from (name for name in os.listdir(folder) if KEY_PATTERN.fullmatch(name))
+
+
+class MemoryStore:
+    """A stand-in kept in this process, for local runs and benchmarks."""
+
+    def __init__(self):
+        self._blobs = {}  # key -> (data, stored_at)
+        self._lock = threading.Lock()
+
+    def put(self, source, extension):
+        digest, chunks = hashlib.sha256(), []
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            chunks.append(chunk)
+        key = f"{digest.hexdigest()}.{extension}"
+        with self._lock:
+            data = self._blobs[key][0] if key in self._blobs else b''.join(chunks)
+            self._blobs[key] = (data, time.time())
+        return key
+
+    def get(self, key):
+        with self._lock:
+            blob = self._blobs.get(key)
+        return blob[0] if blob else None
+
+    def exists(self, key):
+        return key in self._blobs
+
+    def age(self, key):
+        with self._lock:
+            blob = self._blobs.get(key)
+        return time.time() - blob[1] if blob else None
+
+    def delete(self, key):
+        with self._lock:
+            self._blobs.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            return list(self._blobs)
+
+
+def _open_store():
+    backend = os.environ.get('BLOB_BACKEND') or ('memory' if data_backend() == 'memory' else 'local')
+    if backend == 'memory':
+        return MemoryStore()
+    return LocalStore(os.environ.get('BLOB_DIR', os.path.join(os.path.dirname(__file__), 'blob_data')))
+
+
+store = _open_store()
+
+
+def put(source, extension):
+    """Store ``source`` (bytes or a binary file object). Returns its key."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return store.put(source, extension)
+
+
+def url(key):
+    return URL_PREFIX + key
+
+
+def key_from_url(value):
+    """The key a ``/media/`` URL points at, or None for any other URL."""
+    if isinstance(value, str) and value.startswith(URL_PREFIX):
+        key = value[len(URL_PREFIX):]
+        if KEY_PATTERN.fullmatch(key):
+            return key
+    return None
+
+
+def listing_keys(item):
+    """Keys of the stored files a listing shows."""
+    return {key for key in (key_from_url(item.get(field)) for field in ('image', 'thumb')) if key}
+
+
+def _change(batch, keys, amount):
+    for key in keys:
+        batch.set(db.collection(COLLECTION).document(key), {
+            'refs': firestore.Increment(amount),
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        }, merge=True)
+
+
+def retain(batch, keys):
+    """Queue one more reference to each of ``keys`` in ``batch``."""
+    _change(batch, keys, 1)
+
+
+def release(batch, keys):
+    """Queue dropping one reference to each of ``keys``; ``collect`` them after commit."""
+    _change(batch, keys, -1)
+
+
+def collect(keys):
+    """Delete the files among ``keys`` that nothing refers to. Returns the keys deleted."""
+    deleted = []
+    for key in keys:
+        if (store.age(key) or 0) < GRACE and store.exists(key):
+            continue
+        ref = db.collection(COLLECTION).document(key)
+
+        @firestore.transactional
+        def _unreferenced(transaction):
+            doc = ref.get(transaction=transaction)
+            if doc.exists and doc.to_dict().get('refs', 0) > 0:
+                return False
+            transaction.delete(ref)
+            return True
+
+        try:
+            if _unreferenced(db.transaction()):
+                store.delete(key)
+                deleted.append(key)
+        except Exception as e:
+            print(f"Error collecting blob {key}: {e}")
+    return deleted
+
+
+def sweep():
+    """Collect every stored file without references. Returns ``(checked, deleted)``."""
+    candidates = [key for key in store.keys() if (store.age(key) or 0) >= GRACE]
+    unreferenced = []
+    for start in range(0, len(candidates), 100):
+        refs = [db.collection(COLLECTION).document(key) for key in candidates[start:start + 100]]
+        for doc in db.get_all(refs):
+            if not doc.exists or doc.to_dict().get('refs', 0) <= 0:
+                unreferenced.append(doc.id)
+    return len(candidates), len(collect(unreferenced))
+
+
+@click.command('gc-blobs')
+def gc_command():
+    """Delete uploaded files that no listing refers to."""
+    checked, deleted = sweep()
+    click.echo(f"Checked {checked} files, deleted {deleted}")
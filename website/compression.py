@@ -0,0 +1,110 @@
+"""Brotli/gzip compression of text responses.
+
+Rendered pages and JSON are compressed per response. Static text files are
+compressed once per fingerprint and kept in memory, since they are the same
+bytes for every visitor. Brotli is used when the client accepts it and the
+``brotli`` package is installed, gzip otherwise.
+
+Streamed responses (SSE, NDJSON) are left alone: compressing them would
+hold events back until a compressor block fills.
+"""
+import gzip
+import threading
+
+from flask import request
+from werkzeug.security import safe_join
+
+from . import http_cache
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+MIN_SIZE = 500  # bytes; smaller bodies don't win enough to pay for the headers
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5       # dynamic responses: fast enough to do per request
+STATIC_BROTLI_QUALITY = 11
+COMPRESSIBLE = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'text/csv', 'text/xml',
+    'application/javascript', 'application/json', 'application/manifest+json',
+    'application/xml', 'image/svg+xml',
+}
+
+_static_cache = {}  # (filename, fingerprint, encoding) -> compressed bytes
+_static_lock = threading.Lock()
+
+
+def choose_encoding():
+    """Pick 'br', 'gzip' or None from the request's Accept-Encoding."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, static=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if static else GZIP_LEVEL)
+
+
+def _static_body(static_folder, encoding):
+    filename = (request.view_args or {}).get('filename')
+    fingerprint = http_cache.fingerprint(filename)
+    path = safe_join(static_folder, filename) if filename else None
+    if fingerprint is None or path is None:
+        return None
+    key = (filename, fingerprint, encoding)
+    with _static_lock:
+        body = _static_cache.get(key)
+    if body is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        body = compress(data, encoding, static=True)
+        with _static_lock:
+            _static_cache[key] = body
+    return body
+
+
+def _compress_response(response, static_folder):
+    if (response.status_code != 200 or response.is_streamed and not response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.direct_passthrough:
+        # A file from send_file: only static files we have fingerprinted
+        if request.endpoint != 'static':
+            return response
+        body = _static_body(static_folder, encoding)
+        if body is None:
+            return response
+        response.close()
+        response.direct_passthrough = False
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        body = compress(data, encoding)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # Same content, different bytes: a strong ETag would be a lie now
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    static_folder = app.static_folder
+
+    @app.after_request
+    def _compress(response):
+        return _compress_response(response, static_folder)
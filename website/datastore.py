@@ -0,0 +1,1187 @@
+"""Local stand-in for the Firestore client.
+
+``LocalClient`` implements the part of the google-cloud-firestore API the
+app uses: documents, collections and collection groups; ``where``,
+``order_by``, ``limit``, ``offset``, ``select`` and cursors; ``count()``;
+batches, transactions and ``on_snapshot`` listeners; and the write
+transforms (``Increment``, ``ArrayUnion``, ``SERVER_TIMESTAMP``,
+``DELETE_FIELD`` ...). Queries follow Firestore's rules: values of mixed
+types order by type first, documents missing an ordered field are left
+out, and the document name breaks ties.
+
+Two stores sit underneath. ``MemoryStore`` is per process and starts
+empty. ``SqliteStore`` is a file shared by every worker on the host;
+listeners only see writes made by their own process.
+
+Every query is checked against ``firestore.indexes.json`` the way Firestore
+would check it. A query that needs an undeclared composite index fails with
+``FailedPrecondition``. Reads and writes are billed the way Firestore bills
+them, and ``track()`` collects them, with each query's plan, for a block of
+code such as one request. ``TrackedClient`` wraps the real client so its
+RPCs are collected the same way.
+
+Select it with ``DATA_BACKEND=memory`` or ``DATA_BACKEND=sqlite``
+(``LOCAL_DB_PATH`` sets the file).
+"""
+import base64
+import contextvars
+import copy
+import enum
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+ASCENDING = 'ASCENDING'
+DESCENDING = 'DESCENDING'
+MAX_BATCH_WRITES = 500
+MAX_IN_VALUES = 30
+DB_PATH = os.environ.get('LOCAL_DB_PATH', os.path.join(os.path.dirname(__file__), 'local_datastore.sqlite3'))
+INDEXES_PATH = os.environ.get('FIRESTORE_INDEXES', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'firestore.indexes.json'))
+
+EQUALITY_OPS = ('==', 'in')
+CONTAINS_OPS = ('array_contains', 'array_contains_any')
+RANGE_OPS = ('<', '<=', '>', '>=', '!=', 'not-in')
+NAME = '__name__'
+
+_MISSING = object()
+
+
+# --- Values ---
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _coerce(value):
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    if isinstance(value, (list, tuple)):
+        return [_coerce(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _coerce(v) for k, v in value.items()}
+    return value
+
+
+def _key(value):
+    """Sort key putting values in Firestore's cross-type order."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if _is_number(value):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, _coerce(value).timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    if isinstance(value, DocumentReference):
+        return (6, value.path)
+    if isinstance(value, (list, tuple)):
+        return (8, tuple(_key(v) for v in value))
+    if isinstance(value, dict):
+        return (9, tuple((k, _key(v)) for k, v in sorted(value.items())))
+    return (10, str(value))
+
+
+def _cmp(a, b):
+    ka, kb = _key(a), _key(b)
+    return (ka > kb) - (ka < kb)
+
+
+def _transform(old, value):
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.Increment):
+        return (old if _is_number(old) else 0) + value.value
+    if isinstance(value, transforms.Maximum):
+        return max(old, value.value) if _is_number(old) else value.value
+    if isinstance(value, transforms.Minimum):
+        return min(old, value.value) if _is_number(old) else value.value
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(old) if isinstance(old, list) else []
+        for v in value.values:
+            if all(_key(v) != _key(x) for x in result):
+                result.append(_coerce(v))
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        removed = {_key(v) for v in value.values}
+        return [x for x in old if _key(x) not in removed] if isinstance(old, list) else []
+    return _coerce(value)
+
+
+def _merge(base, updates):
+    """Apply ``set`` data onto ``base``, merging nested maps."""
+    for name, value in updates.items():
+        if value is transforms.DELETE_FIELD:
+            base.pop(name, None)
+        elif isinstance(value, dict):
+            target = base.get(name)
+            base[name] = _merge(dict(target) if isinstance(target, dict) else {}, value)
+        else:
+            base[name] = _transform(base.get(name), value)
+    return base
+
+
+def _update(base, updates):
+    """Apply ``update`` data (dotted field paths) onto ``base``."""
+    for path, value in updates.items():
+        *parents, leaf = path.split('.')
+        node = base
+        for part in parents:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = {}
+            node[part] = child = dict(child)
+            node = child
+        if value is transforms.DELETE_FIELD:
+            node.pop(leaf, None)
+        elif isinstance(value, dict):
+            node[leaf] = _merge({}, value)
+        else:
+            node[leaf] = _transform(node.get(leaf), value)
+    return base
+
+
+def _field(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return _MISSING
+        data = data[part]
+    return data
+
+
+def _project(data, field_paths):
+    result = {}
+    for path in field_paths:
+        value = _field(data, path)
+        if value is _MISSING:
+            continue
+        *parents, leaf = path.split('.')
+        node = result
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[leaf] = value
+    return result
+
+
+def _matches(value, op, target):
+    if value is _MISSING:
+        return False
+    if op == '==':
+        return _key(value) == _key(target)
+    if op == '!=':
+        return value is not None and _key(value) != _key(target)
+    if op == 'in':
+        return any(_key(value) == _key(t) for t in target)
+    if op == 'not-in':
+        return value is not None and all(_key(value) != _key(t) for t in target)
+    if op == 'array_contains':
+        return isinstance(value, list) and any(_key(v) == _key(target) for v in value)
+    if op == 'array_contains_any':
+        wanted = {_key(t) for t in target}
+        return isinstance(value, list) and any(_key(v) in wanted for v in value)
+    kv, kt = _key(value), _key(target)
+    if kv[0] != kt[0]:
+        return False  # range filters only match values of the same type
+    return {'<': kv < kt, '<=': kv <= kt, '>': kv > kt, '>=': kv >= kt}[op]
+
+
+# --- Usage tracking ---
+
+class Usage:
+    """RPCs, reads, writes and query plans billed while it was being tracked."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, keep_plans=True):
+        self.rpcs = 0
+        self.reads = 0
+        self.writes = 0
+        self.queries = 0
+        self.seconds = 0.0
+        self.plans = [] if keep_plans else None
+
+    def add(self, reads=0, writes=0, plan=None, seconds=0.0, rpc=True):
+        with self._lock:
+            self.rpcs += int(rpc)
+            self.reads += reads
+            self.writes += writes
+            self.seconds += seconds
+            if plan is not None:
+                self.queries += 1
+                if self.plans is not None:
+                    self.plans.append(plan)
+
+    def as_dict(self):
+        data = {'rpcs': self.rpcs, 'reads': self.reads, 'writes': self.writes,
+                'queries': self.queries, 'seconds': round(self.seconds, 6)}
+        if self.plans is not None:
+            data['plans'] = list(self.plans)
+        return data
+
+
+_tracked = contextvars.ContextVar('datastore_usage', default=())
+
+
+@contextmanager
+def track():
+    """Collect the reads, writes and plans of everything run in the block."""
+    usage = Usage()
+    token = _tracked.set(_tracked.get() + (usage,))
+    try:
+        yield usage
+    finally:
+        _tracked.reset(token)
+
+
+def record(reads=0, writes=0, plan=None, seconds=0.0, rpc=True):
+    """Bill one RPC (or, with ``rpc=False``, just its reads and writes) to
+    every ``track()`` block that is open."""
+    for usage in _tracked.get():
+        usage.add(reads, writes, plan, seconds, rpc)
+
+
+class _Tracked:
+    """Wraps a google-cloud-firestore object, forwarding what it doesn't count."""
+
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __repr__(self):
+        return f"<tracked {self._wrapped!r}>"
+
+
+def _unwrap(value):
+    return value._wrapped if isinstance(value, _Tracked) else value
+
+
+def _timed(function, *args, reads=0, writes=0, **kwargs):
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        record(reads=reads, writes=writes, seconds=time.perf_counter() - start)
+
+
+def _streamed(results, count=lambda item: 1):
+    # Times include the caller's work between documents
+    start = time.perf_counter()
+    reads = 0
+    try:
+        for item in results:
+            reads += count(item)
+            yield item
+    finally:
+        record(reads=max(1, reads), seconds=time.perf_counter() - start)
+
+
+def _aggregation_reads(results):
+    # Aggregations bill one read per 1000 index entries
+    return sum(-(-int(r.value) // 1000) for r in results if isinstance(r.value, (int, float)))
+
+
+class _TrackedQuery(_Tracked):
+    def _chain(self, name, *args, **kwargs):
+        return _TrackedQuery(getattr(self._wrapped, name)(*args, **kwargs))
+
+    def where(self, *args, **kwargs): return self._chain('where', *args, **kwargs)
+    def order_by(self, *args, **kwargs): return self._chain('order_by', *args, **kwargs)
+    def select(self, *args, **kwargs): return self._chain('select', *args, **kwargs)
+    def limit(self, *args, **kwargs): return self._chain('limit', *args, **kwargs)
+    def limit_to_last(self, *args, **kwargs): return self._chain('limit_to_last', *args, **kwargs)
+    def offset(self, *args, **kwargs): return self._chain('offset', *args, **kwargs)
+    def start_at(self, document_fields): return self._chain('start_at', _unwrap(document_fields))
+    def start_after(self, document_fields): return self._chain('start_after', _unwrap(document_fields))
+    def end_at(self, document_fields): return self._chain('end_at', _unwrap(document_fields))
+    def end_before(self, document_fields): return self._chain('end_before', _unwrap(document_fields))
+
+    def count(self, *args, **kwargs):
+        return _TrackedAggregation(self._wrapped.count(*args, **kwargs))
+
+    def stream(self, transaction=None, **kwargs):
+        return _streamed(self._wrapped.stream(transaction=_unwrap(transaction), **kwargs))
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction=transaction, **kwargs))
+
+
+class _TrackedAggregation(_Tracked):
+    def stream(self, transaction=None, **kwargs):
+        return _streamed(self._wrapped.stream(transaction=_unwrap(transaction), **kwargs), _aggregation_reads)
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction=transaction, **kwargs))
+
+
+class _TrackedCollection(_TrackedQuery):
+    def document(self, *args, **kwargs):
+        return _TrackedDocument(self._wrapped.document(*args, **kwargs))
+
+
+class _TrackedDocument(_Tracked):
+    def collection(self, *args, **kwargs):
+        return _TrackedCollection(self._wrapped.collection(*args, **kwargs))
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        return _timed(self._wrapped.get, field_paths=field_paths, transaction=_unwrap(transaction), reads=1, **kwargs)
+
+    def set(self, *args, **kwargs): return _timed(self._wrapped.set, *args, writes=1, **kwargs)
+    def create(self, *args, **kwargs): return _timed(self._wrapped.create, *args, writes=1, **kwargs)
+    def update(self, *args, **kwargs): return _timed(self._wrapped.update, *args, writes=1, **kwargs)
+    def delete(self, *args, **kwargs): return _timed(self._wrapped.delete, *args, writes=1, **kwargs)
+
+
+class _TrackedBatch(_Tracked):
+    """Counts the writes queued and records them when the batch commits."""
+
+    def __init__(self, wrapped):
+        super().__init__(wrapped)
+        self._writes = 0
+
+    def _queue(self, name, reference, *args, **kwargs):
+        self._writes += 1
+        return getattr(self._wrapped, name)(_unwrap(reference), *args, **kwargs)
+
+    def set(self, reference, *args, **kwargs): return self._queue('set', reference, *args, **kwargs)
+    def create(self, reference, *args, **kwargs): return self._queue('create', reference, *args, **kwargs)
+    def update(self, reference, *args, **kwargs): return self._queue('update', reference, *args, **kwargs)
+    def delete(self, reference, *args, **kwargs): return self._queue('delete', reference, *args, **kwargs)
+
+    def __len__(self):
+        return self._writes
+
+    def commit(self, *args, **kwargs):
+        return _timed(self._wrapped.commit, *args, writes=self._writes, **kwargs)
+
+
+class _TrackedTransaction(_TrackedBatch):
+    """``firestore.transactional`` commits the transaction itself, so writes
+    are recorded as they are queued (again on a retried attempt), without
+    an RPC or time of their own."""
+
+    def _queue(self, name, reference, *args, **kwargs):
+        record(writes=1, rpc=False)
+        return getattr(self._wrapped, name)(_unwrap(reference), *args, **kwargs)
+
+    def get_all(self, references, *args, **kwargs):
+        return _streamed(self._wrapped.get_all([_unwrap(ref) for ref in references], *args, **kwargs))
+
+    def get(self, ref_or_query, *args, **kwargs):
+        return _streamed(self._wrapped.get(_unwrap(ref_or_query), *args, **kwargs))
+
+
+class TrackedClient(_Tracked):
+    """A google-cloud-firestore client whose RPCs are reported to ``track()``,
+    so routes are measured the same way on either backend.
+
+    Only the client's public API is wrapped: every collection, document,
+    query, batch and transaction obtained through it reports its own
+    reads and writes. References taken from a snapshot (``doc.reference``)
+    are the library's own and go uncounted.
+    """
+
+    def collection(self, *args, **kwargs):
+        return _TrackedCollection(self._wrapped.collection(*args, **kwargs))
+
+    def collection_group(self, *args, **kwargs):
+        return _TrackedQuery(self._wrapped.collection_group(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return _TrackedDocument(self._wrapped.document(*args, **kwargs))
+
+    def get_all(self, references, *args, transaction=None, **kwargs):
+        return _streamed(self._wrapped.get_all([_unwrap(ref) for ref in references], *args,
+                                               transaction=_unwrap(transaction), **kwargs))
+
+    def batch(self):
+        return _TrackedBatch(self._wrapped.batch())
+
+    def transaction(self, **kwargs):
+        return _TrackedTransaction(self._wrapped.transaction(**kwargs))
+
+
+# --- Index checking ---
+
+def load_indexes(path=INDEXES_PATH):
+    """Return ``(composite, overrides)`` declared in a Firestore indexes file."""
+    try:
+        with open(path) as f:
+            spec = json.load(f)
+    except FileNotFoundError:
+        return [], set()
+    composite = []
+    for index in spec.get('indexes', []):
+        fields = tuple((f['fieldPath'], f.get('order') or 'CONTAINS')
+                       for f in index['fields'] if f['fieldPath'] != NAME)
+        composite.append((index['collectionGroup'], index.get('queryScope', 'COLLECTION'), fields))
+    overrides = set()
+    for override in spec.get('fieldOverrides', []):
+        for index in override.get('indexes', []):
+            overrides.add((override['collectionGroup'], override['fieldPath'],
+                           index.get('queryScope', 'COLLECTION'), index.get('order') or 'CONTAINS'))
+    return composite, overrides
+
+
+def _describe(fields):
+    return ', '.join(f"{field} {mode}" for field, mode in fields)
+
+
+def _choose_index(query, composite, overrides):
+    """Return ``(description, missing)`` for the index Firestore would use."""
+    group = query._collection_id
+    scope = 'COLLECTION_GROUP' if query._all_descendants else 'COLLECTION'
+    equality, contains = [], []
+    for field, op, _ in query._filters:
+        if field == NAME:
+            continue
+        target = contains if op in CONTAINS_OPS else equality if op in EQUALITY_OPS else None
+        if target is not None and field not in target:
+            target.append(field)
+    sort = [(f, d) for f, d in query._effective_orders() if f != NAME and f not in equality]
+
+    if not sort or len(set(equality) | set(contains) | {f for f, _ in sort}) == 1:
+        # Served by automatic single-field indexes, merged for several equalities
+        if scope == 'COLLECTION':
+            return 'single-field', False
+        needed = [(f, ('CONTAINS',)) for f in contains] + [(f, (ASCENDING, DESCENDING)) for f in equality]
+        needed += [(f, (d,)) for f, d in sort]
+        missing = [f for f, modes in needed
+                   if not any((group, f, scope, m) in overrides for m in modes)]
+        return 'single-field', bool(missing)
+
+    flipped = [(f, ASCENDING if d == DESCENDING else DESCENDING) for f, d in sort]
+    prefix = set(equality) | set(contains)
+    for index_group, index_scope, fields in composite:
+        if index_group != group or index_scope != scope or len(fields) != len(prefix) + len(sort):
+            continue
+        head, tail = fields[:len(prefix)], list(fields[len(prefix):])
+        if {f for f, _ in head} != prefix:
+            continue
+        if any((mode == 'CONTAINS') != (f in contains) for f, mode in head):
+            continue
+        if tail == sort or tail == flipped:
+            return f"composite({_describe(fields)})", False
+    wanted = [(f, 'CONTAINS') for f in contains] + [(f, ASCENDING) for f in equality] + sort
+    return f"composite({_describe(wanted)})", True
+
+
+# --- Snapshots and references ---
+
+class ChangeType(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+
+class DocumentChange:
+    def __init__(self, type, document, old_index, new_index):
+        self.type = type
+        self.document = document
+        self.old_index = old_index
+        self.new_index = new_index
+
+
+class AggregationResult:
+    def __init__(self, alias, value, read_time=None):
+        self.alias = alias
+        self.value = value
+        self.read_time = read_time
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.read_time = read_time or _now()
+        self.create_time = self.update_time = None
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        if field_path == NAME:
+            return self.reference
+        value = _field(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"<DocumentReference {self.path}>"
+
+    def collection(self, collection_id):
+        return CollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None):
+        return next(self._client.get_all([self], field_paths=field_paths))
+
+    def set(self, document_data, merge=False):
+        return self._client._commit([('set', self.path, document_data, merge)])[0]
+
+    def update(self, field_updates):
+        return self._client._commit([('update', self.path, field_updates, False)])[0]
+
+    def create(self, document_data):
+        return self._client._commit([('create', self.path, document_data, False)])[0]
+
+    def delete(self):
+        return self._client._commit([('delete', self.path, None, False)])[0]
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class AggregateQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias or 'field_1'
+
+    def get(self, transaction=None):
+        query = self._query
+        start = time.perf_counter()
+        plan = query._check()
+        count = len(query._execute())
+        # Aggregations bill one read per 1000 index entries
+        reads = max(1, -(-count // 1000))
+        query._client._charge(reads=reads, plan=dict(plan, aggregation='count', reads=reads),
+                              seconds=time.perf_counter() - start)
+        return [[AggregationResult(self._alias, count)]]
+
+    stream = get
+
+
+class Query:
+    def __init__(self, client, collection_path, all_descendants=False):
+        self._client = client
+        self._path = collection_path
+        self._collection_id = collection_path.rsplit('/', 1)[-1]
+        self._all_descendants = all_descendants
+        self._filters = ()
+        self._orders = ()
+        self._limit = None
+        self._offset = 0
+        self._projection = None
+        self._start = None
+        self._end = None
+
+    def _copy(self, **changes):
+        query = Query.__new__(Query)
+        query.__dict__.update(self.__dict__)
+        for name, value in changes.items():
+            setattr(query, f"_{name}", value)
+        return query
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in EQUALITY_OPS + CONTAINS_OPS + RANGE_OPS:
+            raise ValueError(f"Operator string {op_string!r} is invalid")
+        if op_string in ('in', 'not-in', 'array_contains_any') and len(value) > MAX_IN_VALUES:
+            raise exceptions.InvalidArgument(f"'{op_string}' filters support a maximum of {MAX_IN_VALUES} elements")
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        if direction not in (ASCENDING, DESCENDING):
+            raise ValueError(f"Invalid direction {direction!r}")
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def select(self, field_paths):
+        return self._copy(projection=tuple(field_paths))
+
+    def start_at(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, True))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, False))
+
+    def end_before(self, document_fields_or_snapshot):
+        return self._copy(end=(document_fields_or_snapshot, True))
+
+    def end_at(self, document_fields_or_snapshot):
+        return self._copy(end=(document_fields_or_snapshot, False))
+
+    def count(self, alias=None):
+        return AggregateQuery(self, alias)
+
+    def _effective_orders(self):
+        orders = list(self._orders)
+        ordered = {f for f, _ in orders}
+        for field, op, _ in self._filters:
+            if op in RANGE_OPS and field not in ordered:
+                # Firestore orders by inequality fields implicitly
+                orders.append((field, ASCENDING))
+                ordered.add(field)
+        if NAME not in ordered:
+            orders.append((NAME, orders[-1][1] if orders else ASCENDING))
+        return orders
+
+    def _check(self):
+        return self._client._plan(self)
+
+    def _cursor_values(self, cursor, orders):
+        spec, _ = cursor
+        if isinstance(spec, DocumentSnapshot):
+            return [spec.reference.path if f == NAME else _field(spec._data or {}, f) for f, _ in orders]
+        if isinstance(spec, dict):
+            return [spec[f] for f, _ in orders if f in spec]
+        return list(spec)
+
+    def _execute(self):
+        """Return the matching ``(path, data)`` pairs in query order."""
+        store = self._client._store
+        if self._all_descendants:
+            docs = store.scan_group(self._collection_id)
+        else:
+            docs = store.scan(self._path)
+
+        orders = self._effective_orders()
+        rows = []
+        for path, data in docs:
+            if not all(_matches(path if f == NAME else _field(data, f), op, v) for f, op, v in self._filters):
+                continue
+            values = [path if f == NAME else _field(data, f) for f, _ in orders]
+            if any(v is _MISSING for v in values):
+                continue  # documents without an ordered field are not indexed
+            rows.append((values, path, data))
+
+        directions = [1 if d == ASCENDING else -1 for _, d in orders]
+
+        def compare(values, cursor):
+            for value, bound, direction in zip(values, cursor, directions):
+                result = _cmp(value, bound) * direction
+                if result:
+                    return result
+            return 0
+
+        # Stable passes from the last sort field to the first
+        for i in reversed(range(len(orders))):
+            rows.sort(key=lambda r: _key(r[0][i]), reverse=directions[i] < 0)
+        if self._start is not None:
+            bound, inclusive = self._cursor_values(self._start, orders), self._start[1]
+            rows = [r for r in rows if compare(r[0], bound) > 0 or (inclusive and compare(r[0], bound) == 0)]
+        if self._end is not None:
+            bound, exclusive = self._cursor_values(self._end, orders), self._end[1]
+            rows = [r for r in rows if compare(r[0], bound) < 0 or (not exclusive and compare(r[0], bound) == 0)]
+        rows = rows[self._offset:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return [(path, data) for _, path, data in rows]
+
+    def _snapshot(self, path, data):
+        if self._projection is not None:
+            data = _project(data, self._projection)
+        return DocumentSnapshot(DocumentReference(self._client, path), data)
+
+    def stream(self, transaction=None):
+        start = time.perf_counter()
+        plan = self._check()
+        rows = self._execute()
+        reads = max(1, len(rows))
+        self._client._charge(reads=reads, plan=dict(plan, reads=reads), seconds=time.perf_counter() - start)
+        for path, data in rows:
+            yield self._snapshot(path, data)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def on_snapshot(self, callback):
+        self._check()
+        return self._client._listen(self, callback)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._collection_id
+
+    @property
+    def parent(self):
+        if '/' not in self._path:
+            return None
+        return DocumentReference(self._client, self._path.rsplit('/', 1)[0])
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        result = ref.create(document_data)
+        return result.update_time, ref
+
+    def list_documents(self):
+        return [DocumentReference(self._client, path) for path, _ in self._client._store.scan(self._path)]
+
+
+# --- Writes ---
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def __len__(self):
+        return len(self._ops)
+
+    def set(self, reference, document_data, merge=False):
+        self._ops.append(('set', reference.path, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._ops.append(('create', reference.path, document_data, False))
+
+    def update(self, reference, field_updates):
+        self._ops.append(('update', reference.path, field_updates, False))
+
+    def delete(self, reference):
+        self._ops.append(('delete', reference.path, None, False))
+
+    def commit(self):
+        if len(self._ops) > MAX_BATCH_WRITES:
+            raise exceptions.InvalidArgument(f"maximum {MAX_BATCH_WRITES} writes allowed per request")
+        ops, self._ops = self._ops, []
+        return self._client._commit(ops)
+
+
+class Transaction(WriteBatch):
+    """Serializable: holds the store's write lock from begin to commit.
+
+    Implements the private hooks ``firestore.transactional`` drives, so the
+    same decorated function runs against either backend.
+    """
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+        self._atomic = None
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _begin(self, retry_id=None):
+        self._atomic = self._client._store.atomic()
+        self._atomic.__enter__()
+        self._id = uuid.uuid4().bytes
+
+    def _clean_up(self):
+        self._ops = []
+        self._id = None
+
+    def _release(self, exc_info=(None, None, None)):
+        atomic, self._atomic = self._atomic, None
+        if atomic is not None:
+            atomic.__exit__(*exc_info)
+
+    def _commit(self):
+        try:
+            results = self.commit()
+        except BaseException as e:
+            self._release((type(e), e, e.__traceback__))
+            raise
+        self._release()
+        self._clean_up()
+        return results
+
+    def _rollback(self):
+        self._release((exceptions.Aborted, exceptions.Aborted('rolled back'), None))
+        self._clean_up()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentReference):
+            return self._client.get_all([ref_or_query], transaction=self)
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references):
+        return self._client.get_all(references, transaction=self)
+
+
+class Watch:
+    def __init__(self, client, query, callback):
+        self._client = client
+        self._query = query
+        self._callback = callback
+        self._docs = {}
+        self._started = False
+        self._lock = threading.Lock()
+
+    def covers(self, path):
+        collection = path.rsplit('/', 1)[0]
+        if self._query._all_descendants:
+            return collection.rsplit('/', 1)[-1] == self._query._collection_id
+        return collection == self._query._path
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        rows = self._query._execute()
+        current = {path: data for path, data in rows}
+        order = {path: i for i, (path, _) in enumerate(rows)}
+        old_order = {path: i for i, path in enumerate(self._docs)}
+        changes = []
+        for path, data in current.items():
+            snapshot = self._query._snapshot(path, data)
+            if path not in self._docs:
+                changes.append(DocumentChange(ChangeType.ADDED, snapshot, -1, order[path]))
+            elif self._docs[path] != data:
+                changes.append(DocumentChange(ChangeType.MODIFIED, snapshot, old_order[path], order[path]))
+        for path, data in self._docs.items():
+            if path not in current:
+                snapshot = self._query._snapshot(path, data)
+                changes.append(DocumentChange(ChangeType.REMOVED, snapshot, old_order[path], -1))
+        self._docs = {path: current[path] for path, _ in rows}
+        if not changes and self._started:
+            return
+        self._started = True
+        # Listeners are billed one read per document delivered
+        self._client._charge(reads=max(1, len(changes)))
+        try:
+            self._callback([self._query._snapshot(p, d) for p, d in rows], changes, _now())
+        except Exception as e:
+            print(f"Snapshot listener error: {e}")
+
+    def unsubscribe(self):
+        self._client._unlisten(self)
+
+
+# --- Stores ---
+
+class MemoryStore:
+    """Documents in a dict. Values are replaced, never mutated in place."""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def atomic(self):
+        with self._lock:
+            yield
+
+    def get(self, path):
+        collection, doc_id = path.rsplit('/', 1)
+        with self._lock:
+            return self._collections.get(collection, {}).get(doc_id)
+
+    def put(self, path, data):
+        collection, doc_id = path.rsplit('/', 1)
+        with self._lock:
+            self._collections.setdefault(collection, {})[doc_id] = data
+
+    def delete(self, path):
+        collection, doc_id = path.rsplit('/', 1)
+        with self._lock:
+            self._collections.get(collection, {}).pop(doc_id, None)
+
+    def scan(self, collection):
+        with self._lock:
+            return [(f"{collection}/{doc_id}", data) for doc_id, data in self._collections.get(collection, {}).items()]
+
+    def scan_group(self, collection_id):
+        with self._lock:
+            return [(f"{collection}/{doc_id}", data)
+                    for collection, docs in self._collections.items()
+                    if collection.rsplit('/', 1)[-1] == collection_id
+                    for doc_id, data in docs.items()]
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__bytes__' in obj:
+            return base64.b64decode(obj['__bytes__'])
+    return obj
+
+
+class SqliteStore:
+    """Documents in a SQLite file shared by every worker on the host."""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.RLock()
+
+    def connect(self):
+        # One connection per thread; sqlite3 connections can't be shared
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS documents ('
+                ' collection TEXT NOT NULL, id TEXT NOT NULL, group_id TEXT NOT NULL, data TEXT NOT NULL,'
+                ' PRIMARY KEY (collection, id))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS documents_group ON documents (group_id)')
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def atomic(self):
+        with self._lock:
+            conn = self.connect()
+            depth = self._local.depth
+            if depth == 0:
+                conn.execute('BEGIN IMMEDIATE')
+            self._local.depth = depth + 1
+            try:
+                yield
+            except BaseException:
+                self._local.depth = depth
+                if depth == 0:
+                    conn.execute('ROLLBACK')
+                raise
+            self._local.depth = depth
+            if depth == 0:
+                conn.execute('COMMIT')
+
+    def get(self, path):
+        collection, doc_id = path.rsplit('/', 1)
+        row = self.connect().execute(
+            'SELECT data FROM documents WHERE collection = ? AND id = ?', (collection, doc_id)).fetchone()
+        return json.loads(row[0], object_hook=_decode) if row else None
+
+    def put(self, path, data):
+        collection, doc_id = path.rsplit('/', 1)
+        self.connect().execute(
+            'INSERT OR REPLACE INTO documents (collection, id, group_id, data) VALUES (?, ?, ?, ?)',
+            (collection, doc_id, collection.rsplit('/', 1)[-1], json.dumps(data, default=_encode)),
+        )
+
+    def delete(self, path):
+        collection, doc_id = path.rsplit('/', 1)
+        self.connect().execute('DELETE FROM documents WHERE collection = ? AND id = ?', (collection, doc_id))
+
+    def scan(self, collection):
+        rows = self.connect().execute('SELECT id, data FROM documents WHERE collection = ?', (collection,))
+        return [(f"{collection}/{doc_id}", json.loads(data, object_hook=_decode)) for doc_id, data in rows]
+
+    def scan_group(self, collection_id):
+        rows = self.connect().execute(
+            'SELECT collection, id, data FROM documents WHERE group_id = ?', (collection_id,))
+        return [(f"{collection}/{doc_id}", json.loads(data, object_hook=_decode)) for collection, doc_id, data in rows]
+
+
+# --- Client ---
+
+class LocalClient:
+    def __init__(self, store=None, indexes_path=INDEXES_PATH, strict_indexes=True):
+        self._store = store if store is not None else MemoryStore()
+        self._composite, self._overrides = load_indexes(indexes_path)
+        self.strict_indexes = strict_indexes
+        self.usage = Usage(keep_plans=False)
+        self._plans = {}
+        self._watches = []
+        self._watch_lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._queued = set()
+        self._dispatcher = None
+
+    def collection(self, *path):
+        return CollectionReference(self, '/'.join(path))
+
+    def document(self, *path):
+        return DocumentReference(self, '/'.join(path))
+
+    def collection_group(self, collection_id):
+        return Query(self, collection_id, all_descendants=True)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return Transaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        start = time.perf_counter()
+        snapshots = []
+        for ref in references:
+            data = self._store.get(ref.path)
+            if data is not None and field_paths is not None:
+                data = _project(data, field_paths)
+            snapshots.append(DocumentSnapshot(ref, data))
+        self._charge(reads=len(snapshots), seconds=time.perf_counter() - start)
+        yield from snapshots
+
+    def close(self):
+        pass
+
+    def _charge(self, reads=0, writes=0, plan=None, seconds=0.0):
+        self.usage.add(reads, writes, plan, seconds)
+        record(reads, writes, plan, seconds)
+
+    def _plan(self, query):
+        signature = (query._path, query._all_descendants,
+                     tuple((f, op) for f, op, _ in query._filters), query._orders)
+        plan = self._plans.get(signature)
+        if plan is None:
+            index, missing = _choose_index(query, self._composite, self._overrides)
+            plan = {
+                'collection': query._collection_id,
+                'scope': 'collection_group' if query._all_descendants else 'collection',
+                'filters': [f"{f} {op}" for f, op, _ in query._filters],
+                'order_by': [f"{f} {d}" for f, d in query._orders],
+                'index': index,
+                'missing_index': missing,
+            }
+            self._plans[signature] = plan
+        if plan['missing_index'] and self.strict_indexes:
+            raise exceptions.FailedPrecondition(
+                f"The query requires an index not declared in firestore.indexes.json: {plan['index']}")
+        return plan
+
+    def _apply(self, staged, kind, path, data, merge):
+        old = staged[path] if path in staged else self._store.get(path)
+        if kind == 'create':
+            if old is not None:
+                raise exceptions.AlreadyExists(f"Document already exists: {path}")
+            return _merge({}, data)
+        if kind == 'set':
+            return _merge(dict(old) if merge and old else {}, data)
+        if kind == 'update':
+            if old is None:
+                raise exceptions.NotFound(f"No document to update: {path}")
+            return _update(copy.deepcopy(old), data)
+        return None
+
+    def _commit(self, ops):
+        """Apply writes atomically: all of them or, on error, none."""
+        start = time.perf_counter()
+        with self._store.atomic():
+            staged = {}
+            for kind, path, data, merge in ops:
+                staged[path] = self._apply(staged, kind, path, data, merge)
+            for path, data in staged.items():
+                if data is None:
+                    self._store.delete(path)
+                else:
+                    self._store.put(path, data)
+        self._charge(writes=len(ops), seconds=time.perf_counter() - start)
+        self._notify(staged)
+        update_time = _now()
+        return [WriteResult(update_time) for _ in ops]
+
+    def _listen(self, query, callback):
+        watch = Watch(self, query, callback)
+        with self._watch_lock:
+            self._watches.append(watch)
+        self._schedule([watch])
+        return watch
+
+    def _unlisten(self, watch):
+        with self._watch_lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _notify(self, paths):
+        with self._watch_lock:
+            watches = [w for w in self._watches if any(w.covers(p) for p in paths)]
+        self._schedule(watches)
+
+    def _schedule(self, watches):
+        # Like Firestore, snapshots are delivered on a background thread, so
+        # listener reads and callbacks stay out of the writer's request
+        with self._watch_lock:
+            for watch in watches:
+                if watch not in self._queued:
+                    self._queued.add(watch)
+                    self._pending.put(watch)
+            if watches and self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name='datastore-listeners', daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            watch = self._pending.get()
+            with self._watch_lock:
+                self._queued.discard(watch)
+            try:
+                if watch in self._watches:
+                    watch.refresh()
+            finally:
+                self._pending.task_done()
+
+    def flush_listeners(self):
+        """Block until every pending snapshot has been delivered."""
+        self._pending.join()
+
+
+def connect(backend, path=DB_PATH):
+    """Return a LocalClient for ``memory`` or ``sqlite``."""
+    strict = os.environ.get('LOCAL_STRICT_INDEXES', '1') != '0'
+    if backend == 'memory':
+        return LocalClient(MemoryStore(), strict_indexes=strict)
+    if backend == 'sqlite':
+        return LocalClient(SqliteStore(path), strict_indexes=strict)
+    raise ValueError(f"Unknown data backend: {backend}")
@@ -0,0 +1,147 @@
+"""Crop diagnosis: the model prompt, the model call and the result caches.
+
+Shared by the synchronous ``/api/analyze-crop`` path and the background
+job workers in ``jobs``.
+"""
+import base64
+import os
+
+from . import diagnosis_cache, image_similarity, model_client, model_output
+
+# Bump whenever DIAGNOSIS_PROMPT changes so cached diagnoses are not reused
+PROMPT_VERSION = 1
+DIAGNOSIS_PROMPT = """
+    You are an expert agricultural plant pathologist. Analyze this image of a crop/plant.
+    1. Identify if there is a disease, pest, or if it is healthy.
+    2. If diseased, name the disease and explain the symptoms visible.
+    3. Provide a confidence score (0-100) based on visual clarity.
+    4. Suggest 7 practical treatments or preventative measures.
+    5. Answer with respect to an Indian Farmer. You can use simple language and provide practical solutions with Indian Solution too.
+
+    Return ONLY valid JSON in this format, with no markdown formatting:
+    {
+        "name": "Disease Name or 'Healthy'",
+        "description": "Brief description of the issue.",
+        "confidence": 85,
+        "treatments": ["Treatment 1", "Treatment 2", "Treatment 3", "Treatment 4", "Treatment 5", "Treatment 6", "Treatment 7"]
+    }
+    """
+
+
+class DiagnosisError(Exception):
+    """The model call failed. ``retryable`` marks timeouts, 429s and 5xx;
+    ``unavailable`` means the call was refused locally (circuit open or busy)."""
+
+    def __init__(self, message, retryable=False, unavailable=False):
+        super().__init__(message)
+        self.retryable = retryable
+        self.unavailable = unavailable
+
+
+def find_cached(image_bytes):
+    """Look for an earlier diagnosis of exactly this image, without decoding it.
+
+    Returns ``(result, cache_key)``; ``result`` is None on a miss and the
+    key is what ``remember`` needs afterwards.
+    """
+    cache_key = diagnosis_cache.make_key(image_bytes, PROMPT_VERSION)
+    return diagnosis_cache.get(cache_key), cache_key
+
+
+def find_similar(image_bytes):
+    """Look for an earlier diagnosis of a near-identical photo of the same
+    leaf (recompressed, resized, cropped). This decodes the image, so only
+    call it once ``images.process`` has accepted it.
+
+    Returns ``(result, image_hash)``; ``result`` is None on a miss and the
+    hash is what ``remember`` needs afterwards.
+    """
+    image_hash = image_similarity.dhash(image_bytes)
+    if image_hash is not None:
+        match = image_similarity.find_similar(image_hash, PROMPT_VERSION)
+        if match:
+            similar_key, distance = match
+            cached = diagnosis_cache.get(similar_key)
+            if cached is not None:
+                return dict(cached, similar_image=True, similar_distance=distance), image_hash
+    return None, image_hash
+
+
+def remember(cache_key, image_hash, result):
+    diagnosis_cache.put(cache_key, result)
+    if image_hash is not None:
+        image_similarity.add(image_hash, cache_key)
+
+
+def _request(image_b64, mime_type):
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        raise DiagnosisError('Server configuration error: API key is missing')
+
+    payload = {
+        "contents": [{
+            "parts": [
+                { "text": DIAGNOSIS_PROMPT },
+                { "inline_data": { "mime_type": mime_type, "data": image_b64 } }
+            ]
+        }]
+    }
+    return payload, api_key
+
+
+def _model_error(e):
+    if isinstance(e, model_client.ModelUnavailable):
+        return DiagnosisError(str(e), retryable=True, unavailable=True)
+    return DiagnosisError(str(e), retryable=e.retryable)
+
+
+def call_model(image_b64, mime_type):
+    """Send one image to the model and return the validated diagnosis dict."""
+    payload, api_key = _request(image_b64, mime_type)
+    try:
+        response_data = model_client.generate_content(payload, api_key)
+    except model_client.ModelError as e:
+        raise _model_error(e) from e
+
+    if 'candidates' not in response_data:
+        print("Gemini API Error:", response_data)
+        raise DiagnosisError('AI could not analyze the image')
+
+    # A blocked answer (safety, recitation) has a candidate but no text
+    try:
+        text_response = response_data['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError) as e:
+        reason = (response_data.get('candidates') or [{}])[0].get('finishReason', 'no content')
+        raise DiagnosisError(f'AI could not analyze the image ({reason})') from e
+    try:
+        return model_output.parse(text_response)
+    except ValueError as e:
+        raise DiagnosisError('AI returned an unreadable answer', retryable=True) from e
+
+
+def stream_model(image_b64, mime_type, cache_key, image_hash):
+    """Stream a diagnosis as events.
+
+    Yields ``{'field': ..., 'value': ...}`` and ``{'item': ..., 'value': ...}``
+    as the model writes them (name and confidence come first), then
+    ``{'done': True, 'result': ...}`` with the validated diagnosis, which is
+    also cached. Raises DiagnosisError.
+    """
+    payload, api_key = _request(image_b64, mime_type)
+    parser = model_output.IncrementalParser()
+    try:
+        for text in model_client.stream_generate_content(payload, api_key):
+            yield from parser.feed(text)
+    except model_client.ModelError as e:
+        raise _model_error(e) from e
+
+    try:
+        result = parser.result()
+    except ValueError as e:
+        raise DiagnosisError('AI returned an unreadable answer', retryable=True) from e
+    remember(cache_key, image_hash, result)
+    yield {'done': True, 'result': result}
+
+
+def encode_image(model_image):
+    return base64.b64encode(model_image.data).decode()
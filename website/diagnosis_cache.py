@@ -0,0 +1,124 @@
+"""Cache of crop diagnoses keyed by image content.
+
+The key is the SHA-256 of the decoded image bytes plus the prompt version,
+so a re-submitted photo gets the stored answer back without a model call,
+and changing the prompt invalidates everything at once.
+
+Two tiers: a per-process LRU with TTL in front of a SQLite file that every
+gunicorn worker on the host shares. Set ``DIAGNOSIS_CACHE_DB`` to move the
+file (or to ``:memory:`` to disable sharing).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cachetools import TTLCache
+
+MEMORY_SIZE = 512
+TTL = 7 * 24 * 3600  # seconds
+DB_PATH = os.environ.get('DIAGNOSIS_CACHE_DB', os.path.join(os.path.dirname(__file__), 'diagnosis_cache.sqlite3'))
+
+_memory = TTLCache(maxsize=MEMORY_SIZE, ttl=TTL)
+_lock = threading.Lock()
+_metrics = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+_local = threading.local()
+
+
+def _reset_after_fork():
+    # sqlite connections must not be carried across fork()
+    global _local
+    _local = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def make_key(image_bytes, prompt_version):
+    return f"{prompt_version}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+
+def connect():
+    # One connection per thread; sqlite3 connections can't be shared
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS diagnoses ('
+            ' key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        _local.conn = conn
+    return conn
+
+
+def _count(metric):
+    with _lock:
+        _metrics[metric] += 1
+
+
+def get(key):
+    """Return the cached diagnosis dict for ``key``, or None."""
+    with _lock:
+        result = _memory.get(key)
+    if result is not None:
+        _count('memory_hits')
+        return result
+
+    try:
+        row = connect().execute(
+            'SELECT result FROM diagnoses WHERE key = ? AND created_at > ?',
+            (key, time.time() - TTL),
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Diagnosis cache read error: {e}")
+        _count('errors')
+        row = None
+
+    if row is None:
+        _count('misses')
+        return None
+
+    result = json.loads(row[0])
+    with _lock:
+        _memory[key] = result
+    _count('disk_hits')
+    return result
+
+
+def put(key, result):
+    with _lock:
+        _memory[key] = result
+    try:
+        conn = connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO diagnoses (key, result, created_at) VALUES (?, ?, ?)',
+                (key, json.dumps(result), time.time()),
+            )
+        _count('stores')
+    except sqlite3.Error as e:
+        print(f"Diagnosis cache write error: {e}")
+        _count('errors')
+
+
+def purge_expired():
+    """Delete expired rows from the shared tier, and the similar-image hashes
+    (``image_similarity``) that point at them. Returns the number removed."""
+    conn = connect()
+    cutoff = time.time() - TTL
+    with conn:
+        removed = conn.execute('DELETE FROM diagnoses WHERE created_at <= ?', (cutoff,)).rowcount
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_hashes'").fetchone():
+            removed += conn.execute('DELETE FROM image_hashes WHERE created_at <= ?', (cutoff,)).rowcount
+    return removed
+
+
+def metrics():
+    with _lock:
+        data = dict(_metrics, memory_entries=len(_memory))
+    lookups = data['memory_hits'] + data['disk_hits'] + data['misses']
+    data['hit_rate'] = round((data['memory_hits'] + data['disk_hits']) / lookups, 3) if lookups else 0.0
+    return data
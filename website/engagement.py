@@ -0,0 +1,200 @@
+"""Likes and comments on community posts, kept off the post document.
+
+A post document used to carry every comment in an array and a like counter,
+so popular posts grew toward Firestore's 1 MiB limit and every like or
+comment queued behind the ~1 write/second a single document sustains.
+Now:
+
+* comments are documents in ``community_posts/<id>/comments``, read a page
+  at a time;
+* like and comment counts live in ``community_posts/<id>/counters/<n>``
+  shards, each write bumping one random shard. Every shard carries the
+  ``post_id``, so one collection-group query fetches the counts for a whole
+  feed page.
+
+``flask migrate-engagement`` moves existing posts to this layout. Until it
+has run, readers also show a post's inline comments and add its inline
+counts.
+"""
+import random
+from datetime import datetime
+
+import click
+from firebase_admin import firestore
+
+from . import db, versions
+
+COLLECTION = 'community_posts'
+NUM_SHARDS = 10
+COMMENTS_PAGE_SIZE = 20
+MAX_BATCH = 450  # Firestore allows 500 writes per batch
+
+
+def _counters(post_id):
+    return db.collection(COLLECTION).document(post_id).collection('counters')
+
+
+def bump_counts(post_id, batch=None, likes=0, comments=0):
+    """Add to the post's like and comment counts with one write to a random shard."""
+    shard = _counters(post_id).document(str(random.randrange(NUM_SHARDS)))
+    data = {'post_id': post_id}
+    for field, amount in (('likes', likes), ('comments', comments)):
+        if amount:
+            data[field] = firestore.Increment(amount)
+    if batch is not None:
+        batch.set(shard, data, merge=True)
+    else:
+        shard.set(data, merge=True)
+
+
+def like(post_id):
+    bump_counts(post_id, likes=1)
+
+
+def queue_comment(batch, post_id, author, text):
+    """Queue a comment in ``batch`` without counting it (see ``bump_counts``).
+    Returns the comment as the client should show it."""
+    comment = {
+        'author': author,
+        'text': text,
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M'),
+    }
+    batch.set(db.collection(COLLECTION).document(post_id).collection('comments').document(),
+              dict(comment, created_at=firestore.SERVER_TIMESTAMP))
+    return comment
+
+
+def add_comment(post_id, author, text):
+    """Store a comment and return it as the client should show it."""
+    batch = db.batch()
+    comment = queue_comment(batch, post_id, author, text)
+    bump_counts(post_id, batch=batch, comments=1)
+    batch.commit()
+    versions.bump(COLLECTION)
+    return comment
+
+
+def get_comments(post_id, page_token=None, page_size=COMMENTS_PAGE_SIZE):
+    """Return ``(comments, next_page_token)``, oldest first.
+
+    A post ``flask migrate-engagement`` hasn't moved yet still has its older
+    comments inline; the first page starts with those not already copied out.
+    """
+    post_ref = db.collection(COLLECTION).document(post_id)
+    comments_ref = post_ref.collection('comments')
+    query = comments_ref.order_by('created_at')
+    comments = []
+    if page_token:
+        cursor = comments_ref.document(page_token).get()
+        if not cursor.exists:
+            return [], None
+        query = query.start_after(cursor)
+    else:
+        post = post_ref.get(['comments'])
+        inline = (post.to_dict().get('comments') or []) if post.exists else []
+        if inline:
+            # An interrupted migration leaves some of these copied to
+            # ``legacy-<i>`` documents, which the pages below already show
+            copies = db.get_all([comments_ref.document(f"legacy-{i}") for i in range(len(inline))],
+                                field_paths=['created_at'])
+            copied = {snap.id for snap in copies if snap.exists}
+            comments = [comment for i, comment in enumerate(inline) if f"legacy-{i}" not in copied]
+
+    docs = list(query.limit(page_size + 1).stream())
+    for doc in docs[:page_size]:
+        comment = doc.to_dict()
+        comment.pop('created_at', None)
+        comments.append(comment)
+    next_token = docs[page_size - 1].id if len(docs) > page_size else None
+    return comments, next_token
+
+
+def get_counts(post_ids):
+    """Return ``{post_id: {'likes': n, 'comments': n}}`` summed over shards."""
+    counts = {post_id: {'likes': 0, 'comments': 0} for post_id in post_ids}
+    ids = list(counts)
+    # 'in' takes at most 30 values
+    for i in range(0, len(ids), 30):
+        shards = db.collection_group('counters').where('post_id', 'in', ids[i:i + 30]).stream()
+        for shard in shards:
+            data = shard.to_dict()
+            total = counts[data['post_id']]
+            total['likes'] += data.get('likes', 0)
+            total['comments'] += data.get('comments', 0)
+    return counts
+
+
+def apply_counts(posts):
+    """Fill ``likes`` and ``comment_count`` on feed posts in place.
+
+    Posts not yet migrated still carry their old inline counters; those are
+    added on top so the numbers stay right during the migration. The inline
+    ``comments`` array is never read here, so posts from before
+    ``comment_count`` existed count only new comments until they are migrated.
+    """
+    counts = get_counts([post['id'] for post in posts])
+    for post in posts:
+        post['likes'] = post.get('likes', 0) + counts[post['id']]['likes']
+        post['comment_count'] = post.get('comment_count', 0) + counts[post['id']]['comments']
+    return posts
+
+
+def migrate_post(doc):
+    """Move one post's inline comments and likes out. Returns comments moved."""
+    post = doc.to_dict()
+    comments = post.get('comments') or []
+    likes = post.get('likes') or 0
+    comments_ref = doc.reference.collection('comments')
+
+    # A post with many comments takes several batches before the one that
+    # clears the inline field. Fixed ids make a rerun after a failure
+    # overwrite the copies already made instead of adding them again.
+    batch = db.batch()
+    pending = 0
+    for i, comment in enumerate(comments):
+        try:
+            created_at = datetime.strptime(comment.get('timestamp', ''), '%Y-%m-%d %H:%M')
+        except ValueError:
+            created_at = post.get('timestamp')
+        batch.set(comments_ref.document(f"legacy-{i}"), dict(comment, created_at=created_at))
+        pending += 1
+        if pending == MAX_BATCH:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    # Counters and the field removal go in the same batch, so the totals
+    # are never counted twice
+    batch.set(_counters(doc.id).document('0'), {
+        'post_id': doc.id,
+        'likes': firestore.Increment(likes),
+        'comments': firestore.Increment(len(comments)),
+    }, merge=True)
+    batch.update(doc.reference, {
+        'comments': firestore.DELETE_FIELD,
+        'likes': firestore.DELETE_FIELD,
+        'comment_count': firestore.DELETE_FIELD,
+    })
+    batch.commit()
+    return len(comments)
+
+
+def migrate_all():
+    """Migrate every post that still has inline comments or likes."""
+    posts = comments = 0
+    for doc in db.collection(COLLECTION).stream():
+        data = doc.to_dict()
+        if 'comments' not in data and 'likes' not in data and 'comment_count' not in data:
+            continue
+        comments += migrate_post(doc)
+        posts += 1
+    if posts:
+        versions.bump(COLLECTION)
+    return posts, comments
+
+
+@click.command('migrate-engagement')
+def migrate_command():
+    """Move post comments to subcollections and likes to sharded counters."""
+    posts, comments = migrate_all()
+    click.echo(f"Migrated {posts} posts, {comments} comments")
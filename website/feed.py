@@ -0,0 +1,149 @@
+"""Community feed pages and the Harvest Heroes leaderboard.
+
+The feed is read a page at a time with a ``start_after`` cursor. Like and
+comment counts come from the sharded counters in ``engagement``, one
+collection-group query per page; comments are fetched per post when the
+reader opens them.
+
+The first page and the leaderboard are what nearly every visit asks for, so
+both are cached in process. New posts and comments in this process
+invalidate the first page directly; new posts from other workers reach us
+through a snapshot listener on the newest posts. Likes don't invalidate
+anything, so a cached like count can lag by up to a minute. The leaderboard
+is one document that ``scores`` rewrites every few minutes, so it is simply
+cached for as long.
+"""
+import threading
+
+from cachetools import TTLCache
+from firebase_admin import firestore
+
+from . import db, engagement, scores, versions
+
+COLLECTION = 'community_posts'
+PAGE_SIZE = 10
+HEROES_LIMIT = 3
+CACHE_TTL = 60  # seconds
+# Never the legacy ``comments`` array: it can be most of a post's size
+FEED_FIELDS = ['author', 'author_id', 'title', 'content', 'tag', 'likes', 'comment_count', 'timestamp', 'avatar']
+
+_cache = TTLCache(maxsize=4, ttl=CACHE_TTL)
+_heroes_cache = TTLCache(maxsize=1, ttl=300)
+_lock = threading.Lock()
+_watch = None
+
+
+def _to_post(doc):
+    post = doc.to_dict()
+    post['id'] = doc.id
+    if 'timestamp' in post and post['timestamp']:
+        post['time_ago'] = post['timestamp'].strftime('%d %b %Y')
+    return post
+
+
+def _query_page(page_token, page_size):
+    query = (db.collection(COLLECTION)
+             .select(FEED_FIELDS)
+             .order_by('timestamp', direction=firestore.Query.DESCENDING))
+    if page_token:
+        cursor = db.collection(COLLECTION).document(page_token).get()
+        if not cursor.exists:
+            return [], None
+        query = query.start_after(cursor)
+
+    # One extra document tells us whether there is a next page
+    docs = list(query.limit(page_size + 1).stream())
+    posts = engagement.apply_counts([_to_post(doc) for doc in docs[:page_size]])
+    next_token = posts[-1]['id'] if len(docs) > page_size else None
+    return posts, next_token
+
+
+def get_page(page_token=None, page_size=PAGE_SIZE):
+    """Return ``(posts, next_page_token)``; the first page is served from cache."""
+    if page_token:
+        return _query_page(page_token, page_size)
+
+    with _lock:
+        cached = _cache.get(page_size)
+    if cached is not None:
+        return cached
+
+    page = _query_page(None, page_size)
+    with _lock:
+        _cache[page_size] = page
+    return page
+
+
+def new_post(fields, author, author_id):
+    """Build a post from submitted ``fields``."""
+    return {
+        'author': author or 'Farmer',
+        'author_id': author_id,
+        'title': fields.get('title'),
+        'content': fields.get('content'),
+        'tag': fields.get('tag') or 'General',
+        'avatar': f"https://api.dicebear.com/7.x/avataaars/svg?seed={author}",
+    }
+
+
+def add_post(post, batch=None):
+    """Store a new post and log it for the author's Harvest Hero score.
+    Returns its id.
+
+    With ``batch`` the writes are only queued, as in ``listings.create_listing``.
+    """
+    ref = db.collection(COLLECTION).document()
+    writes = batch if batch is not None else db.batch()
+    writes.set(ref, dict(post, timestamp=firestore.SERVER_TIMESTAMP))
+    scores.log_post(writes, ref.id, post['author_id'], post['author'])
+    if batch is None:
+        writes.commit()
+        versions.bump(COLLECTION)
+    return ref.id
+
+
+def get_heroes():
+    """The top Harvest Heroes, read from the leaderboard ``scores`` maintains."""
+    with _lock:
+        cached = _heroes_cache.get('heroes')
+    if cached is not None:
+        return cached
+
+    heroes = scores.leaders(HEROES_LIMIT)
+    with _lock:
+        _heroes_cache['heroes'] = heroes
+    return heroes
+
+
+def invalidate(post_id=None):
+    """Drop cached pages after a write.
+
+    With ``post_id``, only drop them if that post is on a cached page (a
+    comment on an old post doesn't change the first page).
+    """
+    with _lock:
+        if post_id is None:
+            _cache.clear()
+        else:
+            for size, (posts, _) in list(_cache.items()):
+                if any(post['id'] == post_id for post in posts):
+                    del _cache[size]
+
+
+def _on_snapshot(col_snapshot, changes, read_time):
+    if changes:
+        invalidate()
+
+
+def start():
+    """Listen for changes to the newest posts made by any worker."""
+    global _watch
+    if _watch is not None or not db.is_configured():
+        return
+    try:
+        query = (db.collection(COLLECTION)
+                 .order_by('timestamp', direction=firestore.Query.DESCENDING)
+                 .limit(PAGE_SIZE))
+        _watch = query.on_snapshot(_on_snapshot)
+    except Exception as e:
+        print(f"Error starting feed listener: {e}")
@@ -0,0 +1,122 @@
+"""The Firestore client, created on first use in each process.
+
+Opening the client parses credentials and starts gRPC channels, and gRPC
+channels don't survive ``fork()``. ``db`` is a stand-in that opens the real
+client the first time it is used, so importing the app is cheap and
+gunicorn can preload it: the master never needs a channel, and a process
+that inherits one across a fork drops it and opens its own.
+"""
+import json
+import os
+import threading
+import time
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+
+class NotConfigured(RuntimeError):
+    """No usable Firebase credentials."""
+
+
+def data_backend():
+    """'firestore', or 'memory' / 'sqlite' for the local stand-in in datastore.py."""
+    return os.environ.get('DATA_BACKEND', 'firestore')
+
+
+def _certificate():
+    # OPTION 1: Environment Variable (For Render Deployment)
+    firebase_creds = os.environ.get('FIREBASE_CREDENTIALS')
+    if firebase_creds:
+        try:
+            return credentials.Certificate(json.loads(firebase_creds)), 'Environment Variable'
+        except Exception as e:
+            print(f"Failed to initialize from Env Var: {e}")
+
+    # OPTION 2: Local file (For Local Development)
+    cred_path = os.path.join(os.path.dirname(__file__), 'serviceAccountKey.json')
+    if os.path.exists(cred_path):
+        try:
+            return credentials.Certificate(cred_path), 'Local File'
+        except Exception as e:
+            print(f"Failed to initialize Firebase from file: {e}")
+    return None, None
+
+
+def create_client():
+    """Open a client for the configured backend. Raises NotConfigured."""
+    backend = data_backend()
+    if backend != 'firestore':
+        from . import datastore
+        print(f"Using local {backend} datastore")
+        return datastore.connect(backend)
+
+    if not firebase_admin._apps:
+        cred, source = _certificate()
+        if cred is None:
+            raise NotConfigured('No Firebase credentials found (Env Var or File)')
+        firebase_admin.initialize_app(cred)
+        print(f"Firebase Initialized from {source}")
+    # Not firestore.client(): that one is cached on the app and would be
+    # handed, channels and all, to a forked child
+    app = firebase_admin.get_app()
+    from .datastore import TrackedClient
+    return TrackedClient(firestore.Client(project=app.project_id, credentials=app.credential.get_credential()))
+
+
+class LazyClient:
+    """Forwards everything to a client opened on first use in this process."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._pid = None
+        self._error = None
+        self._lock = threading.Lock()
+        self.open_seconds = None
+
+    def client(self):
+        """Return this process's client, opening it if needed. Raises NotConfigured."""
+        client = self._client
+        if client is not None and self._pid == os.getpid():
+            return client
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                if self._error is not None:
+                    # Credentials don't appear at runtime; don't retry on every request
+                    raise self._error
+                start = time.perf_counter()
+                try:
+                    self._client = self._factory()
+                except NotConfigured as e:
+                    print(f"Error: {e}")
+                    self._error = e
+                    raise
+                self._pid = os.getpid()
+                self.open_seconds = time.perf_counter() - start
+            return self._client
+
+    def is_configured(self):
+        """Whether a client can be opened, opening it if needed."""
+        try:
+            self.client()
+            return True
+        except NotConfigured:
+            return False
+
+    def reset(self):
+        """Forget the client, e.g. in a forked child. The memory backend is
+        kept: its data lives nowhere else."""
+        self._lock = threading.Lock()  # may have been held by another thread at fork
+        if data_backend() == 'memory' and self._pid is not None:
+            self._pid = os.getpid()
+            return
+        self._client = None
+        self._pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.client(), name)
+
+    def __repr__(self):
+        state = 'open' if self._client is not None else 'not opened'
+        return f"<LazyClient {state}>"
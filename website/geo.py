@@ -0,0 +1,295 @@
+"""Offline geocoding and "near me" search for listings.
+
+``geocode`` turns a listing's free-text location into coordinates with a
+gazetteer that ships with the app: ``gazetteer.csv`` holds district towns
+and some head post office PIN codes. ``GAZETTEER_FILES`` (comma-separated
+paths) adds more in the same layout or as data.gov.in's "All India Pincode
+Directory", which lists every post office with its PIN, district and
+coordinates. A PIN is looked up exactly, then by its first three digits
+(its sorting district). Names are matched after the same transliteration
+and spelling folds as search, most specific comma-separated part first
+("Pimpalgaon, Tal. Niphad, Dist. Nashik"), then word by word.
+
+Geocoded listings store ``lat``, ``lng`` and a ``geohash``. A radius query
+covers its circle with nine geohash cells, the one holding the centre and
+its neighbours, at the finest precision whose cells are still wider than
+the radius. Only listings in those cells are looked at:
+
+* in Firestore, one ``geohash`` prefix range per cell (``listings.search_nearby``);
+* in process, ``GeoIndex``, listing ids bucketed by geohash cell, kept by
+  ``search_index`` next to its text index.
+
+Both then check the exact distance and sort nearest first; ``GeoIndex.nearest``
+widens the radius until it has enough listings.
+"""
+import csv
+import math
+import os
+import re
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+BUNDLED = os.path.join(os.path.dirname(__file__), 'gazetteer.csv')
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+GEOHASH_PRECISION = 9  # ~5 m cells, what listings store
+GRID_PRECISION = 4     # ~39 x 20 km buckets in GeoIndex
+DEFAULT_RADIUS_KM = 50
+MAX_RADIUS_KM = 500
+INDIA = ((6.0, 38.0), (68.0, 98.0))  # rows outside this are typos in the source
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_HEADERS = {
+    'name': 'name', 'officename': 'name', 'placename': 'name', 'village': 'name',
+    'district': 'district', 'districtname': 'district',
+    'state': 'state', 'statename': 'state',
+    'pincode': 'pincode', 'pin': 'pincode',
+    'lat': 'lat', 'latitude': 'lat',
+    'lon': 'lng', 'lng': 'lng', 'long': 'lng', 'longitude': 'lng',
+}
+
+Place = namedtuple('Place', 'name district state lat lng')
+
+
+# --- GEOHASH ---
+def encode(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    out, value, bits, even = [], 0, 0, True
+    while len(out) < precision:
+        span, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        mid = (span[0] + span[1]) / 2
+        if coordinate >= mid:
+            value, span[0] = value * 2 + 1, mid
+        else:
+            value, span[1] = value * 2, mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[value])
+            value, bits = 0, 0
+    return ''.join(out)
+
+
+def _cell_size(precision):
+    """``(height, width)`` of a cell in degrees."""
+    return 180.0 / 2 ** (5 * precision // 2), 360.0 / 2 ** ((5 * precision + 1) // 2)
+
+
+def covering_cells(lat, lng, radius_km):
+    """Geohash cells that together contain every point within ``radius_km``."""
+    dlat = radius_km / KM_PER_DEGREE
+    dlng = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    precision = 1
+    for candidate in range(2, GEOHASH_PRECISION + 1):
+        height, width = _cell_size(candidate)
+        if height < dlat or width < dlng:
+            break
+        precision = candidate
+    height, width = _cell_size(precision)
+    return sorted({encode(min(max(lat + i * height, -90.0), 89.999999), (lng + j * width + 180) % 360 - 180, precision)
+                   for i in (-1, 0, 1) for j in (-1, 0, 1)})
+
+
+def distance_km(lat, lng, lats, lngs):
+    """Great-circle distance from one point to each of ``lats``/``lngs``."""
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+# --- GAZETTEER ---
+def _key(text):
+    from .search_index import tokenize
+    return ' '.join(tokenize(text))
+
+
+class Gazetteer:
+    def __init__(self):
+        self.names = {}      # normalized name -> [Place]
+        self.pincodes = {}   # PIN -> Place
+        self.areas = {}      # first three PIN digits -> Place at their centre
+        self._districts = {}
+
+    def load(self, path):
+        """Add the places in a CSV file. Returns how many were read."""
+        added = 0
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            col = {}
+            for i, name in enumerate(header):
+                field = _HEADERS.get(re.sub(r'[^a-z]', '', name.lower()))
+                if field and field not in col:
+                    col[field] = i
+            if not {'name', 'lat', 'lng'} <= col.keys():
+                raise ValueError(f"{path}: needs name, latitude and longitude columns")
+            for row in reader:
+                try:
+                    lat, lng = float(row[col['lat']]), float(row[col['lng']])
+                except (ValueError, IndexError):
+                    continue  # the pincode directory says "NA"
+                if not (INDIA[0][0] <= lat <= INDIA[0][1] and INDIA[1][0] <= lng <= INDIA[1][1]):
+                    continue
+                value = lambda field: row[col[field]].strip() if field in col else ''
+                # Post offices are named "Pimpalgaon B.O" / "Niphad S.O"
+                name = re.sub(r'\s+[BSHG]\.?\s?P?\.?O\.?$', '', value('name'), flags=re.I).strip().title()
+                place = Place(name, value('district').title(), value('state').title(), lat, lng)
+                self.names.setdefault(_key(name), []).append(place)
+                if place.district:
+                    self._districts.setdefault(_key(place.district), []).append(place)
+                pincode = value('pincode')
+                if re.fullmatch(r'\d{6}', pincode):
+                    self.pincodes.setdefault(pincode, place)
+                added += 1
+        self._finish()
+        return added
+
+    def _finish(self):
+        """Index districts and PIN areas by the centre of their places."""
+        for key, places in self._districts.items():
+            if key not in self.names:
+                first = places[0]
+                self.names[key] = [Place(first.district, first.district, first.state,
+                                         sum(p.lat for p in places) / len(places),
+                                         sum(p.lng for p in places) / len(places))]
+        areas = {}
+        for pincode, place in self.pincodes.items():
+            areas.setdefault(pincode[:3], []).append(place)
+        self.areas = {prefix: Place(places[0].district, places[0].district, places[0].state,
+                                    sum(p.lat for p in places) / len(places),
+                                    sum(p.lng for p in places) / len(places))
+                      for prefix, places in areas.items()}
+
+    def _best(self, candidates, context):
+        # Several villages share a name: prefer the one whose district or
+        # state is also mentioned
+        for place in candidates:
+            if _key(place.district) in context or _key(place.state) in context:
+                return place
+        return candidates[0]
+
+    def geocode(self, text):
+        """The Place ``text`` most likely means, or None."""
+        text = str(text or '')
+        pincode = re.search(r'\b(\d{6})\b', text)
+        if pincode:
+            place = self.pincodes.get(pincode.group(1)) or self.areas.get(pincode.group(1)[:3])
+            if place:
+                return place
+        context = _key(text)
+        parts = [_key(part) for part in re.split(r'[,;/()]', text)]
+        for part in parts:
+            if part in self.names:
+                return self._best(self.names[part], context)
+        for part in parts:
+            words = part.split()
+            for size in (2, 1):
+                for i in range(len(words) - size + 1):
+                    candidates = self.names.get(' '.join(words[i:i + size]))
+                    if candidates:
+                        return self._best(candidates, context)
+        return None
+
+
+_gazetteer = None
+_lock = threading.Lock()
+
+
+def gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _lock:
+            if _gazetteer is None:
+                loaded = Gazetteer()
+                for path in [BUNDLED] + [p for p in os.environ.get('GAZETTEER_FILES', '').split(',') if p]:
+                    try:
+                        loaded.load(path)
+                    except (OSError, ValueError) as e:
+                        print(f"Error loading gazetteer {path}: {e}")
+                _gazetteer = loaded
+    return _gazetteer
+
+
+@lru_cache(maxsize=4096)
+def geocode(text):
+    return gazetteer().geocode(text)
+
+
+def fields(location):
+    """Position fields to store on a listing at ``location`` (None when unknown)."""
+    place = geocode(location) if location else None
+    if place is None:
+        return {'lat': None, 'lng': None, 'geohash': None}
+    return {'lat': place.lat, 'lng': place.lng, 'geohash': encode(place.lat, place.lng)}
+
+
+# --- IN-PROCESS INDEX ---
+class GeoIndex:
+    """Listing positions bucketed by geohash cell. Not thread safe on its
+    own; ``SearchIndex`` calls it under its lock."""
+
+    def __init__(self, precision=GRID_PRECISION):
+        self.precision = precision
+        self.cells = {}   # cell -> {doc id: (lat, lng)}
+        self.cell_of = {}
+        self._sorted = None
+
+    def add(self, doc_id, lat, lng):
+        self.remove(doc_id)
+        cell = encode(lat, lng, self.precision)
+        if cell not in self.cells:
+            self.cells[cell] = {}
+            self._sorted = None
+        self.cells[cell][doc_id] = (lat, lng)
+        self.cell_of[doc_id] = cell
+
+    def remove(self, doc_id):
+        cell = self.cell_of.pop(doc_id, None)
+        if cell is not None:
+            del self.cells[cell][doc_id]
+            if not self.cells[cell]:
+                del self.cells[cell]
+                self._sorted = None
+
+    def _buckets(self, lat, lng, radius_km):
+        buckets = set()
+        for cell in covering_cells(lat, lng, radius_km):
+            if len(cell) >= self.precision:
+                buckets.add(cell[:self.precision])
+                continue
+            # A cell coarser than the grid holds every bucket it prefixes
+            if self._sorted is None:
+                self._sorted = sorted(self.cells)
+            i = bisect_left(self._sorted, cell)
+            while i < len(self._sorted) and self._sorted[i].startswith(cell):
+                buckets.add(self._sorted[i])
+                i += 1
+        return [self.cells[bucket] for bucket in buckets if bucket in self.cells]
+
+    def within(self, lat, lng, radius_km):
+        """``[(distance_km, doc_id)]`` within ``radius_km``, nearest first."""
+        ids, points = [], []
+        for bucket in self._buckets(lat, lng, radius_km):
+            ids.extend(bucket)
+            points.extend(bucket.values())
+        if not ids:
+            return []
+        points = np.array(points)
+        distances = distance_km(lat, lng, points[:, 0], points[:, 1])
+        inside = np.flatnonzero(distances <= radius_km)
+        inside = inside[np.argsort(distances[inside], kind='stable')]
+        return [(float(distances[i]), ids[i]) for i in inside]
+
+    def nearest(self, lat, lng, k, max_radius_km=MAX_RADIUS_KM):
+        """The ``k`` nearest ``(distance_km, doc_id)`` within ``max_radius_km``."""
+        radius = 10
+        while True:
+            found = self.within(lat, lng, min(radius, max_radius_km))
+            if len(found) >= k or radius >= max_radius_km:
+                return found[:k]
+            radius *= 2
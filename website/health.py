@@ -0,0 +1,62 @@
+"""Liveness and warm-up endpoints.
+
+``/healthz`` answers without touching Firestore, for load balancer checks.
+``/warmup`` (an App Engine / Cloud Run style warm-up request) opens this
+process's Firestore client, compiles the templates and does one small read,
+so the first real request doesn't pay for them. It reports where the
+process spent its startup time and returns 503 until the datastore works.
+"""
+import os
+import time
+
+from flask import Blueprint, current_app, jsonify
+
+from . import db, startup_timings
+from .firebase import NotConfigured
+
+health = Blueprint('health', __name__)
+
+_started = time.time()
+
+
+@health.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+
+@health.route('/_ah/warmup')
+@health.route('/warmup')
+def warmup():
+    from . import feed, listings, search_index, versions
+
+    timings = {}
+    started = time.perf_counter()
+    try:
+        db.client()
+        timings['client'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        env = current_app.jinja_env
+        for name in env.list_templates(extensions=['html']):
+            env.get_template(name)
+        timings['templates'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        versions.get([listings.COLLECTION, feed.COLLECTION])
+        timings['read'] = time.perf_counter() - started
+        status, code = 'ok', 200
+    except NotConfigured as e:
+        status, code = f'not configured: {e}', 503
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        status, code = f'error: {e}', 503
+
+    return jsonify({
+        'status': status,
+        'pid': os.getpid(),
+        'uptime': round(time.time() - _started, 3),
+        'startup': {name: round(seconds, 4) for name, seconds in startup_timings.items()},
+        'client_open': round(db.open_seconds, 4) if db.open_seconds is not None else None,
+        'warmup': {name: round(seconds, 4) for name, seconds in timings.items()},
+        'search_index_complete': search_index.index.complete,
+    }), code
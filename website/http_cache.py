@@ -0,0 +1,177 @@
+"""HTTP caching for data pages and static files.
+
+Data pages (``@conditional``) get a weak ETag built from the versions of the
+collections they show (see ``versions``), the user they are rendered for,
+the query string and the build. It is checked against ``If-None-Match``
+before the view runs, so an unchanged page costs no reads and no render,
+just an empty 304. Pages are ``private, no-cache``: browsers and the service
+worker keep them but revalidate every time.
+
+Static files are fingerprinted: ``url_for('static', ...)`` adds ``?v=<hash
+of the file>`` and a request carrying the current hash is served with a one
+year ``immutable`` lifetime. Uploads are left alone; their URLs are stored
+in Firestore.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import Response, make_response, request, session
+
+from . import versions
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+UNVERSIONED_PREFIXES = ('uploads/',)
+
+_fingerprints = {}  # static filename -> short content hash
+_build = {'id': 'dev'}
+
+
+def _hash_file(path, digest):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest
+
+
+def fingerprint_static(static_folder):
+    """Hash every static file except uploads. Returns ``{filename: hash}``."""
+    fingerprints = {}
+    for root, dirs, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if filename.startswith(UNVERSIONED_PREFIXES):
+                continue
+            fingerprints[filename] = _hash_file(path, hashlib.sha256()).hexdigest()[:12]
+    return fingerprints
+
+
+def _build_id(app, fingerprints):
+    """Changes whenever a template or a static file does."""
+    digest = hashlib.sha256()
+    for filename in sorted(fingerprints):
+        digest.update(f"{filename}={fingerprints[filename]};".encode())
+    template_folder = os.path.join(app.root_path, app.template_folder)
+    for root, dirs, files in sorted(os.walk(template_folder)):
+        for name in sorted(files):
+            _hash_file(os.path.join(root, name), digest)
+    return digest.hexdigest()[:12]
+
+
+def build_id():
+    return _build['id']
+
+
+def fingerprint(filename):
+    return _fingerprints.get(filename)
+
+
+def asset_urls():
+    """``/static/<file>`` -> its fingerprinted URL, for the service worker."""
+    return {f"/static/{filename}": f"/static/{filename}?v={fingerprint}"
+            for filename, fingerprint in _fingerprints.items()}
+
+
+def _add_fingerprint(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        current = _fingerprints.get(values.get('filename'))
+        if current:
+            values['v'] = current
+
+
+def _static_headers(response):
+    if request.endpoint != 'static' or response.status_code != 200:
+        return response
+    filename = (request.view_args or {}).get('filename')
+    current = _fingerprints.get(filename)
+    if current and request.args.get('v') == current:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def page_validators(collections, bucket=None):
+    """Return ``(etag, last_modified)`` for the current request.
+
+    ``bucket`` (seconds) also rolls the ETag over on a clock, for pages that
+    show data whose writes aren't versioned (like counts); such pages get no
+    Last-Modified, since the date wouldn't move when they change.
+    """
+    current = versions.get(collections)
+    parts = [build_id(), request.path, request.query_string.decode(),
+             str(session.get('user', '')), str(session.get('user_name', ''))]
+    parts += [f"{name}:{current[name][0]}" for name in collections]
+    if bucket:
+        parts.append(str(int(datetime.now(timezone.utc).timestamp() // bucket)))
+    etag = hashlib.sha1('|'.join(parts).encode()).hexdigest()[:20]
+
+    last_modified = None
+    if not bucket:
+        times = [updated_at for _, updated_at in current.values() if updated_at]
+        last_modified = max(times) if times else None
+    return etag, last_modified
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def _validate(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional(*collections, bucket=None):
+    """Answer GETs of the decorated view with 304 while ``collections`` are unchanged."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            try:
+                etag, last_modified = page_validators(collections, bucket)
+            except Exception as e:
+                print(f"Error computing page validators: {e}")
+                return view(*args, **kwargs)
+
+            if _not_modified(etag, last_modified):
+                return _validate(Response(status=304), etag, last_modified)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                _validate(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+def service_worker_response(path):
+    """Serve sw.js with the build id and fingerprinted asset URLs filled in."""
+    with open(path, encoding='utf-8') as f:
+        script = f.read()
+    script = (script.replace("/*BUILD*/'dev'", repr(build_id()))
+                    .replace('/*ASSET_URLS*/{}', json.dumps(asset_urls())))
+    response = Response(script, mimetype='application/javascript')
+    response.cache_control.no_cache = True
+    return response
+
+
+def init_app(app):
+    _fingerprints.clear()
+    _fingerprints.update(fingerprint_static(app.static_folder))
+    _build['id'] = _build_id(app, _fingerprints)
+    app.url_defaults(_add_fingerprint)
+    app.after_request(_static_headers)
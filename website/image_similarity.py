@@ -0,0 +1,159 @@
+"""Near-duplicate lookup for crop photos that were already diagnosed.
+
+Each diagnosed image gets a 64-bit difference hash (dHash) of its grayscale
+thumbnail. Recompression, resizing and small crops move only a few bits, so
+a new photo within ``THRESHOLD`` bits of a recent one is treated as the same
+leaf and its stored diagnosis is reused.
+
+Hashes sit in a BK-tree for sub-linear Hamming-distance search. They are also
+written to the diagnosis cache's SQLite file, and each process pulls in the
+rows other workers added before every lookup.
+"""
+import io
+import os
+import threading
+import time
+
+from PIL import Image, UnidentifiedImageError
+
+from . import diagnosis_cache
+
+THRESHOLD = int(os.environ.get('SIMILAR_IMAGE_THRESHOLD', 6))  # bits out of 64
+MAX_ENTRIES = 20000
+KEEP_ON_REBUILD = MAX_ENTRIES // 2  # low watermark, so rebuilds stay rare
+HASH_SIZE = 8
+
+
+def dhash(image_bytes):
+    """64-bit difference hash of an image, or None if it can't be decoded."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))  # cheap JPEG downscale on decode
+            small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        return None
+
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes with Hamming distance."""
+
+    def __init__(self):
+        self.root = None  # [hash, value, {distance: child}]
+        self.size = 0
+
+    def add(self, hash_value, value):
+        self.size += 1
+        if self.root is None:
+            self.root = [hash_value, value, {}]
+            return
+        node = self.root
+        while True:
+            dist = hamming(hash_value, node[0])
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [hash_value, value, {}]
+                return
+            node = child
+
+    def search(self, hash_value, threshold):
+        """Return ``(distance, value)`` pairs within ``threshold``, closest first."""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            dist = hamming(hash_value, node[0])
+            if dist <= threshold:
+                found.append((dist, node[1]))
+            # Triangle inequality: only children in [dist - t, dist + t] can match
+            for child_dist, child in node[2].items():
+                if dist - threshold <= child_dist <= dist + threshold:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+_tree = BKTree()
+_last_rowid = 0
+_lock = threading.Lock()
+
+
+def _ensure_table(conn):
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS image_hashes ('
+        ' id INTEGER PRIMARY KEY AUTOINCREMENT, hash TEXT NOT NULL, key TEXT NOT NULL, created_at REAL NOT NULL)'
+    )
+
+
+def _sync():
+    """Pull hashes added by any worker since the last sync into the tree."""
+    global _tree, _last_rowid
+    conn = diagnosis_cache.connect()
+    _ensure_table(conn)
+    cutoff = time.time() - diagnosis_cache.TTL
+    rows = conn.execute(
+        'SELECT id, hash, key, created_at FROM image_hashes WHERE id > ? ORDER BY id',
+        (_last_rowid,),
+    ).fetchall()
+    if not rows:
+        return
+
+    # BK-trees don't support deletes: when full, drop expired rows on disk
+    # and rebuild from the newest half, so the next rebuild is another
+    # MAX_ENTRIES // 2 inserts away
+    if _tree.size + len(rows) > MAX_ENTRIES:
+        newest = rows[-1][0]
+        diagnosis_cache.purge_expired()
+        _tree = BKTree()
+        rows = conn.execute(
+            'SELECT id, hash, key, created_at FROM image_hashes WHERE created_at > ? ORDER BY id DESC LIMIT ?',
+            (cutoff, KEEP_ON_REBUILD),
+        ).fetchall()[::-1]
+        _last_rowid = newest
+
+    for rowid, hash_hex, key, created_at in rows:
+        if created_at > cutoff:
+            _tree.add(int(hash_hex, 16), key)
+        _last_rowid = max(_last_rowid, rowid)
+
+
+def find_similar(hash_value, prompt_version):
+    """Return ``(cache_key, distance)`` of the closest earlier diagnosis, or None."""
+    try:
+        with _lock:
+            _sync()
+            matches = _tree.search(hash_value, THRESHOLD)
+    except Exception as e:
+        print(f"Image similarity lookup error: {e}")
+        return None
+
+    prefix = f"{prompt_version}:"
+    for dist, key in matches:
+        if key.startswith(prefix):
+            return key, dist
+    return None
+
+
+def add(hash_value, cache_key):
+    try:
+        conn = diagnosis_cache.connect()
+        _ensure_table(conn)
+        with conn:
+            conn.execute(
+                'INSERT INTO image_hashes (hash, key, created_at) VALUES (?, ?, ?)',
+                (f"{hash_value:016x}", cache_key, time.time()),
+            )
+    except Exception as e:
+        print(f"Image similarity write error: {e}")
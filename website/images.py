@@ -0,0 +1,149 @@
+"""Shared image processing for crop photos and listing uploads.
+
+Every image goes through ``process``: it is decoded (which validates it and
+detects the real format regardless of the file name or claimed mime type),
+rotated per its EXIF orientation, downsized to a bounded resolution and
+re-encoded without metadata. Phone photos of several MB come out at a few
+hundred KB, and listing thumbnails at a few tens of KB.
+
+Pillow releases the GIL while decoding, resizing and encoding, so the work
+runs in a small thread pool instead of the request thread alone.
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import blobs
+
+# Refuse decompression bombs well before Pillow's own limit
+Image.MAX_IMAGE_PIXELS = 40_000_000
+
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF', 'MPO'}
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+# Where uploads were written before they moved to ``blobs``
+UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
+
+# name -> (longest side in px, output format, quality)
+VARIANTS = {
+    'model': (1024, 'JPEG', 85),   # what the diagnosis model sees
+    'full': (1280, 'WEBP', 80),    # listing detail image
+    'thumb': (400, 'WEBP', 75),    # listing cards
+}
+
+def _new_pool():
+    return ThreadPoolExecutor(max_workers=int(os.environ.get('IMAGE_WORKERS', 2)), thread_name_prefix='images')
+
+
+def _reset_after_fork():
+    # The parent's worker threads don't exist in a forked child
+    global _pool
+    _pool = _new_pool()
+
+
+_pool = _new_pool()
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+class ProcessedImage:
+    def __init__(self, data, format, width, height):
+        self.data = data
+        self.format = format
+        self.width = width
+        self.height = height
+
+    @property
+    def mime_type(self):
+        return MIME_TYPES[self.format]
+
+    @property
+    def extension(self):
+        return EXTENSIONS[self.format]
+
+
+def open_image(source, draft_size=None):
+    """Decode ``source`` (bytes or a file object) and return a Pillow image.
+
+    With ``draft_size``, JPEGs are downscaled by a power of two while
+    decoding, which is much cheaper than decoding full size and resizing.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        img = Image.open(source)
+        if img.format not in ALLOWED_FORMATS:
+            raise InvalidImage(f"Unsupported image format: {img.format}")
+        if draft_size:
+            img.draft('RGB', draft_size)
+        img.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise InvalidImage(str(e)) from e
+    return img
+
+
+def _render(img, max_side, format, quality):
+    img = ImageOps.exif_transpose(img)
+    if format == 'JPEG' and img.mode != 'RGB':
+        img = img.convert('RGB')
+    elif img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    out = io.BytesIO()
+    # No exif= argument: metadata (GPS location included) is dropped
+    img.save(out, format=format, quality=quality, optimize=True, **({'method': 4} if format == 'WEBP' else {}))
+    return ProcessedImage(out.getvalue(), format, img.width, img.height)
+
+
+def process(source, variant='full'):
+    """Validate and re-encode ``source`` as the named variant."""
+    max_side, format, quality = VARIANTS[variant]
+    img = open_image(source, draft_size=(max_side, max_side))
+    return _render(img, max_side, format, quality)
+
+
+def process_variants(source, variants=('full', 'thumb')):
+    """Return ``{variant: ProcessedImage}``, decoding ``source`` only once."""
+    largest = max(VARIANTS[name][0] for name in variants)
+    img = open_image(source, draft_size=(largest, largest))
+    return {name: _render(img, *VARIANTS[name]) for name in variants}
+
+
+def save_listing_photo(source):
+    """Process a listing photo and store its full and thumb variants (see
+    ``blobs``). Returns their ``(full, thumb)`` keys. Raises InvalidImage."""
+    variants = process_variants(source)
+    return tuple(blobs.put(variants[name].data, variants[name].extension) for name in ('full', 'thumb'))
+
+
+def submit(fn, *args, **kwargs):
+    """Run ``fn`` on the image worker pool and return its future."""
+    return _pool.submit(fn, *args, **kwargs)
+
+
+@click.command('optimize-uploads')
+@click.argument('folder', default=UPLOAD_FOLDER)
+def optimize_uploads_command(folder):
+    """Re-encode existing uploads in place (same name, so stored URLs keep working)."""
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        try:
+            with open(path, 'rb') as f:
+                original = f.read()
+            img = open_image(original)
+            format = 'PNG' if img.format == 'PNG' else 'JPEG'
+            result = _render(img, VARIANTS['full'][0], format, VARIANTS['full'][2])
+        except InvalidImage:
+            continue
+        if len(result.data) < len(original):
+            with open(path, 'wb') as f:
+                f.write(result.data)
+            click.echo(f"{name}: {len(original) // 1024} KB -> {len(result.data) // 1024} KB")
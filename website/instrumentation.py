@@ -0,0 +1,262 @@
+"""Per-request performance instrumentation.
+
+``init_app`` records, for every request, the wall time, Firestore RPCs and
+documents read and written (through ``datastore.track()``), time spent
+waiting on the model and template render time. They are then:
+
+* returned in a ``Server-Timing`` header, which browser dev tools show
+  next to each request;
+* logged as one JSON line per request on the ``krishimitra.requests``
+  logger (``LOG_REQUESTS=0`` turns this off);
+* aggregated per route into Prometheus text at ``/metrics``. The numbers
+  are per process, so every gunicorn worker reports its own. Set
+  ``METRICS_TOKEN`` to require ``Authorization: Bearer <token>``, here
+  and on the other stats endpoints (``metrics_token_required``).
+
+``PROFILE_SAMPLE_RATE`` (0 to 1, off by default) runs a sampling profiler
+on that fraction of requests. Sampled requests slower than
+``PROFILE_SLOW_MS`` log their hottest stacks on ``krishimitra.profile`` in
+collapsed-stack form, ready for a flame graph.
+
+Streamed responses (SSE, NDJSON) are measured up to the point the body
+starts streaming.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, before_render_template, g, request, template_rendered
+
+from . import datastore
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LOG_REQUESTS = os.environ.get('LOG_REQUESTS', '1') != '0'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 500))
+PROFILE_INTERVAL = 0.005  # seconds between stack samples
+PROFILE_TOP_STACKS = 15
+PROFILE_MAX_DEPTH = 30
+
+request_log = logging.getLogger('krishimitra.requests')
+profile_log = logging.getLogger('krishimitra.profile')
+
+_timings = contextvars.ContextVar('request_timings', default=None)
+_lock = threading.Lock()
+_statuses = Counter()
+_routes = defaultdict(lambda: {
+    'count': 0, 'buckets': [0] * len(BUCKETS), 'seconds': 0.0,
+    'rpcs': 0, 'reads': 0, 'writes': 0, 'model': 0.0, 'render': 0.0,
+})
+
+
+def add_timing(name, seconds):
+    """Add ``seconds`` under ``name`` to the current request, if there is one."""
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's stack at a fixed interval."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def finish(self):
+        self._done.set()
+        self.join()
+        return self.stacks
+
+
+def _before_request():
+    g.request_start = time.perf_counter()
+    g.timings_token = _timings.set({})
+    g.usage_tracker = datastore.track()
+    g.usage = g.usage_tracker.__enter__()
+    g.sampler = None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        g.sampler = StackSampler(threading.get_ident())
+        g.sampler.start()
+
+
+def _before_render(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None:
+        add_timing('render', time.perf_counter() - start)
+
+
+def _after_request(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    sampler = g.pop('sampler', None)
+    stacks = sampler.finish() if sampler is not None else None
+    usage = g.usage
+    timings = _timings.get() or {}
+    route = request.endpoint or 'unmatched'
+
+    parts = [f"app;dur={elapsed * 1000:.1f}",
+             f'firestore;dur={usage.seconds * 1000:.1f};desc="{usage.rpcs} rpc, {usage.reads} read, {usage.writes} write"']
+    for name in ('model', 'render'):
+        if name in timings:
+            parts.append(f"{name};dur={timings[name] * 1000:.1f}")
+    response.headers.add('Server-Timing', ', '.join(parts))
+
+    with _lock:
+        _statuses[(route, request.method, response.status_code)] += 1
+        stats = _routes[route]
+        stats['count'] += 1
+        stats['seconds'] += elapsed
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                stats['buckets'][i] += 1
+        stats['rpcs'] += usage.rpcs
+        stats['reads'] += usage.reads
+        stats['writes'] += usage.writes
+        stats['model'] += timings.get('model', 0.0)
+        stats['render'] += timings.get('render', 0.0)
+
+    if LOG_REQUESTS:
+        request_log.info(json.dumps({
+            'route': route,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 1),
+            'firestore_rpcs': usage.rpcs,
+            'firestore_reads': usage.reads,
+            'firestore_writes': usage.writes,
+            'firestore_ms': round(usage.seconds * 1000, 1),
+            'model_ms': round(timings.get('model', 0.0) * 1000, 1),
+            'render_ms': round(timings.get('render', 0.0) * 1000, 1),
+        }))
+
+    if stacks and elapsed * 1000 >= PROFILE_SLOW_MS:
+        profile_log.warning(json.dumps({
+            'route': route,
+            'path': request.path,
+            'duration_ms': round(elapsed * 1000, 1),
+            'samples': sum(stacks.values()),
+            'stacks': [f"{stack} {count}" for stack, count in stacks.most_common(PROFILE_TOP_STACKS)],
+        }))
+    return response
+
+
+def _teardown_request(exc):
+    sampler = g.pop('sampler', None)
+    if sampler is not None:
+        sampler.finish()
+    tracker = g.pop('usage_tracker', None)
+    if tracker is not None:
+        tracker.__exit__(None, None, None)
+    token = g.pop('timings_token', None)
+    if token is not None:
+        _timings.reset(token)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_metrics():
+    """Return the collected metrics in the Prometheus text format."""
+    with _lock:
+        statuses = dict(_statuses)
+        routes = {route: dict(stats, buckets=list(stats['buckets'])) for route, stats in _routes.items()}
+
+    lines = [
+        '# HELP krishimitra_requests_total Requests handled.',
+        '# TYPE krishimitra_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(statuses.items()):
+        lines.append(f'krishimitra_requests_total{{route="{_label(route)}",method="{method}",status="{status}"}} {count}')
+
+    lines += [
+        '# HELP krishimitra_request_duration_seconds Request wall time.',
+        '# TYPE krishimitra_request_duration_seconds histogram',
+    ]
+    for route, stats in sorted(routes.items()):
+        label = f'route="{_label(route)}"'
+        for bound, count in zip(BUCKETS, stats['buckets']):
+            lines.append(f'krishimitra_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'krishimitra_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats["count"]}')
+        lines.append(f'krishimitra_request_duration_seconds_sum{{{label}}} {stats["seconds"]:.6f}')
+        lines.append(f'krishimitra_request_duration_seconds_count{{{label}}} {stats["count"]}')
+
+    counters = [
+        ('firestore_rpcs_total', 'rpcs', 'Firestore RPCs sent.'),
+        ('firestore_documents_read_total', 'reads', 'Firestore documents read (billed reads).'),
+        ('firestore_documents_written_total', 'writes', 'Firestore documents written.'),
+        ('model_seconds_total', 'model', 'Time spent waiting on the model.'),
+        ('template_render_seconds_total', 'render', 'Time spent rendering templates.'),
+    ]
+    for name, key, help_text in counters:
+        lines += [f'# HELP krishimitra_{name} {help_text}', f'# TYPE krishimitra_{name} counter']
+        for route, stats in sorted(routes.items()):
+            lines.append(f'krishimitra_{name}{{route="{_label(route)}"}} {stats[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_token_required(view):
+    """Answer 403 unless the request carries ``METRICS_TOKEN`` (when set)."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            return Response('Forbidden\n', status=403, mimetype='text/plain')
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@metrics_token_required
+def metrics_view():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def _configure_logger(logger, level):
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+
+
+def init_app(app):
+    """Register the request hooks and the ``/metrics`` endpoint on ``app``."""
+    _configure_logger(request_log, logging.INFO)
+    _configure_logger(profile_log, logging.WARNING)
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,232 @@
+"""Background diagnosis jobs.
+
+``enqueue`` writes a job to a SQLite table and returns its id straight away.
+A small pool of worker threads in every process claims queued jobs from that
+table, calls the model with timeouts, and retries transient failures with
+exponential backoff. Because the queue is on disk and shared, jobs survive a
+worker restart: anything still ``running`` after ``LEASE_SECONDS`` is put
+back in the queue, or failed once it has had ``MAX_ATTEMPTS`` tries.
+
+Settings (environment): ``JOBS_DB`` for the SQLite path, ``DIAGNOSIS_WORKERS``
+for threads per process (0 disables the workers in this process).
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from . import diagnosis
+
+DB_PATH = os.environ.get('JOBS_DB', os.path.join(os.path.dirname(__file__), 'jobs.sqlite3'))
+NUM_WORKERS = int(os.environ.get('DIAGNOSIS_WORKERS', 4))
+MAX_QUEUE = 200
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 2       # seconds, doubled per attempt
+LEASE_SECONDS = 180    # a running job older than this is assumed orphaned
+POLL_INTERVAL = 0.5
+KEEP_FINISHED = 24 * 3600
+
+_local = threading.local()
+_wakeup = threading.Event()
+_workers = []
+_lock = threading.Lock()
+_latencies = deque(maxlen=500)  # (queue wait, run time) of recent finished jobs
+_counts = {'done': 0, 'failed': 0, 'retried': 0}
+
+
+def _reset_after_fork():
+    # sqlite connections must not be carried across fork(), and the
+    # parent's worker threads don't exist in the child
+    global _local, _lock
+    _local = threading.local()
+    _lock = threading.Lock()
+    _workers.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=5, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL,'
+            ' result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,'
+            ' created_at REAL NOT NULL, run_after REAL NOT NULL,'
+            ' started_at REAL, finished_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, run_after)')
+        _local.conn = conn
+    return conn
+
+
+def queue_depth():
+    return _connect().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+
+def enqueue(image_b64, mime_type, cache_key, image_hash):
+    """Queue a diagnosis and return the job id. Raises QueueFull."""
+    if queue_depth() >= MAX_QUEUE:
+        raise QueueFull()
+    job_id = uuid.uuid4().hex
+    payload = {
+        'image': image_b64,
+        'mime_type': mime_type,
+        'cache_key': cache_key,
+        'image_hash': image_hash,
+    }
+    now = time.time()
+    _connect().execute(
+        "INSERT INTO jobs (id, status, payload, created_at, run_after) VALUES (?, 'queued', ?, ?, ?)",
+        (job_id, json.dumps(payload), now, now),
+    )
+    _wakeup.set()
+    return job_id
+
+
+def get(job_id):
+    """Public view of a job: id, status and result or error. None if unknown."""
+    row = _connect().execute(
+        'SELECT id, status, result, error, attempts, created_at, finished_at FROM jobs WHERE id = ?',
+        (job_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    job = {'id': row['id'], 'status': row['status'], 'attempts': row['attempts']}
+    if row['status'] == 'done':
+        job['result'] = json.loads(row['result'])
+    elif row['status'] == 'failed':
+        job['error'] = row['error']
+    return job
+
+
+def _claim():
+    conn = _connect()
+    now = time.time()
+    # Orphaned jobs (their worker died mid-call) go back in the queue,
+    # unless they have had all their attempts
+    expired = conn.execute(
+        "UPDATE jobs SET status = 'failed', error = 'Diagnosis did not finish', finished_at = ?"
+        " WHERE status = 'running' AND started_at < ? AND attempts >= ?",
+        (now, now - LEASE_SECONDS, MAX_ATTEMPTS),
+    ).rowcount
+    if expired:
+        with _lock:
+            _counts['failed'] += expired
+    conn.execute(
+        "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND started_at < ?",
+        (now - LEASE_SECONDS,),
+    )
+    return conn.execute(
+        "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1"
+        " WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ?"
+        "             ORDER BY run_after LIMIT 1)"
+        " RETURNING id, payload, attempts, created_at",
+        (now, now),
+    ).fetchone()
+
+
+def _finish(job, status, result=None, error=None):
+    now = time.time()
+    _connect().execute(
+        'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+        (status, json.dumps(result) if result is not None else None, error, now, job['id']),
+    )
+    with _lock:
+        _counts[status] += 1
+        _latencies.append((now - job['created_at'], now - job['started_at']))
+
+
+def _run(job):
+    payload = json.loads(job['payload'])
+    try:
+        result = diagnosis.call_model(payload['image'], payload['mime_type'])
+    except Exception as e:
+        if not isinstance(e, diagnosis.DiagnosisError):
+            # A bug or an unexpected reply: retried like a transient error,
+            # so the job still ends up failed after MAX_ATTEMPTS
+            print(f"Diagnosis job {job['id']} error: {e!r}")
+            e = diagnosis.DiagnosisError('Diagnosis failed', retryable=True)
+        if e.retryable and job['attempts'] < MAX_ATTEMPTS:
+            delay = BACKOFF_BASE * 2 ** (job['attempts'] - 1) * random.uniform(0.8, 1.2)
+            _connect().execute(
+                "UPDATE jobs SET status = 'queued', run_after = ?, error = ? WHERE id = ?",
+                (time.time() + delay, str(e), job['id']),
+            )
+            with _lock:
+                _counts['retried'] += 1
+            return
+        _finish(job, 'failed', error=str(e))
+        return
+
+    diagnosis.remember(payload['cache_key'], payload['image_hash'], result)
+    _finish(job, 'done', result=result)
+
+
+def _worker():
+    last_cleanup = 0
+    while True:
+        try:
+            row = _claim()
+            if row is None:
+                if time.time() - last_cleanup > 3600:
+                    _connect().execute(
+                        "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                        (time.time() - KEEP_FINISHED,),
+                    )
+                    last_cleanup = time.time()
+                _wakeup.wait(POLL_INTERVAL)
+                _wakeup.clear()
+                continue
+            job = dict(row, started_at=time.time())
+            _run(job)
+        except Exception as e:
+            print(f"Diagnosis worker error: {e}")
+            time.sleep(POLL_INTERVAL)
+
+
+def start():
+    """Start this process's worker threads (idempotent)."""
+    with _lock:
+        if _workers:
+            return
+        for i in range(NUM_WORKERS):
+            t = threading.Thread(target=_worker, name=f'diagnosis-{i}', daemon=True)
+            t.start()
+            _workers.append(t)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 3)
+
+
+def metrics():
+    conn = _connect()
+    by_status = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+    with _lock:
+        waits = [w for w, _ in _latencies]
+        runs = [r for _, r in _latencies]
+        counts = dict(_counts)
+    return {
+        'queue_depth': by_status.get('queued', 0),
+        'running': by_status.get('running', 0),
+        'workers': len(_workers),
+        'processed': counts,
+        'wait_seconds': {'p50': _percentile(waits, 50), 'p95': _percentile(waits, 95)},
+        'run_seconds': {'p50': _percentile(runs, 50), 'p95': _percentile(runs, 95)},
+    }
@@ -0,0 +1,309 @@
+"""Indexed, paginated queries over ``marketplace_items``.
+
+Category is pushed into Firestore as a composite-index query (see
+``firestore.indexes.json``), and name/location search uses the
+``name_tokens`` / ``location_tokens`` arrays written alongside every listing:
+each holds the lowercase word prefixes of the field, so "tom" matches
+"Tomato" through a single ``array_contains`` lookup instead of a full scan.
+The price range is checked on each result rather than in the query, since
+a range filter would make Firestore order by price and results are always
+newest first.
+
+Results come back one page at a time. The page token is an opaque string
+carrying the id of the last listing shown (used as the ``start_after``
+cursor) and the total estimate from the first page.
+"""
+import base64
+import json
+import re
+
+import click
+from firebase_admin import firestore
+
+from . import blobs, db, geo, stats, sync, users, versions
+
+COLLECTION = 'marketplace_items'
+# What a listing card shows; the JSON API sends only these
+CARD_FIELDS = ['name', 'price', 'unit', 'location', 'category', 'seller', 'seller_phone', 'thumb', 'image']
+DEFAULT_IMAGE = "https://images.unsplash.com/photo-1574323347407-f5e1ad6d020b?auto=format&fit=crop&w=400&q=80"
+PAGE_SIZE = 20
+MAX_PREFIX_LEN = 15
+# Only one array_contains is allowed per query, so any extra search words
+# (and the price range) are checked in Python. Stop after this many
+# batches to bound reads.
+MAX_SCAN_BATCHES = 5
+# A "near" search reads at most this many listings from its geohash cells
+MAX_NEARBY_READS = 100
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def prefixes(text):
+    out = set()
+    for word in tokenize(text):
+        for i in range(1, min(len(word), MAX_PREFIX_LEN) + 1):
+            out.add(word[:i])
+    return sorted(out)
+
+
+def index_fields(name, location):
+    """Search fields to store on a listing with this name and location,
+    its geocoded position included."""
+    return dict({
+        'name_tokens': prefixes(name),
+        'location_tokens': prefixes(location),
+    }, **geo.fields(location))
+
+
+def parse_price(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def encode_page_token(last_id, total):
+    raw = json.dumps({'after': last_id, 'total': total}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_page_token(token):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return data['after'], data.get('total')
+    except Exception:
+        return None, None
+
+
+def build_query(category='', search='', location=''):
+    """Return ``(query, extra_terms)`` for the given filters, newest first.
+
+    ``extra_terms`` is a list of ``(field, token)`` pairs that could not be
+    pushed into Firestore and must be checked against each result.
+    """
+    query = db.collection(COLLECTION)
+
+    if category and category != 'All':
+        query = query.where('category', '==', category)
+
+    terms = [('name_tokens', w[:MAX_PREFIX_LEN]) for w in tokenize(search)]
+    terms += [('location_tokens', w[:MAX_PREFIX_LEN]) for w in tokenize(location)]
+    extra_terms = []
+    if terms:
+        # The longest token is the most selective one to give to the index
+        terms.sort(key=lambda t: len(t[1]), reverse=True)
+        field, token = terms[0]
+        query = query.where(field, 'array_contains', token)
+        extra_terms = terms[1:]
+
+    query = query.order_by('created_at', direction=firestore.Query.DESCENDING)
+
+    return query, extra_terms
+
+
+def _matches(item, extra_terms):
+    return all(token in item.get(field, []) for field, token in extra_terms)
+
+
+def _in_price_range(item, min_price, max_price):
+    price = item.get('price', 0)
+    return (min_price is None or price >= min_price) and (max_price is None or price <= max_price)
+
+
+def search_nearby(near, radius_km=geo.DEFAULT_RADIUS_KM, search='', category='', location='',
+                  min_price=None, max_price=None, page_size=PAGE_SIZE):
+    """Listings within ``radius_km`` of ``near`` (``(lat, lng)``), nearest
+    first, each with its ``distance_km``.
+
+    Runs one ``geohash`` prefix range per cell around the point (see
+    ``geo``), with the category pushed into the query and the other filters
+    checked here. Reads are capped at ``MAX_NEARBY_READS``, so in a dense
+    area this is the nearest of the listings read rather than of all of
+    them; the in-process index has no such limit. There is one page only.
+    """
+    lat, lng = near
+    cells = geo.covering_cells(lat, lng, radius_km)
+    terms = [('name_tokens', w[:MAX_PREFIX_LEN]) for w in tokenize(search)]
+    terms += [('location_tokens', w[:MAX_PREFIX_LEN]) for w in tokenize(location)]
+    found = []
+    for cell in cells:
+        query = db.collection(COLLECTION)
+        if category and category != 'All':
+            query = query.where('category', '==', category)
+        query = (query.where('geohash', '>=', cell).where('geohash', '<', cell + '~')
+                 .limit(max(1, MAX_NEARBY_READS // len(cells))))
+        for doc in query.stream():
+            item = doc.to_dict()
+            if _in_price_range(item, min_price, max_price) and _matches(item, terms):
+                found.append(dict(item, id=doc.id))
+
+    if found:
+        distances = geo.distance_km(lat, lng, [item['lat'] for item in found], [item['lng'] for item in found])
+        found = sorted((dict(item, distance_km=round(float(d), 1)) for item, d in zip(found, distances)
+                        if d <= radius_km), key=lambda item: item['distance_km'])
+    return {'items': found[:page_size], 'next_page_token': None, 'total_estimate': len(found)}
+
+
+def search_listings(search='', category='', location='', min_price=None, max_price=None,
+                    near=None, radius_km=geo.DEFAULT_RADIUS_KM, page_token=None, page_size=PAGE_SIZE):
+    """Fetch one page of listings.
+
+    Returns a dict with ``items``, ``next_page_token`` (None on the last
+    page) and ``total_estimate`` (count of index matches, before any extra
+    search words or the price range are applied). With ``near`` see ``search_nearby``.
+    """
+    if near is not None:
+        return search_nearby(near, radius_km, search, category, location, min_price, max_price, page_size)
+    query, extra_terms = build_query(category, search, location)
+
+    cursor = None
+    total = None
+    if page_token:
+        last_id, total = decode_page_token(page_token)
+        if last_id:
+            cursor = db.collection(COLLECTION).document(last_id).get()
+            if not cursor.exists:
+                return {'items': [], 'next_page_token': None, 'total_estimate': total}
+
+    if total is None:
+        if not (search or location or (category and category != 'All')):
+            # Whole catalog: the home page counter already has it, without
+            # a count() billed per 1000 listings
+            total = stats.get_count('listings')
+        else:
+            total = query.count().get()[0][0].value
+
+    items = []
+    exhausted = False
+    for _ in range(MAX_SCAN_BATCHES):
+        batch_query = query.limit(page_size)
+        if cursor is not None:
+            batch_query = batch_query.start_after(cursor)
+        docs = list(batch_query.stream())
+
+        for doc in docs:
+            cursor = doc
+            item = doc.to_dict()
+            if not (_in_price_range(item, min_price, max_price) and _matches(item, extra_terms)):
+                continue
+            item['id'] = doc.id
+            items.append(item)
+            if len(items) == page_size:
+                break
+
+        if len(items) == page_size:
+            break
+        if len(docs) < page_size:
+            exhausted = True
+            break
+
+    next_token = None
+    if not exhausted and cursor is not None:
+        next_token = encode_page_token(cursor.id, total)
+
+    return {'items': items, 'next_page_token': next_token, 'total_estimate': total}
+
+
+def new_listing(fields, seller, seller_phone, image=DEFAULT_IMAGE, thumb=None):
+    """Build a listing from submitted ``fields`` (a form or JSON object).
+    Raises ValueError if the price isn't a whole number."""
+    price = fields.get('price')
+    return {
+        'name': fields.get('name'),
+        'price': int(price) if price else 0,
+        'unit': fields.get('unit'),
+        'location': fields.get('location'),
+        'category': fields.get('category'),
+        'description': fields.get('description'),
+        'seller': seller,
+        'seller_phone': seller_phone,
+        'image': image,
+        'thumb': thumb or image,
+    }
+
+
+def create_listing(item, batch=None):
+    """Add a listing with its search fields. Returns the new id.
+
+    With ``batch`` (a batch or transaction) the write is only queued; the
+    caller bumps the collection version once it has committed.
+    """
+    data = dict(item, created_at=firestore.SERVER_TIMESTAMP, updated_at=firestore.SERVER_TIMESTAMP)
+    data.update(index_fields(item.get('name'), item.get('location')))
+    ref = db.collection(COLLECTION).document()
+    writes = batch if batch is not None else db.batch()
+    writes.set(ref, data)
+    blobs.retain(writes, blobs.listing_keys(item))
+    if batch is None:
+        writes.commit()
+        versions.bump(COLLECTION)
+    return ref.id
+
+
+def get_listing(item_id):
+    doc = db.collection(COLLECTION).document(item_id).get()
+    return dict(doc.to_dict(), id=doc.id) if doc.exists else None
+
+
+def update_listing(item_id, updates, previous=None):
+    """Apply ``updates``. Pass the ``previous`` listing when the photo may
+    change, so the replaced files are released and collected."""
+    updates = dict(updates, updated_at=firestore.SERVER_TIMESTAMP)
+    if 'name' in updates or 'location' in updates:
+        updates.update(index_fields(updates.get('name'), updates.get('location')))
+    batch = db.batch()
+    batch.update(db.collection(COLLECTION).document(item_id), updates)
+    before = blobs.listing_keys(previous or {})
+    after = blobs.listing_keys(dict(previous or {}, **updates))
+    released = before - after
+    blobs.retain(batch, after - before)
+    blobs.release(batch, released)
+    batch.commit()
+    versions.bump(COLLECTION)
+    blobs.collect(released)
+
+
+def delete_listing(item_id, item=None):
+    """Delete a listing; with the ``item`` itself, its stored photo too if
+    no other listing shows it."""
+    released = blobs.listing_keys(item) if item else set()
+    batch = db.batch()
+    batch.delete(db.collection(COLLECTION).document(item_id))
+    sync.tombstone(batch, COLLECTION, item_id)
+    blobs.release(batch, released)
+    batch.commit()
+    versions.bump(COLLECTION)
+    blobs.collect(released)
+
+
+def seller_listings(phone):
+    # Unmigrated listings keep the number as typed
+    docs = db.collection(COLLECTION).where('seller_phone', 'in', users.phone_variants(phone)).stream()
+    return [dict(doc.to_dict(), id=doc.id) for doc in docs]
+
+
+def backfill_index_fields():
+    """Write search fields and position, and the ``updated_at`` delta sync
+    orders by, on every listing. Returns the number updated."""
+    updated = 0
+    batch = db.batch()
+    for doc in db.collection(COLLECTION).stream():
+        item = doc.to_dict()
+        fields = index_fields(item.get('name'), item.get('location'))
+        if 'updated_at' not in item:
+            fields['updated_at'] = item.get('created_at') or firestore.SERVER_TIMESTAMP
+        batch.update(doc.reference, fields)
+        updated += 1
+        if updated % 400 == 0:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    return updated
+
+
+@click.command('backfill-listing-index')
+def backfill_command():
+    """Add search token, position and sync fields to existing marketplace listings."""
+    click.echo(f"Updated {backfill_index_fields()} listings")
@@ -0,0 +1,562 @@
+"""Mandi (wholesale market) prices from Agmarknet CSV files.
+
+``flask ingest-mandi FILE...`` stream-parses daily price files, plain or
+gzipped, in either the data.gov.in or the Agmarknet report layout, into a
+columnar store under ``MANDI_DATA_DIR``. Each column is one ``.npy``
+array. The arrays are sorted by a packed commodity / market / day key,
+and JSON tables hold the names. One row is kept per commodity, market
+and day. Varieties are folded together: the lowest min, the highest max
+and the mean modal. A day that is ingested again replaces the stored
+one, so files can be loaded in any order, or loaded twice.
+
+An ingest writes a new store directory, then swaps the ``CURRENT``
+pointer. A worker sees the swap on its next lookup and maps the new
+arrays. The arrays are memory-mapped, so every worker on a host shares
+one copy in the page cache.
+
+Queries find their rows with ``searchsorted`` on the sorted key and
+aggregate with NumPy, so no request walks rows in Python. The fair-price
+hints shown on the marketplace are worked out once per store load.
+
+Prices are in rupees per quintal (100 kg), as published.
+"""
+import csv
+import functools
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import statistics
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import click
+import numpy as np
+
+from . import versions
+
+DATA_DIR = os.environ.get('MANDI_DATA_DIR', os.path.join(os.path.dirname(__file__), 'mandi_data'))
+VERSION = 'mandi'  # bumped in ``versions`` after an ingest, for page ETags
+CHUNK_ROWS = 500_000
+RECENT_DAYS = 14  # window the fair-price hints are taken from
+MAX_TREND_DAYS = 730
+KEEP_STORES = 2  # the previous store may still be mapped by a worker
+
+# Packed row key: commodity << 40 | market << 20 | day (days since 1970)
+_FIELD_BITS = 20
+_FIELD_MASK = (1 << _FIELD_BITS) - 1
+_EPOCH = date(1970, 1, 1)
+
+# Normalized CSV header -> column
+_HEADERS = {
+    'state': 'state', 'statename': 'state',
+    'district': 'district', 'districtname': 'district',
+    'market': 'market', 'marketname': 'market', 'apmc': 'market',
+    'commodity': 'commodity', 'commodityname': 'commodity',
+    'arrivaldate': 'date', 'pricedate': 'date', 'reporteddate': 'date', 'date': 'date',
+    'minprice': 'min', 'minimumprice': 'min',
+    'maxprice': 'max', 'maximumprice': 'max',
+    'modalprice': 'modal',
+}
+_DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d %b %Y', '%d-%b-%Y', '%d/%m/%y')
+
+# Listing unit -> quintals, for hints in the seller's unit
+UNIT_QUINTALS = {'kg': 0.01, 'kgs': 0.01, 'quintal': 1, 'qtl': 1, 'q': 1, 'ton': 10, 'tonne': 10, 'tons': 10}
+
+
+class UnknownName(KeyError):
+    """No such commodity or market in the store."""
+
+
+def _header_name(raw):
+    name = raw.lower().replace('_x0020_', '')
+    name = re.sub(r'\(.*?\)', '', name)  # "Modal Price (Rs./Quintal)"
+    return re.sub(r'[^a-z]', '', name)
+
+
+@functools.lru_cache(maxsize=8192)
+def _day(text):
+    # A file holds a few dates over millions of rows; parse each once
+    for format in _DATE_FORMATS:
+        try:
+            return (datetime.strptime(text.strip(), format).date() - _EPOCH).days
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognized date {text!r}")
+
+
+def to_date(day):
+    return _EPOCH + timedelta(days=int(day))
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8-sig', newline='')
+    return open(path, encoding='utf-8-sig', newline='')
+
+
+class _Names:
+    """Name -> code tables, extended as files introduce new names."""
+
+    def __init__(self, commodities=(), markets=()):
+        self.commodities = list(commodities)
+        self.markets = [list(market) for market in markets]  # [name, district, state]
+        self._commodity_ids = {name.lower(): i for i, name in enumerate(self.commodities)}
+        self._market_ids = {market[0].lower(): i for i, market in enumerate(self.markets)}
+
+    def commodity(self, name):
+        name = ' '.join(name.split())
+        code = self._commodity_ids.get(name.lower())
+        if code is None:
+            code = self._commodity_ids[name.lower()] = len(self.commodities)
+            self.commodities.append(name)
+        return code
+
+    def market(self, name, district, state):
+        name = ' '.join(name.split())
+        code = self._market_ids.get(name.lower())
+        if code is None:
+            code = self._market_ids[name.lower()] = len(self.markets)
+            self.markets.append([name, district.strip(), state.strip()])
+        elif district and not self.markets[code][1]:
+            self.markets[code][1:] = [district.strip(), state.strip()]
+        return code
+
+
+def read_csv(path, names):
+    """Yield ``(key, min, max, modal)`` array chunks from one price file.
+
+    Rows with a missing or unreadable date or price are skipped and counted
+    in the returned generator's ``StopIteration`` value.
+    """
+    skipped = 0
+    with _open(path) as f:
+        reader = csv.reader(f)
+        header = [_HEADERS.get(_header_name(column)) for column in next(reader, [])]
+        missing = {'market', 'commodity', 'date', 'modal'} - set(header)
+        if missing:
+            raise click.ClickException(f"{path}: no {', '.join(sorted(missing))} column")
+        col = {name: header.index(name) for name in header if name}
+        i_state, i_district = col.get('state'), col.get('district')
+        i_min, i_max = col.get('min', col['modal']), col.get('max', col['modal'])
+
+        # Names repeat on every row; resolve each spelling once
+        market_codes, commodity_codes = {}, {}
+        i_market, i_commodity, i_date, i_modal = col['market'], col['commodity'], col['date'], col['modal']
+        keys, lows, highs, modals = [], [], [], []
+        for row in reader:
+            try:
+                modal = float(row[i_modal])
+                low = float(row[i_min] or modal)
+                high = float(row[i_max] or modal)
+                day = _day(row[i_date])
+                place = (row[i_market], row[i_district] if i_district is not None else '',
+                         row[i_state] if i_state is not None else '')
+                market = market_codes.get(place)
+                if market is None:
+                    market = market_codes[place] = names.market(*place)
+                commodity = commodity_codes.get(row[i_commodity])
+                if commodity is None:
+                    commodity = commodity_codes[row[i_commodity]] = names.commodity(row[i_commodity])
+            except (ValueError, IndexError):
+                skipped += 1
+                continue
+            if modal <= 0:
+                skipped += 1
+                continue
+            keys.append(commodity << 2 * _FIELD_BITS | market << _FIELD_BITS | day)
+            lows.append(low)
+            highs.append(high)
+            modals.append(modal)
+            if len(keys) == CHUNK_ROWS:
+                yield _chunk(keys, lows, highs, modals)
+                keys, lows, highs, modals = [], [], [], []
+        if keys:
+            yield _chunk(keys, lows, highs, modals)
+    return skipped
+
+
+def _chunk(keys, lows, highs, modals):
+    return (np.array(keys, dtype=np.int64), np.array(lows, dtype=np.float32),
+            np.array(highs, dtype=np.float32), np.array(modals, dtype=np.float32))
+
+
+def _fold(key, low, high, modal):
+    """Sort by key and merge rows sharing one (varieties of a commodity)."""
+    order = np.argsort(key, kind='stable')
+    key, low, high, modal = key[order], low[order], high[order], modal[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    counts = np.diff(np.r_[starts, len(key)])
+    return (key[starts], np.minimum.reduceat(low, starts), np.maximum.reduceat(high, starts),
+            (np.add.reduceat(modal.astype(np.float64), starts) / counts).astype(np.float32))
+
+
+def ingest(paths, data_dir=DATA_DIR):
+    """Add price files to the store. Returns ``(rows read, rows skipped, rows stored)``."""
+    store = _load(data_dir)
+    names = _Names(store.commodities, store.markets) if store else _Names()
+
+    chunks, skipped = [], 0
+    for path in paths:
+        reader = read_csv(path, names)
+        while True:
+            try:
+                chunks.append(next(reader))
+            except StopIteration as done:
+                skipped += done.value or 0
+                break
+    read = sum(len(chunk[0]) for chunk in chunks)
+    if not chunks:
+        return 0, skipped, len(store.key) if store else 0
+
+    new = _fold(*(np.concatenate(column) for column in zip(*chunks)))
+    if store:
+        # A re-published day replaces what was stored for it
+        keep = ~np.isin(store.key, new[0], assume_unique=True)
+        columns = [np.concatenate([np.asarray(old)[keep], fresh])
+                   for old, fresh in zip((store.key, store.low, store.high, store.modal), new)]
+        order = np.argsort(columns[0], kind='stable')
+        new = [column[order] for column in columns]
+
+    _write(data_dir, new, names)
+    versions.bump(VERSION)
+    return read, skipped, len(new[0])
+
+
+def _write(data_dir, columns, names):
+    os.makedirs(data_dir, exist_ok=True)
+    name = f"store-{time.time_ns()}"
+    path = os.path.join(data_dir, name)
+    os.makedirs(path)
+    for column, values in zip(('key', 'low', 'high', 'modal'), columns):
+        np.save(os.path.join(path, f'{column}.npy'), values)
+    with open(os.path.join(path, 'names.json'), 'w') as f:
+        json.dump({'commodities': names.commodities, 'markets': names.markets}, f)
+
+    pointer = os.path.join(data_dir, 'CURRENT')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(name)
+    os.replace(pointer + '.tmp', pointer)
+
+    stores = sorted(entry for entry in os.listdir(data_dir) if entry.startswith('store-'))
+    for old in stores[:-KEEP_STORES]:
+        shutil.rmtree(os.path.join(data_dir, old), ignore_errors=True)
+
+
+def _base_names(commodity):
+    """Lowercase names a listing may use for a commodity:
+    "Bhindi(Ladies Finger)" -> ["bhindi", "ladies finger"]."""
+    parts = re.split(r'[()]', commodity.lower())
+    return [' '.join(re.findall(r'[a-z]+', part)) for part in parts if re.search(r'[a-z]', part)]
+
+
+class Store:
+    """One ingested store, memory-mapped."""
+
+    def __init__(self, path):
+        self.id = os.path.basename(path)
+        self.key, self.low, self.high, self.modal = (
+            np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')
+            for column in ('key', 'low', 'high', 'modal'))
+        with open(os.path.join(path, 'names.json')) as f:
+            tables = json.load(f)
+        self.commodities = tables['commodities']
+        self.markets = tables['markets']
+        self._commodity_ids = {name.lower(): i for i, name in enumerate(self.commodities)}
+        self._market_ids = {market[0].lower(): i for i, market in enumerate(self.markets)}
+        self._hints = None
+        self._phrases = None
+        self._hints_lock = threading.Lock()
+
+    def commodity_id(self, name):
+        try:
+            return self._commodity_ids[' '.join(str(name).split()).lower()]
+        except KeyError:
+            raise UnknownName(name)
+
+    def market_id(self, name):
+        try:
+            return self._market_ids[' '.join(str(name).split()).lower()]
+        except KeyError:
+            raise UnknownName(name)
+
+    def rows(self, commodity, market=None):
+        """The slice of rows for a commodity, or one of its markets."""
+        low = commodity << 2 * _FIELD_BITS
+        high = low + (1 << 2 * _FIELD_BITS)
+        if market is not None:
+            low |= market << _FIELD_BITS
+            high = low + (1 << _FIELD_BITS)
+        start, end = np.searchsorted(self.key, [low, high])
+        return slice(int(start), int(end))
+
+    def hints(self):
+        """``{commodity: {'market'|'district'|'state': {name: (modal, day)}, 'all': (modal, day)}}``."""
+        with self._hints_lock:
+            if self._hints is None:
+                self._hints = _build_hints(self)
+                # Phrase -> the commodity of that name reported by most markets
+                phrases = {}
+                for commodity in sorted(self._hints, key=lambda c: len(self._hints[c]['market'])):
+                    for phrase in _base_names(self.commodities[commodity]):
+                        phrases[phrase] = commodity
+                self._phrases = phrases
+            return self._hints
+
+    def match(self, name):
+        """Commodity id for a listing name like "Fresh Desi Tomato", or None."""
+        self.hints()
+        words = re.findall(r'[a-z]+', (name or '').lower())
+        # Longest phrase first, so "green chilli" wins over "chilli"
+        for size in (3, 2, 1):
+            for i in range(len(words) - size + 1):
+                commodity = self._phrases.get(' '.join(words[i:i + size]))
+                if commodity is not None:
+                    return commodity
+        return None
+
+
+def _build_hints(store):
+    """Median recent modal price per commodity at each level of place."""
+    key = np.asarray(store.key)
+    day = key & _FIELD_MASK
+    pair = key >> _FIELD_BITS  # commodity and market
+    # Each commodity's window ends at its own latest day
+    commodity = pair >> _FIELD_BITS
+    starts = np.flatnonzero(np.r_[True, commodity[1:] != commodity[:-1]])
+    latest = np.repeat(np.maximum.reduceat(day, starts), np.diff(np.r_[starts, len(day)]))
+    recent = day > latest - RECENT_DAYS
+
+    pair, day, modal = pair[recent], day[recent], np.asarray(store.modal)[recent]
+    if not len(pair):
+        return {}
+    starts = np.flatnonzero(np.r_[True, pair[1:] != pair[:-1]])
+    counts = np.diff(np.r_[starts, len(pair)])
+    means = np.add.reduceat(modal.astype(np.float64), starts) / counts
+    last_days = day[np.r_[starts[1:], len(pair)] - 1]
+
+    hints = {}
+    grouped = {}
+    for pair_key, price, last in zip(pair[starts].tolist(), means.tolist(), last_days.tolist()):
+        commodity, market = pair_key >> _FIELD_BITS, pair_key & _FIELD_MASK
+        name, district, state = store.markets[market]
+        entry = hints.setdefault(commodity, {'market': {}, 'district': {}, 'state': {}, 'all': None})
+        entry['market'][name.lower()] = (price, last)
+        places = grouped.setdefault(commodity, {'district': {}, 'state': {}, 'all': {}})
+        for level, place in (('district', district), ('state', state), ('all', '')):
+            if place or level == 'all':
+                values = places[level].setdefault(place.lower(), ([], []))
+                values[0].append(price)
+                values[1].append(last)
+
+    for commodity, places in grouped.items():
+        for level in ('district', 'state'):
+            hints[commodity][level] = {place: (statistics.median(prices), max(days))
+                                       for place, (prices, days) in places[level].items()}
+        prices, days = places['all']['']
+        hints[commodity]['all'] = (statistics.median(prices), max(days))
+    return hints
+
+
+_store = None
+_pointer = None  # (path, mtime) of the CURRENT file the store was loaded from
+_lock = threading.Lock()
+
+
+def _load(data_dir=DATA_DIR):
+    try:
+        with open(os.path.join(data_dir, 'CURRENT')) as f:
+            name = f.read().strip()
+        return Store(os.path.join(data_dir, name))
+    except FileNotFoundError:
+        return None
+
+
+def current():
+    """The latest ingested store, or None before the first ingest."""
+    global _store, _pointer
+    pointer = os.path.join(DATA_DIR, 'CURRENT')
+    try:
+        stamp = (pointer, os.stat(pointer).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    if stamp != _pointer:
+        with _lock:
+            if stamp != _pointer:
+                _store, _pointer = _load(), stamp
+    return _store
+
+
+def commodities():
+    """Commodity names with data, most reported first."""
+    store = current()
+    if store is None:
+        return []
+    commodity = np.asarray(store.key) >> 2 * _FIELD_BITS
+    counts = np.bincount(commodity, minlength=len(store.commodities))
+    return [store.commodities[i] for i in np.argsort(-counts, kind='stable') if counts[i]]
+
+
+def markets(commodity):
+    """Market names trading ``commodity``."""
+    store = current()
+    if store is None:
+        raise UnknownName(commodity)
+    rows = store.rows(store.commodity_id(commodity))
+    market = np.unique((np.asarray(store.key[rows]) >> _FIELD_BITS) & _FIELD_MASK)
+    return sorted(store.markets[i][0] for i in market.tolist())
+
+
+def trend(commodity, market=None, days=90, window=7):
+    """Daily min, max and modal prices over the last ``days`` days with data,
+    with a ``window``-day moving average of the modal price.
+
+    Without ``market`` the prices are across all markets: the lowest min,
+    the highest max and the mean modal of the day. Days without any report
+    are left out of ``points`` and of the average. Raises UnknownName.
+    """
+    store = current()
+    if store is None:
+        raise UnknownName(commodity)
+    commodity_id = store.commodity_id(commodity)
+    market_id = store.market_id(market) if market else None
+    rows = store.rows(commodity_id, market_id)
+    days = max(1, min(days, MAX_TREND_DAYS))
+    window = max(1, min(window, days))
+
+    day = np.asarray(store.key[rows]) & _FIELD_MASK
+    if not len(day):
+        raise UnknownName(market or commodity)
+    first = int(day.max()) - days + 1
+    recent = day >= first
+    index = (day[recent] - first).astype(np.intp)
+    low = np.asarray(store.low[rows])[recent]
+    high = np.asarray(store.high[rows])[recent]
+    modal = np.asarray(store.modal[rows])[recent].astype(np.float64)
+
+    reports = np.bincount(index, minlength=days)
+    daily_modal = np.bincount(index, weights=modal, minlength=days) / np.maximum(reports, 1)
+    daily_low = np.full(days, np.inf)
+    np.minimum.at(daily_low, index, low)
+    daily_high = np.full(days, -np.inf)
+    np.maximum.at(daily_high, index, high)
+
+    # Moving average over calendar days, counting only days with reports
+    traded = reports > 0
+    sums = np.r_[0, np.cumsum(np.where(traded, daily_modal, 0))]
+    counts = np.r_[0, np.cumsum(traded)]
+    upper = np.arange(1, days + 1)
+    lower = np.maximum(0, upper - window)
+    average = (sums[upper] - sums[lower]) / np.maximum(counts[upper] - counts[lower], 1)
+
+    points = [[to_date(first + i).isoformat(), round(float(daily_low[i])), round(float(daily_high[i])),
+               round(float(daily_modal[i])), round(float(average[i]))]
+              for i in np.flatnonzero(traded).tolist()]
+    modal_prices = daily_modal[traded]
+    return {
+        'commodity': store.commodities[commodity_id],
+        'market': store.markets[market_id][0] if market_id is not None else None,
+        'unit': 'Rs/quintal',
+        'window': window,
+        'fields': ['date', 'min', 'max', 'modal', 'average'],
+        'points': points,
+        'summary': {
+            'latest': points[-1][3] if points else None,
+            'change': round(float(modal_prices[-1] - modal_prices[0])) if len(modal_prices) > 1 else 0,
+            'low': round(float(daily_low[traded].min())) if points else None,
+            'high': round(float(daily_high[traded].max())) if points else None,
+        },
+    }
+
+
+def compare(commodity, market, limit=10):
+    """Latest modal price at ``market`` and at the markets nearest it: the
+    same district first, then the same state. Raises UnknownName."""
+    store = current()
+    if store is None:
+        raise UnknownName(commodity)
+    commodity_id = store.commodity_id(commodity)
+    home = store.market_id(market)
+    _, district, state = store.markets[home]
+
+    rows = store.rows(commodity_id)
+    key = np.asarray(store.key[rows])
+    market_ids = (key >> _FIELD_BITS) & _FIELD_MASK
+    last = np.flatnonzero(np.r_[market_ids[1:] != market_ids[:-1], True])  # latest row per market
+    latest = dict(zip(market_ids[last].tolist(), zip(np.asarray(store.modal[rows])[last].tolist(),
+                                                       (key[last] & _FIELD_MASK).tolist())))
+    if home not in latest:
+        raise UnknownName(market)
+    home_price = latest[home][0]
+
+    def rank(market_id):
+        _, other_district, other_state = store.markets[market_id]
+        near = 0 if district and other_district == district else 1 if state and other_state == state else 2
+        return near, -latest[market_id][0]
+
+    nearby = sorted((m for m in latest if m != home and rank(m)[0] < 2), key=rank)[:limit]
+    return {
+        'commodity': store.commodities[commodity_id],
+        'unit': 'Rs/quintal',
+        'fields': ['market', 'district', 'state', 'modal', 'date', 'difference'],
+        'market': [store.markets[home][0], district, state, round(home_price), to_date(latest[home][1]).isoformat(), 0],
+        'nearby': [[*store.markets[m], round(latest[m][0]), to_date(latest[m][1]).isoformat(),
+                    round(latest[m][0] - home_price)] for m in nearby],
+    }
+
+
+def price_hint(name, location, unit):
+    """A recent mandi price for a listing, in its own unit, or None.
+
+    Taken from the listing's market if it reports the commodity, else its
+    district, its state, or the whole country.
+    """
+    store = current()
+    factor = UNIT_QUINTALS.get((unit or '').strip().lower())
+    if store is None or factor is None:
+        return None
+    commodity = store.match(name)
+    if commodity is None:
+        return None
+    hint = store.hints()[commodity]
+    place = ' '.join((location or '').split()).lower()
+    for level in ('market', 'district', 'state'):
+        if place in hint[level]:
+            (price, day), scope = hint[level][place], location
+            break
+    else:
+        (price, day), scope = hint['all'], 'India'
+    return {
+        'price': round(price * factor, 2) if factor < 1 else round(price * factor),
+        'unit': unit,
+        'scope': scope,
+        'commodity': store.commodities[commodity],
+        'date': to_date(day),
+    }
+
+
+def price_hints(items):
+    """``{listing id: hint}`` for the listings that have one."""
+    hints = {}
+    for item in items:
+        try:
+            hint = price_hint(item.get('name'), item.get('location'), item.get('unit'))
+        except Exception as e:
+            print(f"Error computing price hint: {e}")
+            return hints
+        if hint:
+            hints[item['id']] = hint
+    return hints
+
+
+@click.command('ingest-mandi')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def ingest_command(paths):
+    """Load Agmarknet daily price CSV files (optionally gzipped)."""
+    started = time.perf_counter()
+    read, skipped, stored = ingest(paths)
+    click.echo(f"Read {read} rows ({skipped} skipped), store holds {stored} rows "
+               f"[{time.perf_counter() - started:.1f}s]")
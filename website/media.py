@@ -0,0 +1,63 @@
+"""Serves stored uploads (see ``blobs``) at ``/media/<key>``.
+
+A key is the hash of the file, so its URL always means the same bytes and
+responses are cacheable for a year as ``immutable``. Range requests are
+answered with 206 so a slow connection can resume a photo.
+
+With ``BLOB_ACCEL_PREFIX`` set (e.g. ``/_blobs/``), the app only checks the
+key and answers with an ``X-Accel-Redirect`` to that internal location, and
+nginx sends the file itself (ranges included) without tying up a worker::
+
+    location /_blobs/ { internal; alias /srv/krishimitra/blob_data/; }
+
+Otherwise the file is sent with ``send_file``, which hands it to the
+server's ``wsgi.file_wrapper`` (sendfile under gunicorn) for whole files.
+"""
+import io
+import os
+
+from flask import Blueprint, Response, abort, request, send_file
+
+from . import blobs
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+media = Blueprint('media', __name__)
+
+
+def _immutable(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+@media.route('/media/<string:key>')
+def blob(key):
+    if not blobs.KEY_PATTERN.fullmatch(key):
+        abort(404)
+    mimetype = blobs.MIME_TYPES.get(key.rsplit('.', 1)[1], 'application/octet-stream')
+    etag = key.split('.', 1)[0]
+    if request.if_none_match.contains(etag):
+        # Same key, same bytes: no need to look at the file
+        return _immutable(Response(status=304, headers={'ETag': f'"{etag}"'}))
+
+    store = blobs.store
+    if isinstance(store, blobs.LocalStore):
+        path = store.path(key)
+        accel = os.environ.get('BLOB_ACCEL_PREFIX')
+        if accel:
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = accel.rstrip('/') + '/' + os.path.relpath(path, store.root)
+            return _immutable(response)
+        if not os.path.exists(path):
+            abort(404)
+        source = path
+    else:
+        data = store.get(key)
+        if data is None:
+            abort(404)
+        source = io.BytesIO(data)
+
+    response = send_file(source, mimetype=mimetype, etag=etag, conditional=True, max_age=IMMUTABLE_MAX_AGE)
+    return _immutable(response)
@@ -0,0 +1,258 @@
+"""HTTP client for the Gemini API.
+
+One ``httpx.Client`` per process keeps TLS connections alive (over HTTP/2
+when the server offers it), so a diagnosis no longer pays a fresh handshake.
+Around it:
+
+* connect/read/write/pool timeouts on every call;
+* a semaphore capping concurrent model calls per process, so a slow upstream
+  can't tie up every request thread;
+* a circuit breaker: after ``FAILURE_THRESHOLD`` consecutive failures, calls
+  fail immediately for ``RESET_SECONDS``, then one trial call decides whether
+  to close it again;
+* latency and outcome counters, served by ``metrics``.
+
+``GEMINI_BASE_URL`` points the client elsewhere, e.g. at
+``benchmarks/stub_model_server.py`` for offline load tests.
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import httpx
+
+from . import instrumentation
+
+BASE_URL = os.environ.get('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com')
+MODEL = 'gemini-3-flash-preview'
+TIMEOUT = httpx.Timeout(connect=5, read=60, write=20, pool=5)
+MAX_CONCURRENCY = int(os.environ.get('MODEL_MAX_CONCURRENCY', 8))
+ACQUIRE_TIMEOUT = 10     # seconds to wait for a free slot before giving up
+FAILURE_THRESHOLD = 5
+RESET_SECONDS = 30
+
+
+class ModelError(Exception):
+    """The call failed. ``retryable`` is False only for client-side errors."""
+
+    def __init__(self, message, retryable=True, status_code=None, outcome=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status_code = status_code
+        self.outcome = outcome or f"http_{status_code}"
+
+
+class ModelUnavailable(ModelError):
+    """Failed fast without calling upstream (circuit open or no free slot)."""
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_seconds=RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def cancel_trial(self):
+        with self._lock:
+            self.trial_running = False
+
+    def record(self, success):
+        with self._lock:
+            self.trial_running = False
+            if success:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold or self.opened_at is not None:
+                    self.opened_at = time.monotonic()
+
+
+_client = None
+_client_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+breaker = CircuitBreaker()
+
+_metrics_lock = threading.Lock()
+_outcomes = Counter()
+_latencies = deque(maxlen=1000)
+_in_flight = 0
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(
+                    base_url=BASE_URL,
+                    http2=True,
+                    timeout=TIMEOUT,
+                    limits=httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY),
+                    headers={'Content-Type': 'application/json'},
+                )
+    return _client
+
+
+def _reset_after_fork():
+    # A forked child can't use the parent's connections or a lock that was
+    # held at fork time
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _record(outcome, elapsed=None):
+    with _metrics_lock:
+        _outcomes[outcome] += 1
+        if elapsed is not None:
+            _latencies.append(elapsed)
+    if elapsed is not None:
+        instrumentation.add_timing('model', elapsed)
+
+
+@contextmanager
+def _guarded():
+    """Admission control, circuit breaker bookkeeping and metrics for one call."""
+    global _in_flight
+    # Cheap check first so an open circuit fails fast without queueing
+    if breaker.state == 'open':
+        _record('circuit_open')
+        raise ModelUnavailable('Diagnosis service is temporarily unavailable')
+    if not _slots.acquire(timeout=ACQUIRE_TIMEOUT):
+        _record('busy')
+        raise ModelUnavailable('Diagnosis service is busy')
+    try:
+        if not breaker.allow():
+            _record('circuit_open')
+            raise ModelUnavailable('Diagnosis service is temporarily unavailable')
+
+        with _metrics_lock:
+            _in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        except ModelError as e:
+            # 4xx other than 429 is our fault, not a sign of upstream trouble
+            breaker.record(not e.retryable)
+            _record(e.outcome, time.perf_counter() - start)
+            raise
+        except BaseException:
+            # Caller went away mid-stream: says nothing about upstream health
+            breaker.cancel_trial()
+            raise
+        finally:
+            with _metrics_lock:
+                _in_flight -= 1
+        breaker.record(True)
+        _record('ok', time.perf_counter() - start)
+    finally:
+        _slots.release()
+
+
+def post(path, payload, api_key):
+    """POST ``payload`` to ``path`` and return the decoded JSON response."""
+    with _guarded():
+        return _send(path, payload, api_key)
+
+
+def _send(path, payload, api_key):
+    try:
+        response = get_client().post(path, params={'key': api_key}, json=payload)
+    except httpx.TimeoutException as e:
+        raise ModelError(f"Model request timed out: {e}", outcome='timeout') from e
+    except httpx.TransportError as e:
+        raise ModelError(f"Model request failed: {e}", outcome='transport_error') from e
+
+    _check_status(response)
+    try:
+        return response.json()
+    except ValueError as e:
+        raise ModelError('Model returned invalid JSON', outcome='bad_response') from e
+
+
+def _check_status(response):
+    if response.status_code == 429 or response.status_code >= 500:
+        raise ModelError(f"Model returned HTTP {response.status_code}", status_code=response.status_code)
+    if response.status_code >= 400:
+        raise ModelError(f"Model returned HTTP {response.status_code}: {response.text[:200]}",
+                         retryable=False, status_code=response.status_code)
+
+
+def generate_content(payload, api_key):
+    return post(f"/v1beta/models/{MODEL}:generateContent", payload, api_key)
+
+
+def stream_generate_content(payload, api_key):
+    """Yield the text of each chunk from ``streamGenerateContent`` as it arrives."""
+    with _guarded():
+        try:
+            with get_client().stream('POST', f"/v1beta/models/{MODEL}:streamGenerateContent",
+                                     params={'key': api_key, 'alt': 'sse'}, json=payload) as response:
+                if response.status_code >= 400:
+                    response.read()
+                    _check_status(response)
+                for line in response.iter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    try:
+                        chunk = json.loads(line[5:])
+                    except ValueError as e:
+                        raise ModelError('Model stream returned invalid JSON', outcome='bad_response') from e
+                    for candidate in chunk.get('candidates', [])[:1]:
+                        for part in candidate.get('content', {}).get('parts', []):
+                            if part.get('text'):
+                                yield part['text']
+        except httpx.TimeoutException as e:
+            raise ModelError(f"Model request timed out: {e}", outcome='timeout') from e
+        except httpx.TransportError as e:
+            raise ModelError(f"Model request failed: {e}", outcome='transport_error') from e
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 3)
+
+
+def metrics():
+    with _metrics_lock:
+        latencies = sorted(_latencies)
+        data = {
+            'outcomes': dict(_outcomes),
+            'in_flight': _in_flight,
+        }
+    data.update({
+        'circuit': breaker.state,
+        'consecutive_failures': breaker.failures,
+        'max_concurrency': MAX_CONCURRENCY,
+        'latency_seconds': {p: _percentile(latencies, int(p[1:])) for p in ('p50', 'p95', 'p99')},
+    })
+    return data
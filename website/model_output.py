@@ -0,0 +1,224 @@
+"""Parsing the diagnosis JSON the model writes.
+
+``parse`` handles a complete reply: it finds the JSON object wherever it
+sits (markdown fences, a sentence before it), repairs the usual defects
+(trailing commas, output cut off mid-object) and validates the result
+against the diagnosis schema.
+
+``IncrementalParser`` handles a streamed reply: feed it text chunks as they
+arrive and it reports each top-level field as soon as its value is
+complete, and each element of an array field (the treatments) one by one.
+"""
+import json
+import re
+
+SCHEMA_DEFAULTS = {
+    'name': 'Unknown',
+    'description': '',
+    'confidence': 0,
+    'treatments': [],
+}
+
+
+def _scan(text, start):
+    """Walk ``text`` from the '{' at ``start``.
+
+    Returns ``(end, stack, in_string)``: the index just past the matching
+    '}' (None if the object never closes), plus the open brackets and the
+    string state at the point scanning stopped.
+    """
+    stack = []
+    in_string = escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append(ch)
+        elif ch in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                return i + 1, stack, False
+    return None, stack, in_string
+
+
+_DANGLING_KEY = re.compile(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+
+
+def repair(fragment):
+    """Best-effort fix of a truncated or sloppy JSON object."""
+    end, stack, in_string = _scan(fragment, 0)
+    if end is not None:
+        fixed = fragment[:end]
+    else:
+        # Close a cut-off string, then drop a separator left by the cut
+        fixed = fragment + ('"' if in_string else '')
+        fixed = re.sub(r',\s*$', '', fixed.rstrip())
+        if stack and stack[-1] == '{':
+            # In an object a string right after '{' or ',' is a key; one
+            # without a value is dropped. Values and array items are kept.
+            fixed = _DANGLING_KEY.sub(lambda m: '{' if m.group(1) == '{' else '', fixed)
+        fixed += ''.join('}' if b == '{' else ']' for b in reversed(stack))
+    return re.sub(r',\s*([}\]])', r'\1', fixed)
+
+
+def validate(data):
+    """Coerce a parsed reply into the diagnosis schema."""
+    if not isinstance(data, dict):
+        raise ValueError('Diagnosis is not a JSON object')
+    result = dict(SCHEMA_DEFAULTS, **{k: v for k, v in data.items() if v is not None})
+
+    result['name'] = str(result['name']).strip() or SCHEMA_DEFAULTS['name']
+    result['description'] = str(result['description']).strip()
+
+    confidence = result['confidence']
+    if isinstance(confidence, str):
+        match = re.search(r'\d+(\.\d+)?', confidence)
+        confidence = float(match.group()) if match else 0
+    try:
+        confidence = float(confidence)
+    except (TypeError, ValueError):
+        confidence = 0
+    if 0 < confidence <= 1:
+        confidence *= 100  # model answered with a fraction
+    result['confidence'] = int(round(min(max(confidence, 0), 100)))
+
+    treatments = result['treatments']
+    if isinstance(treatments, str):
+        treatments = [line.strip(' -*•\t') for line in treatments.splitlines()]
+    if not isinstance(treatments, list):
+        treatments = [treatments]
+    result['treatments'] = [str(t).strip() for t in treatments if str(t).strip()]
+    return result
+
+
+def parse(text):
+    """Extract, repair and validate the diagnosis in a full model reply."""
+    start = text.find('{')
+    if start == -1:
+        raise ValueError('No JSON object in model reply')
+    end, _, _ = _scan(text, start)
+    fragment = text[start:end] if end is not None else text[start:]
+    try:
+        data = json.loads(fragment, strict=False)
+    except ValueError:
+        data = json.loads(repair(fragment), strict=False)
+    return validate(data)
+
+
+class IncrementalParser:
+    """Turns a stream of text chunks into field events.
+
+    ``feed`` returns a list of events:
+    ``{'field': key, 'value': value}`` once a top-level value is complete, and
+    ``{'item': key, 'value': value}`` for each element of a top-level array.
+    Schema fields are coerced as ``validate`` does, so a streamed value
+    matches the one in the final result.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.pos = 0
+        self.start = None     # index of the opening '{'
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.pair_start = None
+        self.array_key = None
+        self.item_start = None
+        self.done = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        events = []
+        text = self.text
+        while self.pos < len(text) and not self.done:
+            i, ch = self.pos, text[self.pos]
+            self.pos += 1
+
+            if self.start is None:
+                if ch == '{':
+                    self.start = i
+                    self.depth = 1
+                    self.pair_start = i + 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+
+            if ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                self.depth += 1
+                if ch == '[' and self.depth == 2:
+                    self.array_key = self._key(text[self.pair_start:i])
+                    self.item_start = i + 1
+            elif ch == ']':
+                if self.depth == 2 and self.array_key:
+                    self._emit_item(text[self.item_start:i], events)
+                    self.array_key = None
+                self.depth -= 1
+            elif ch == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    self._emit_field(text[self.pair_start:i], events)
+                    self.done = True
+            elif ch == ',':
+                if self.depth == 1:
+                    self._emit_field(text[self.pair_start:i], events)
+                    self.pair_start = i + 1
+                elif self.depth == 2 and self.array_key:
+                    self._emit_item(text[self.item_start:i], events)
+                    self.item_start = i + 1
+        return events
+
+    @staticmethod
+    def _key(pair):
+        match = re.match(r'\s*"((?:[^"\\]|\\.)*)"\s*:', pair)
+        return match.group(1) if match else None
+
+    def _emit_item(self, raw, events):
+        raw = raw.strip()
+        if not raw:
+            return
+        try:
+            value = json.loads(raw, strict=False)
+        except ValueError:
+            return
+        if isinstance(SCHEMA_DEFAULTS.get(self.array_key), list):
+            # Clean the item the way ``validate`` cleans the whole list
+            cleaned = validate({self.array_key: [value]})[self.array_key]
+            if not cleaned:
+                return
+            value = cleaned[0]
+        events.append({'item': self.array_key, 'value': value})
+
+    def _emit_field(self, raw, events):
+        if not raw.strip():
+            return
+        try:
+            pair = json.loads('{' + raw + '}', strict=False)
+        except ValueError:
+            return
+        for key, value in pair.items():
+            if key in SCHEMA_DEFAULTS:
+                # Same coercion as the final result (confidence clamped to 0-100)
+                value = validate({key: value})[key]
+            events.append({'field': key, 'value': value})
+
+    def result(self):
+        """Parse everything received so far as a complete diagnosis."""
+        return parse(self.text)
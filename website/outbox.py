@@ -0,0 +1,216 @@
+"""Writes queued by the PWA while offline, applied in one request.
+
+The service worker keeps new listings, posts, likes and comments made
+without a connection and sends them to ``POST /api/v1/batch`` when it
+comes back, instead of replaying each as its own request. An operation is
+``{"key": ..., "type": ..., "data": {...}}``, where ``type`` is one of
+``OPERATIONS`` and ``key`` is an idempotency key made by the client.
+
+A batch is applied in one Firestore transaction, together with a record of
+every key in it (``idempotency/<user>:<key>``). A batch that fails changes
+nothing and can simply be sent again; a batch that was applied but whose
+response was lost is answered from the records, so nothing is applied
+twice. Records carry an ``expire_at`` for a Firestore TTL policy.
+
+Writes that land in the same place are merged: the likes and comments on
+one post bump one counter shard. Posts only log their activity; ``scores``
+works out the author's Harvest Hero score from it later.
+
+Each operation gets a result, in order, with a ``status`` of:
+
+* ``applied``: done now; ``result`` holds what the client needs (new ids,
+  the comment as shown);
+* ``duplicate``: the key was applied before; ``result`` is the original;
+* ``rejected``: can never succeed (``error`` says why); drop it;
+* ``login_required``: keep it until the user has logged in again.
+"""
+import base64
+import binascii
+import io
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+from . import blobs, db, engagement, feed, images, listings, stats, versions
+
+COLLECTION = 'idempotency'
+RETENTION = timedelta(days=7)
+MAX_OPS = 100  # a transaction takes 500 writes; an operation needs up to 3
+MAX_IMAGE_BYTES = 8 * 1024 * 1024
+KEY_PATTERN = re.compile(r'[A-Za-z0-9_-]{8,64}')
+
+OPERATIONS = ('listing', 'post', 'like', 'comment')
+ANONYMOUS_OPERATIONS = ('like',)  # like_post doesn't ask for a login either
+
+
+class Rejected(ValueError):
+    """The operation is malformed and will never be applied."""
+
+
+def _record_ref(user, key):
+    return db.collection(COLLECTION).document(f"{user or 'anonymous'}:{key}")
+
+
+def _post_id(data):
+    post_id = data.get('post_id')
+    if not isinstance(post_id, str) or not post_id or '/' in post_id:
+        raise Rejected('post_id is required')
+    return post_id
+
+
+def _listing_photo(data):
+    """Save the listing's base64 ``image``, if any. Returns ``(image, thumb)`` URLs."""
+    encoded = data.get('image')
+    if not encoded:
+        return listings.DEFAULT_IMAGE, None
+    try:
+        raw = base64.b64decode(encoded.split(',', 1)[-1], validate=True)
+    except (binascii.Error, ValueError, AttributeError):
+        raise Rejected('image is not valid base64')
+    if len(raw) > MAX_IMAGE_BYTES:
+        raise Rejected('image is too large')
+    try:
+        # Stored by content, so a retried batch finds its own files again
+        full, thumb = images.submit(images.save_listing_photo, io.BytesIO(raw)).result()
+    except images.InvalidImage as e:
+        raise Rejected(f'unsupported image: {e}')
+    return blobs.url(full), blobs.url(thumb)
+
+
+def _prepare(op, user, user_name):
+    """Check one operation and build what it writes. Raises Rejected."""
+    kind, data = op['type'], op['data']
+    if kind == 'listing':
+        image, thumb = _listing_photo(data)
+        try:
+            return listings.new_listing(data, user_name, user, image, thumb)
+        except (TypeError, ValueError):
+            raise Rejected('price must be a whole number')
+    if kind == 'post':
+        if not data.get('title') or not data.get('content'):
+            raise Rejected('title and content are required')
+        return feed.new_post(data, user_name, user)
+    if kind == 'comment':
+        text = data.get('comment')
+        if not isinstance(text, str) or not text.strip():
+            raise Rejected('comment is required')
+        return _post_id(data), text
+    return _post_id(data)  # like
+
+
+def _parse(raw):
+    """Validate the shape of one raw operation. Raises Rejected."""
+    if not isinstance(raw, dict):
+        raise Rejected('operation must be an object')
+    key, kind, data = raw.get('key'), raw.get('type'), raw.get('data') or {}
+    if not isinstance(key, str) or not KEY_PATTERN.fullmatch(key):
+        raise Rejected('key must be 8-64 letters, digits, - or _')
+    if kind not in OPERATIONS:
+        raise Rejected(f"type must be one of {', '.join(OPERATIONS)}")
+    if not isinstance(data, dict):
+        raise Rejected('data must be an object')
+    return {'key': key, 'type': kind, 'data': data}
+
+
+def apply(raw_ops, user, user_name):
+    """Apply a batch for the logged-in ``user`` (None if logged out).
+
+    Returns one result dict per operation, in order. Raises if the
+    transaction fails, in which case nothing was applied.
+    """
+    results = [None] * len(raw_ops)
+    pending = []  # (index, op, prepared)
+    seen = {}
+    for i, raw in enumerate(raw_ops):
+        try:
+            op = _parse(raw)
+        except Rejected as e:
+            results[i] = {'key': raw.get('key') if isinstance(raw, dict) else None,
+                          'status': 'rejected', 'error': str(e)}
+            continue
+        if op['key'] in seen:
+            # Sent twice in one batch: the second is a repeat of the first
+            results[i] = {'key': op['key'], 'status': 'duplicate', 'of': seen[op['key']]}
+            continue
+        seen[op['key']] = i
+        if user is None and op['type'] not in ANONYMOUS_OPERATIONS:
+            results[i] = {'key': op['key'], 'status': 'login_required'}
+            continue
+        try:
+            pending.append((i, op, _prepare(op, user, user_name)))
+        except Rejected as e:
+            results[i] = {'key': op['key'], 'status': 'rejected', 'error': str(e)}
+
+    if pending:
+        changed = _commit(pending, user, user_name, results)
+        _after_commit(changed)
+
+    for i, result in enumerate(results):
+        if 'of' in result:
+            original = results[result['of']]
+            if original['status'] in ('applied', 'duplicate'):
+                results[i] = {'key': result['key'], 'status': 'duplicate', 'result': original['result']}
+            else:
+                results[i] = dict(original)
+    return results
+
+
+def _commit(pending, user, user_name, results):
+    """Run the transaction. Fills ``results`` for ``pending``; returns what changed."""
+    refs = {op['key']: _record_ref(user, op['key']) for _, op, _ in pending}
+
+    @firestore.transactional
+    def _apply(transaction):
+        changed = {'listings': 0, 'posts': 0, 'commented': set()}
+        snapshots = {snap.reference.path: snap for snap in transaction.get_all(list(refs.values()))}
+        counts = defaultdict(lambda: {'likes': 0, 'comments': 0})
+
+        for i, op, prepared in pending:
+            ref = refs[op['key']]
+            record = snapshots.get(ref.path)
+            if record is not None and record.exists:
+                results[i] = {'key': op['key'], 'status': 'duplicate', 'result': record.to_dict().get('result')}
+                continue
+
+            kind = op['type']
+            if kind == 'listing':
+                result = {'id': listings.create_listing(prepared, batch=transaction)}
+                changed['listings'] += 1
+            elif kind == 'post':
+                result = {'id': feed.add_post(prepared, batch=transaction)}
+                changed['posts'] += 1
+            elif kind == 'comment':
+                post_id, text = prepared
+                result = {'comment': engagement.queue_comment(transaction, post_id, user_name, text)}
+                counts[post_id]['comments'] += 1
+                changed['commented'].add(post_id)
+            else:
+                result = {}
+                counts[prepared]['likes'] += 1
+
+            transaction.set(ref, {
+                'type': kind,
+                'result': result,
+                'created_at': firestore.SERVER_TIMESTAMP,
+                'expire_at': datetime.now(timezone.utc) + RETENTION,
+            })
+            results[i] = {'key': op['key'], 'status': 'applied', 'result': result}
+
+        for post_id, amounts in counts.items():
+            engagement.bump_counts(post_id, batch=transaction, **amounts)
+        return changed
+
+    return _apply(db.transaction())
+
+
+def _after_commit(changed):
+    if changed['listings']:
+        stats.increment('listings', changed['listings'])
+        versions.bump(listings.COLLECTION)
+    if changed['posts'] or changed['commented']:
+        versions.bump(feed.COLLECTION)
+    if changed['posts']:
+        feed.invalidate()
+    for post_id in changed['commented']:
+        feed.invalidate(post_id)
@@ -0,0 +1,316 @@
+"""Harvest Hero scores, derived from an append-only activity log.
+
+Posting used to read the author's document, work out streak points in
+Python and write ``community_score`` back, outside any transaction. Now a
+post only appends ``activity/<post id>`` in the same batch as the post, and
+scores are worked out here, in bulk, from that log.
+
+The rule is the old one: 2 points for each day with a post, less one for
+each day missed in between, except that missed days now count every day
+rather than only when the user posts again. For a user whose ``n`` posting
+days run from day ``first`` to day ``last``, the score on ``today`` is::
+
+    3n - (today - first) - (1 if last == today else 0)
+
+so a user is fully described by ``[n, first, last, name]``. Those rows live
+in ``scores/shard-<k>`` documents (users hashed over ``SHARDS``), and the
+``LEADERBOARD_SIZE`` best are copied into ``scores/leaderboard``, the only
+document the community page reads. Since decay takes a point a day from
+everyone, the order changes with the date only for people posting today;
+readers score the stored rows for the current day themselves, so a board
+computed yesterday is still right today.
+
+``recompute()`` reads the activity appended since its watermark, folds it
+into the shards with numpy and rewrites the leaderboard, in one
+transaction guarded by the watermark, so concurrent runs can't apply the
+same events twice. Every worker runs it every ``SCORES_INTERVAL`` seconds
+(environment, 0 disables); with nothing new it costs two reads.
+``replay()`` rebuilds everything from the whole log, which also picks up
+the rare event that arrived after the watermark passed it.
+
+``flask recompute-scores`` runs either by hand; ``--backfill`` first logs
+posts written before the activity log existed.
+"""
+import os
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import click
+import numpy as np
+from firebase_admin import firestore
+
+from . import db, versions
+
+COLLECTION = 'scores'
+ACTIVITY = 'activity'
+SHARDS = 32  # ~80 bytes a user, so a 1 MiB shard holds over 10k users
+LEADERBOARD_SIZE = 50
+PAGE_SIZE = 1000
+SETTLE = timedelta(seconds=30)  # commits this recent may not be visible yet
+DAY_OFFSET = timedelta(hours=5, minutes=30)  # days are counted in India time
+INTERVAL = int(os.environ.get('SCORES_INTERVAL', 300))
+
+_NO_DAY = np.iinfo(np.int32).max
+_thread = None
+
+
+def _reset_after_fork():
+    # The parent's thread doesn't exist in the child
+    global _thread
+    _thread = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def day_number(moment):
+    """Days since the epoch, in India time."""
+    return (moment + DAY_OFFSET).toordinal() - 719163  # date(1970, 1, 1).toordinal()
+
+
+def today():
+    return day_number(datetime.now(timezone.utc))
+
+
+def score(n, first, last, day):
+    return 3 * n - (day - first) - (1 if last == day else 0)
+
+
+def log_post(batch, post_id, user_id, name):
+    """Queue the activity entry for a new post in ``batch``."""
+    batch.set(db.collection(ACTIVITY).document(post_id), {
+        'type': 'post',
+        'user_id': user_id,
+        'name': name,
+        'at': firestore.SERVER_TIMESTAMP,
+    })
+
+
+def _shard(user_id):
+    return zlib.crc32(user_id.encode()) % SHARDS
+
+
+def _shard_ref(k):
+    return db.collection(COLLECTION).document(f"shard-{k}")
+
+
+def _shard_refs():
+    return [_shard_ref(k) for k in range(SHARDS)]
+
+
+class _Table:
+    """Every user's ``[n, first, last]`` as arrays, plus ids and names."""
+
+    def __init__(self, rows=()):
+        rows = list(rows)
+        self.ids = [user_id for user_id, _ in rows]
+        self.names = [row[3] for _, row in rows]
+        self.index = {user_id: i for i, user_id in enumerate(self.ids)}
+        self.n = np.array([row[0] for _, row in rows], dtype=np.int64)
+        self.first = np.array([row[1] for _, row in rows], dtype=np.int64)
+        self.last = np.array([row[2] for _, row in rows], dtype=np.int64)
+        self.shards = np.array([_shard(user_id) for user_id in self.ids], dtype=np.int64)
+
+    def add_users(self, user_ids):
+        new = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in self.index]
+        for user_id in new:
+            self.index[user_id] = len(self.ids)
+            self.ids.append(user_id)
+            self.names.append(None)
+        self.n = np.concatenate([self.n, np.zeros(len(new), dtype=np.int64)])
+        self.first = np.concatenate([self.first, np.full(len(new), _NO_DAY, dtype=np.int64)])
+        self.last = np.concatenate([self.last, np.full(len(new), -1, dtype=np.int64)])
+        self.shards = np.concatenate([self.shards, np.array([_shard(user_id) for user_id in new], dtype=np.int64)])
+
+    def fold(self, events):
+        """Apply ``(user_id, name, day)`` events in log order. Returns the touched shards."""
+        if not events:
+            return set()
+        user_ids = [user_id for user_id, _, _ in events]
+        self.add_users(user_ids)
+        for user_id, name, _ in events:
+            if name:
+                self.names[self.index[user_id]] = name
+        rows = np.fromiter((self.index[user_id] for user_id in user_ids), dtype=np.int64, count=len(events))
+        days = np.fromiter((day for _, _, day in events), dtype=np.int64, count=len(events))
+
+        # One entry per (user, day); only days after a user's last counted
+        # day are new. An older day was either counted already or arrived
+        # late, and is left for replay
+        pairs = np.unique(rows << 32 | days)
+        rows, days = pairs >> 32, pairs & 0xFFFFFFFF
+        fresh = days > self.last[rows]
+        rows, days = rows[fresh], days[fresh]
+        self.n += np.bincount(rows, minlength=len(self.ids))
+        np.maximum.at(self.last, rows, days)
+        np.minimum.at(self.first, rows, days)
+        return set(np.unique(self.shards[rows]).tolist())
+
+    def top(self, day, size=LEADERBOARD_SIZE):
+        """Rows of the ``size`` best scores on ``day``, best first."""
+        counted = np.flatnonzero(self.n)
+        scores = 3 * self.n[counted] - (day - self.first[counted]) - (self.last[counted] == day)
+        if len(counted) > size:
+            keep = np.argpartition(-scores, size - 1)[:size]
+            counted, scores = counted[keep], scores[keep]
+        # Ties go to the most recently active
+        order = np.lexsort((-self.last[counted], -scores))
+        return [self.row(i) for i in counted[order]]
+
+    def row(self, i):
+        return {'user_id': self.ids[i], 'name': self.names[i], 'days': int(self.n[i]),
+                'first': int(self.first[i]), 'last': int(self.last[i])}
+
+    def shard(self, k):
+        return {self.ids[i]: [int(self.n[i]), int(self.first[i]), int(self.last[i]), self.names[i]]
+                for i in np.flatnonzero(self.shards == k)}
+
+
+def _read_events(since, until):
+    """``(user_id, name, day)`` for activity logged in ``(since, until]``, oldest first."""
+    query = db.collection(ACTIVITY).select(['user_id', 'name', 'at']).order_by('at')
+    if since is not None:
+        query = query.where('at', '>', since)
+    query = query.where('at', '<=', until)
+    events, cursor = [], None
+    while True:
+        page = query.start_after(cursor) if cursor is not None else query
+        docs = list(page.limit(PAGE_SIZE).stream())
+        for doc in docs:
+            data = doc.to_dict()
+            if data.get('user_id') and data.get('at'):
+                events.append((data['user_id'], data.get('name'), day_number(data['at'])))
+        if len(docs) < PAGE_SIZE:
+            return events
+        cursor = docs[-1]
+
+
+def _write_board(batch, table, day, watermark):
+    leaders = table.top(day)
+    batch.set(db.collection(COLLECTION).document('leaderboard'), {
+        'day': day,
+        'leaders': leaders,
+        'users': len(table.ids),
+        'updated_at': firestore.SERVER_TIMESTAMP,
+    })
+    batch.set(db.collection(COLLECTION).document('state'), {'watermark': watermark, 'day': day})
+    return leaders
+
+
+def recompute():
+    """Fold new activity into the scores and refresh the leaderboard.
+
+    Returns the number of events applied, or None when another run got
+    there first.
+    """
+    state_ref = db.collection(COLLECTION).document('state')
+    state = state_ref.get()
+    state = state.to_dict() if state.exists else {}
+    since = state.get('watermark')
+    until = datetime.now(timezone.utc) - SETTLE
+    day = today()
+    events = _read_events(since, until)
+    if not events and state.get('day') == day:
+        return 0
+
+    @firestore.transactional
+    def _apply(transaction):
+        snapshots = {snap.id: snap for snap in transaction.get_all([state_ref] + _shard_refs())}
+        current = snapshots.get('state')
+        if (current.to_dict() if current is not None and current.exists else {}).get('watermark') != since:
+            return None
+        table = _Table((user_id, row)
+                       for name, snap in snapshots.items() if name != 'state' and snap.exists
+                       for user_id, row in (snap.to_dict().get('users') or {}).items())
+        for k in table.fold(events):
+            transaction.set(_shard_ref(k), {'users': table.shard(k)})
+        _write_board(transaction, table, day, until)
+        return len(events)
+
+    applied = _apply(db.transaction())
+    if applied is not None:
+        versions.bump(COLLECTION)
+    return applied
+
+
+def replay():
+    """Rebuild every user's score from the whole activity log. Returns ``(events, users)``."""
+    until = datetime.now(timezone.utc) - SETTLE
+    table = _Table()
+    events = _read_events(None, until)
+    table.fold(events)
+    batch = db.batch()
+    for k in range(SHARDS):
+        batch.set(_shard_ref(k), {'users': table.shard(k)})
+    _write_board(batch, table, today(), until)
+    batch.commit()
+    versions.bump(COLLECTION)
+    return len(events), len(table.ids)
+
+
+def backfill():
+    """Log posts written before the activity log existed. Returns how many were added."""
+    logged = {doc.id for doc in db.collection(ACTIVITY).select([]).stream()}
+    batch, added = db.batch(), 0
+    for doc in db.collection('community_posts').select(['author', 'author_id', 'timestamp']).stream():
+        post = doc.to_dict()
+        if doc.id in logged or not post.get('author_id') or not post.get('timestamp'):
+            continue
+        batch.set(db.collection(ACTIVITY).document(doc.id), {
+            'type': 'post', 'user_id': post['author_id'], 'name': post.get('author'), 'at': post['timestamp'],
+        })
+        added += 1
+        if len(batch) == 450:
+            batch.commit()
+            batch = db.batch()
+    if len(batch):
+        batch.commit()
+    return added
+
+
+def leaders(limit):
+    """The ``limit`` best ``{'full_name', 'score'}`` for today, from the leaderboard document."""
+    doc = db.collection(COLLECTION).document('leaderboard').get()
+    rows = (doc.to_dict() or {}).get('leaders', []) if doc.exists else []
+    day = today()
+    ranked = sorted(rows, key=lambda row: (-score(row['days'], row['first'], row['last'], day), -row['last']))
+    return [{'full_name': row['name'], 'score': score(row['days'], row['first'], row['last'], day)}
+            for row in ranked[:limit]]
+
+
+def _run():
+    # Spread the workers out so they don't all recompute at once
+    time.sleep(random.uniform(0, INTERVAL))
+    while True:
+        try:
+            recompute()
+        except Exception as e:
+            print(f"Error recomputing scores: {e}")
+        time.sleep(INTERVAL)
+
+
+def start():
+    """Recompute scores in the background of this process."""
+    global _thread
+    if _thread is not None or INTERVAL <= 0 or not db.is_configured():
+        return
+    _thread = threading.Thread(target=_run, name='scores', daemon=True)
+    _thread.start()
+
+
+@click.command('recompute-scores')
+@click.option('--replay', 'full', is_flag=True, help='Rebuild from the whole activity log.')
+@click.option('--backfill', 'old_posts', is_flag=True, help='Log posts made before the activity log first.')
+def recompute_command(full, old_posts):
+    """Bring Harvest Hero scores and the leaderboard up to date."""
+    if old_posts:
+        click.echo(f"Logged {backfill()} older posts")
+    if full or old_posts:
+        events, users = replay()
+        click.echo(f"Replayed {events} events for {users} users")
+    else:
+        applied = recompute()
+        click.echo("Another run is in progress" if applied is None else f"Applied {applied} events")
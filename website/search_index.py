@@ -0,0 +1,363 @@
+"""In-process inverted index over marketplace listings.
+
+The index is filled from a Firestore ``on_snapshot`` listener on
+``marketplace_items``: the first snapshot delivers every listing, later ones
+deliver only the changes, so searches never touch Firestore.
+
+Text is normalized before indexing so the same word typed in Devanagari or
+in any common Roman spelling lands on the same token ("टमाटर", "Tamaatar" and
+"tamatar" all become "tamatar"). Queries match on word prefixes across name,
+description, category and location, and every result set comes with facet
+counts per category and location. Geocoded listings are also kept in a
+``geo.GeoIndex``, so a "near" search only looks at listings in the cells
+around the buyer and comes back nearest first.
+
+Set ``SEARCH_INDEX_MAX_DOCS`` to keep only the newest N listings in memory:
+the listener then watches just those (``created_at`` descending, limited to
+N), so startup reads N documents rather than the collection. Once it is
+full the index may be missing older listings, so it only answers a page
+it can fill from what it holds, newest first; the page that would reach
+past the oldest listing kept comes back with a query-path page token, and
+the marketplace carries on with the Firestore query from there. "Near"
+searches, and searches with fewer matches than a page, go to Firestore
+straight away, and a partial index has no facets. A partial index matches
+search words against names only, as the query path does.
+
+Pages with no filter but the category are served from a newest-first list
+and facet counts kept up to date on every change, so they cost the page
+rather than the catalog.
+"""
+import bisect
+import heapq
+import itertools
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+from firebase_admin import firestore
+
+from . import db, geo, listings
+
+COLLECTION = 'marketplace_items'
+FIELDS = ('name', 'description', 'category', 'location')
+FACET_DEFAULTS = {'category': 'Other', 'location': 'Unknown'}
+PAGE_SIZE = 20
+
+# --- NORMALIZATION ---
+_VOWELS = {
+    'अ': 'a', 'आ': 'a', 'इ': 'i', 'ई': 'i', 'उ': 'u', 'ऊ': 'u', 'ऋ': 'ri',
+    'ए': 'e', 'ऐ': 'ai', 'ओ': 'o', 'औ': 'au',
+}
+_MATRAS = {
+    'ा': 'a', 'ि': 'i', 'ी': 'i', 'ु': 'u', 'ू': 'u', 'ृ': 'ri',
+    'े': 'e', 'ै': 'ai', 'ो': 'o', 'ौ': 'au',
+}
+_CONSONANTS = {
+    'क': 'k', 'ख': 'kh', 'ग': 'g', 'घ': 'gh', 'ङ': 'n',
+    'च': 'ch', 'छ': 'chh', 'ज': 'j', 'झ': 'jh', 'ञ': 'n',
+    'ट': 't', 'ठ': 'th', 'ड': 'd', 'ढ': 'dh', 'ण': 'n',
+    'त': 't', 'थ': 'th', 'द': 'd', 'ध': 'dh', 'न': 'n',
+    'प': 'p', 'फ': 'ph', 'ब': 'b', 'भ': 'bh', 'म': 'm',
+    'य': 'y', 'र': 'r', 'ल': 'l', 'व': 'v', 'श': 'sh', 'ष': 'sh',
+    'स': 's', 'ह': 'h',
+}
+_VIRAMA = '्'
+_NUKTA = '़'
+_NASALS = {'ं': 'n', 'ँ': 'n', 'ः': 'h'}
+
+# Spelling variants farmers commonly mix up when typing Hindi words in Roman
+_PHONETIC_FOLDS = [
+    ('aa', 'a'), ('ee', 'i'), ('oo', 'u'), ('ou', 'u'),
+    ('w', 'v'), ('ph', 'f'), ('z', 'j'), ('q', 'k'),
+]
+
+
+def transliterate(text):
+    """Roman transliteration of Devanagari text; other characters pass through."""
+    text = unicodedata.normalize('NFC', text).replace(_NUKTA, '')
+    out = []
+    prev_vowel = False
+    for i, ch in enumerate(text):
+        if ch in _CONSONANTS:
+            out.append(_CONSONANTS[ch])
+            nxt = text[i + 1] if i + 1 < len(text) else ''
+            after = text[i + 2] if i + 2 < len(text) else ''
+            # Inherent 'a' only before another consonant or a nasal, so the
+            # word-final one is dropped ("टमाटर" -> "tamatar"). Also drop it
+            # between vowels as spoken Hindi does ("बासमती" -> "basmati").
+            schwa = (nxt in _CONSONANTS or nxt in _NASALS) and not (
+                prev_vowel and nxt in _CONSONANTS and (after in _MATRAS or after in _CONSONANTS))
+            if schwa:
+                out.append('a')
+            prev_vowel = schwa
+        elif ch in _MATRAS or ch in _VOWELS:
+            out.append(_MATRAS.get(ch) or _VOWELS[ch])
+            prev_vowel = True
+        elif ch in _NASALS:
+            out.append(_NASALS[ch])
+            prev_vowel = False
+        elif ch == _VIRAMA:
+            continue
+        else:
+            out.append(ch)
+            prev_vowel = False
+    return ''.join(out)
+
+
+def normalize_word(word):
+    word = unicodedata.normalize('NFKD', word)
+    word = ''.join(c for c in word if not unicodedata.combining(c))
+    for src, dst in _PHONETIC_FOLDS:
+        word = word.replace(src, dst)
+    # Collapse doubled letters ("makka" / "maka")
+    return re.sub(r'(.)\1+', r'\1', word)
+
+
+@lru_cache(maxsize=65536)
+def _tokenize(text):
+    text = transliterate(text.lower())
+    return tuple(normalize_word(w) for w in re.findall(r'\w+', text))
+
+
+def tokenize(text):
+    return list(_tokenize(text or ''))
+
+
+# --- INDEX ---
+class SearchIndex:
+    def __init__(self, max_docs=None, index_description=True):
+        self.max_docs = max_docs
+        self.index_description = index_description
+        self.docs = {}      # doc id -> listing dict
+        self._newest = []   # (-sort key, doc id), newest listing first
+        self._facets = {field: Counter() for field in FACET_DEFAULTS}
+        self.postings = {}  # field -> token -> set of doc ids
+        self._sorted_tokens = {}
+        self._dirty = set()
+        self.geo = geo.GeoIndex()
+        self._lock = threading.RLock()
+        self.ready = threading.Event()
+
+    @property
+    def partial(self):
+        """True when the index is full, so older listings may be missing."""
+        return bool(self.max_docs) and len(self.docs) >= self.max_docs
+
+    @property
+    def complete(self):
+        """True once loaded, if the index holds every listing."""
+        return self.ready.is_set() and not self.partial
+
+    def _fields(self):
+        return FIELDS if self.index_description else tuple(f for f in FIELDS if f != 'description')
+
+    def _index(self, doc_id, item, add=True):
+        for field in self._fields():
+            postings = self.postings.setdefault(field, {})
+            for token in set(tokenize(item.get(field))):
+                if add:
+                    postings.setdefault(token, set()).add(doc_id)
+                else:
+                    ids = postings.get(token)
+                    if ids is not None:
+                        ids.discard(doc_id)
+                        if not ids:
+                            del postings[token]
+            self._dirty.add(field)
+
+    def upsert(self, doc_id, item):
+        with self._lock:
+            self.remove(doc_id)
+            item = dict(item, id=doc_id)
+            self.docs[doc_id] = item
+            self._index(doc_id, item)
+            if item.get('lat') is not None and item.get('lng') is not None:
+                self.geo.add(doc_id, item['lat'], item['lng'])
+            bisect.insort(self._newest, _age_entry(item))
+            for field, default in FACET_DEFAULTS.items():
+                self._facets[field][item.get(field) or default] += 1
+            while self.max_docs and len(self.docs) > self.max_docs:
+                self.remove(self._newest[-1][1])
+
+    def remove(self, doc_id):
+        with self._lock:
+            item = self.docs.pop(doc_id, None)
+            if item is not None:
+                self._index(doc_id, item, add=False)
+                self.geo.remove(doc_id)
+                entry = _age_entry(item)
+                del self._newest[bisect.bisect_left(self._newest, entry)]
+                for field, default in FACET_DEFAULTS.items():
+                    counts = self._facets[field]
+                    value = item.get(field) or default
+                    counts[value] -= 1
+                    if counts[value] <= 0:
+                        del counts[value]
+
+    def _prefix_ids(self, field, prefix):
+        postings = self.postings.get(field, {})
+        if field in self._dirty or field not in self._sorted_tokens:
+            self._sorted_tokens[field] = sorted(postings)
+            self._dirty.discard(field)
+        tokens = self._sorted_tokens[field]
+        ids = set()
+        i = bisect.bisect_left(tokens, prefix)
+        while i < len(tokens) and tokens[i].startswith(prefix):
+            ids |= postings[tokens[i]]
+            i += 1
+        return ids
+
+    def _match(self, text, fields):
+        result = None
+        for token in tokenize(text):
+            ids = set()
+            for field in fields:
+                ids |= self._prefix_ids(field, token)
+            result = ids if result is None else result & ids
+            if not result:
+                break
+        return result
+
+    def search(self, search='', category='', location='', min_price=None, max_price=None,
+               near=None, radius_km=geo.DEFAULT_RADIUS_KM, offset=0, page_size=PAGE_SIZE):
+        """Same filters as ``listings.search_listings``, answered from memory.
+
+        Returns ``items``, ``next_page_token``, ``total_estimate`` (exact
+        here) and ``facets`` with per-category and per-location counts.
+        With ``near`` (``(lat, lng)``), only listings within ``radius_km``
+        match, nearest first, each with its ``distance_km``.
+
+        A ``partial`` index returns None when it can't fill the page (see
+        above), and a lower bound for ``total_estimate``.
+        """
+        with self._lock:
+            partial = self.partial
+            if partial and near is not None:
+                return None
+            if not (search or location or near is not None or min_price is not None or max_price is not None):
+                return self._newest_page(category, offset, page_size, partial)
+            ids = None
+            distances = None
+            if near is not None:
+                distances = {doc_id: d for d, doc_id in self.geo.within(near[0], near[1], radius_km)}
+                ids = set(distances)
+            if search and ids != set():
+                # A partial index matches names only, like the query path
+                # it hands over to, so the pages after it agree
+                search_ids = self._match(search, ('name',) if partial else self._fields())
+                if search_ids is not None:
+                    ids = search_ids if ids is None else ids & search_ids
+            if location and ids != set():
+                loc_ids = self._match(location, ('location',))
+                ids = loc_ids if ids is None else ids & loc_ids
+            candidates = self.docs.values() if ids is None else [self.docs[i] for i in ids]
+
+            matches = []
+            for item in candidates:
+                price = item.get('price', 0)
+                if min_price is not None and price < min_price: continue
+                if max_price is not None and price > max_price: continue
+                matches.append(item)
+
+            facets = {field: Counter(item.get(field) or default for item in matches)
+                      for field, default in FACET_DEFAULTS.items()}
+            if category and category != 'All':
+                matches = [item for item in matches if item.get('category') == category]
+
+        next_offset = offset + page_size
+        next_token = str(next_offset) if next_offset < len(matches) else None
+        if distances is None:
+            page = heapq.nlargest(next_offset, matches, key=_sort_key)[offset:]
+        else:
+            nearest = heapq.nsmallest(next_offset, matches, key=lambda item: distances[item['id']])[offset:]
+            page = [dict(item, distance_km=round(distances[item['id']], 1)) for item in nearest]
+        return _page(page, next_token, len(matches), facets, offset, page_size, partial)
+
+    def _newest_page(self, category, offset, page_size, partial):
+        """Unfiltered page (a category at most) from the maintained newest-first
+        list and facet counts, without touching the rest of the index."""
+        facets = {field: Counter(counts) for field, counts in self._facets.items()}
+        next_offset = offset + page_size
+        if category and category != 'All':
+            total = facets['category'].get(category, 0)
+            wanted = (self.docs[doc_id] for _, doc_id in self._newest)
+            wanted = (item for item in wanted if item.get('category') == category)
+            page = list(itertools.islice(wanted, offset, next_offset))
+        else:
+            total = len(self._newest)
+            page = [self.docs[doc_id] for _, doc_id in self._newest[offset:next_offset]]
+        next_token = str(next_offset) if next_offset < total else None
+        return _page(page, next_token, total, facets, offset, page_size, partial)
+
+    def on_snapshot(self, col_snapshot, changes, read_time):
+        for change in changes:
+            if change.type.name == 'REMOVED':
+                self.remove(change.document.id)
+            else:
+                self.upsert(change.document.id, change.document.to_dict())
+        self.ready.set()
+
+
+def _sort_key(item):
+    created = item.get('created_at')
+    # Pending server timestamps come back as None: treat them as newest
+    return created.timestamp() if created else float('inf')
+
+
+def _age_entry(item):
+    return -_sort_key(item), item['id']
+
+
+def _page(items, next_token, total, facets, offset, page_size, partial):
+    if partial:
+        if len(items) < page_size:
+            return None
+        if offset + 2 * page_size > total:
+            # The next page reaches past the oldest listing held: the
+            # query path carries on after the last one shown
+            next_token = listings.encode_page_token(items[-1]['id'], None)
+        facets = None
+    return {
+        'items': items,
+        'next_page_token': next_token,
+        'total_estimate': total,
+        'facets': facets,
+    }
+
+
+index = SearchIndex(
+    max_docs=int(os.environ['SEARCH_INDEX_MAX_DOCS']) if os.environ.get('SEARCH_INDEX_MAX_DOCS') else None,
+)
+_watch = None
+
+
+def start():
+    """Attach the snapshot listener that builds and maintains ``index``."""
+    global _watch
+    if _watch is not None or not db.is_configured():
+        return
+    query = db.collection(COLLECTION)
+    if index.max_docs:
+        query = query.order_by('created_at', direction=firestore.Query.DESCENDING).limit(index.max_docs)
+    try:
+        _watch = query.on_snapshot(index.on_snapshot)
+    except Exception as e:
+        print(f"Error starting search index: {e}")
+
+
+def search(page_token=None, **filters):
+    """Search the index, or return None for the Firestore query path: before
+    the index has loaded, for a page token of that path, or when a
+    ``partial`` index can't answer.
+
+    The query path matches less: search words against listing names only
+    (not description or category), location words against location, each as
+    typed, without the Devanagari transliteration and spelling folds. So a
+    result from it can be narrower than the same search here.
+    """
+    if not index.ready.is_set() or (page_token and not page_token.isdigit()):
+        return None
+    return index.search(offset=int(page_token) if page_token else 0, **filters)
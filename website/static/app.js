@@ -1,122 +1,238 @@
-
-if('serviceWorker' in navigator) {
-    window.addEventListener('load', () => {
-        navigator.serviceWorker.register('/sw.js')
-            .then(reg => console.log('Service Worker Registered'))
-            .catch(err => console.error('SW Registration Failed:', err));
-    });
-}
-
-
-document.addEventListener('DOMContentLoaded', () => {
-    
-   
-    const loginForm = document.getElementById('LoginForm');
-    if (loginForm) {
-        loginForm.addEventListener('submit', async function(event) {
-            event.preventDefault();
-            
-            const phone = document.getElementById('phone').value;
-            const password = document.getElementById('password').value;
-            const btn = document.querySelector('.primary-btn');
-
-            const originalText = btn.innerText;
-            btn.innerText = "Verifying...";
-            btn.disabled = true;
-
-            try {
-                const response = await fetch('/login', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ phone: phone, password: password })
-                });
-
-                const result = await response.json();
-
-                if (result.success) {
-                    alert("Welcome " + result.user + "!");
-                    window.location.href = '/dashboard';
-               
-                } else {
-                    alert(result.message);
-                }
-            } catch (error) {
-                console.error(error);
-                alert("Server connection failed.");
-            } finally {
-                btn.innerText = originalText;
-                btn.disabled = false;
-            }
-        });
-    }
-
-   
-    const signupForm = document.getElementById('authForm');
-    if (signupForm) {
-        signupForm.addEventListener('submit', async function(event) {
-            event.preventDefault();
-
-            
-            const fullName = document.querySelector('input[placeholder="Full Name"]').value;
-            const dob = document.getElementById('dob').value;
-            const phone = document.querySelector('input[type="tel"]').value;
-            const password = document.getElementById('pass').value;
-            const confirmPass = document.getElementById('confirmPass').value;
-            const captchaInput = document.getElementById('captchaInput').value;
-            const captchaCode = document.getElementById('captchaCode').innerText;
-            const btn = document.querySelector('.register-btn');
-
-          
-            if (password !== confirmPass) {
-                alert("Passwords do not match!");
-                return;
-            }
-            if (captchaInput !== captchaCode) {
-                alert("Incorrect Captcha!");
-                return;
-            }
-
-            const originalText = btn.innerText;
-            btn.innerText = "Creating Account...";
-            btn.disabled = true;
-
-            try {
-                const response = await fetch('/signup', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ 
-                        full_name: fullName,
-                        phone: phone,
-                        password: password,
-                        dob: dob
-                    })
-                });
-
-                const result = await response.json();
-
-                if (result.success) {
-                    alert(result.message);
-                    window.location.href = '/dashboard'; 
-                } else {
-                    alert(result.message);
-                }
-            } catch (error) {
-                console.error(error);
-                alert("Server connection failed.");
-            } finally {
-                btn.innerText = originalText;
-                btn.disabled = false;
-            }
-        });
-    }
-});
-
-function generateCaptcha() {
-    const chars = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ';
-    let captcha = '';
-    for (let i = 0; i < 6; i++) {
-        captcha += chars[Math.floor(Math.random() * chars.length)];
-    }
-    const captchaDisplay = document.getElementById('captchaCode');
-    if(captchaDisplay) captchaDisplay.innerText = captcha;
-}
\ No newline at end of file
+
+if('serviceWorker' in navigator) {
+    window.addEventListener('load', () => {
+        navigator.serviceWorker.register('/sw.js')
+            .then(reg => {
+                console.log('Service Worker Registered');
+                // Background refresh of saved listings and posts, where supported
+                if (reg.periodicSync) {
+                    reg.periodicSync.register('krishimitra-data', { minInterval: 12 * 60 * 60 * 1000 }).catch(() => {});
+                }
+            })
+            .catch(err => console.error('SW Registration Failed:', err));
+    });
+    // Send writes queued while offline; covers browsers without Background Sync
+    const flushOutbox = () => navigator.serviceWorker.controller && navigator.serviceWorker.controller.postMessage('flush-outbox');
+    window.addEventListener('online', flushOutbox);
+    window.addEventListener('load', () => { if (navigator.onLine) flushOutbox(); });
+}
+
+
+document.addEventListener('DOMContentLoaded', () => {
+    
+   
+    const loginForm = document.getElementById('LoginForm');
+    if (loginForm) {
+        loginForm.addEventListener('submit', async function(event) {
+            event.preventDefault();
+            
+            const phone = document.getElementById('phone').value;
+            const password = document.getElementById('password').value;
+            const btn = document.querySelector('.primary-btn');
+
+            const originalText = btn.innerText;
+            btn.innerText = "Verifying...";
+            btn.disabled = true;
+
+            try {
+                const response = await fetch('/login', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ phone: phone, password: password })
+                });
+
+                const result = await response.json();
+
+                if (result.success) {
+                    alert("Welcome " + result.user + "!");
+                    window.location.href = '/dashboard';
+               
+                } else {
+                    alert(result.message);
+                }
+            } catch (error) {
+                console.error(error);
+                alert("Server connection failed.");
+            } finally {
+                btn.innerText = originalText;
+                btn.disabled = false;
+            }
+        });
+    }
+
+   
+    const signupForm = document.getElementById('authForm');
+    if (signupForm) {
+        signupForm.addEventListener('submit', async function(event) {
+            event.preventDefault();
+
+            
+            const fullName = document.querySelector('input[placeholder="Full Name"]').value;
+            const dob = document.getElementById('dob').value;
+            const phone = document.querySelector('input[type="tel"]').value;
+            const password = document.getElementById('pass').value;
+            const confirmPass = document.getElementById('confirmPass').value;
+            const captchaInput = document.getElementById('captchaInput').value;
+            const captchaCode = document.getElementById('captchaCode').innerText;
+            const btn = document.querySelector('.register-btn');
+
+          
+            if (password !== confirmPass) {
+                alert("Passwords do not match!");
+                return;
+            }
+            if (captchaInput !== captchaCode) {
+                alert("Incorrect Captcha!");
+                return;
+            }
+
+            const originalText = btn.innerText;
+            btn.innerText = "Creating Account...";
+            btn.disabled = true;
+
+            try {
+                const response = await fetch('/signup', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ 
+                        full_name: fullName,
+                        phone: phone,
+                        password: password,
+                        dob: dob
+                    })
+                });
+
+                const result = await response.json();
+
+                if (result.success) {
+                    alert(result.message);
+                    window.location.href = '/dashboard'; 
+                } else {
+                    alert(result.message);
+                }
+            } catch (error) {
+                console.error(error);
+                alert("Server connection failed.");
+            } finally {
+                btn.innerText = originalText;
+                btn.disabled = false;
+            }
+        });
+    }
+});
+
+function generateCaptcha() {
+    const chars = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ';
+    let captcha = '';
+    for (let i = 0; i < 6; i++) {
+        captcha += chars[Math.floor(Math.random() * chars.length)];
+    }
+    const captchaDisplay = document.getElementById('captchaCode');
+    if(captchaDisplay) captchaDisplay.innerText = captcha;
+}
+// --- Client-rendered listings and posts (pages with data-sync) ---
+// Shows what IndexedDB already has straight away, then fetches only the
+// changes (see sync.js) and renders again. Works offline from the saved copy.
+
+function el(tag, attrs, ...children) {
+    const node = document.createElement(tag);
+    Object.entries(attrs || {}).forEach(([key, value]) => {
+        if (key === 'onclick') node.onclick = value;
+        else node.setAttribute(key, value);
+    });
+    children.forEach(child => node.append(child));
+    return node;
+}
+
+function renderListings(container, listings) {
+    container.replaceChildren(...listings.map(item => el('div', { class: 'card' },
+        el('div', { class: 'card-img-container' }, el('img', { src: item.thumb || '', alt: 'product', loading: 'lazy' })),
+        el('div', { class: 'card-body' },
+            el('h3', {}, item.name || ''),
+            el('span', { style: 'background: #eee; font-size: 0.8rem; padding: 2px 6px; border-radius: 4px;' }, item.category || ''),
+            el('div', { class: 'price' }, `₹${item.price} / ${item.unit || ''}`),
+            el('div', { class: 'location' }, `📍 ${item.location || ''}`),
+            el('p', { style: 'font-size:0.8rem; color:#666;' }, `Seller: ${item.seller || ''}`),
+            el('button', { class: 'btn-buy', onclick: () => alert('Call ' + item.phone) }, 'Contact Seller')))));
+}
+
+function renderPosts(container, posts, meta) {
+    container.replaceChildren(...posts.map(post => el('div', { class: 'card', id: 'post-' + post.id },
+        el('div', { class: 'user-meta' },
+            el('img', { src: post.avatar || '', alt: 'User' }),
+            el('div', {},
+                el('strong', {}, post.author || ''), ' ', el('span', { class: 'tag' }, post.tag || ''),
+                el('p', { style: 'font-size: 0.8rem; color: #888;' },
+                    post.time ? new Date(post.time).toLocaleDateString('en-GB', { day: '2-digit', month: 'short', year: 'numeric' }) : ''))),
+        el('h2', { class: 'question-title' }, post.title || ''),
+        el('p', {}, post.content || ''),
+        el('div', { class: 'card-actions' },
+            el('button', { class: 'action-btn', onclick: () => likePost(post.id) },
+                el('i', { class: 'fa fa-arrow-up' }), ' ', el('span', { id: 'like-count-' + post.id }, String(post.likes || 0))),
+            el('button', { class: 'action-btn', onclick: () => toggleComments(post.id) },
+                el('i', { class: 'fa fa-comment' }), ' ', el('span', {}, post.comments ? `Comment (${post.comments})` : 'Comment')),
+            el('button', { class: 'action-btn', onclick: () => sharePost(post.title) },
+                el('i', { class: 'fa fa-share' }), ' ', el('span', {}, 'Share'))),
+        el('div', { id: 'comments-' + post.id, class: 'comments-section' },
+            el('div', { id: 'comment-list-' + post.id }),
+            el('div', { style: 'display:flex; margin-top:10px;' },
+                el('input', { type: 'text', id: 'input-comment-' + post.id, placeholder: 'Write a comment...',
+                              style: 'flex:1; padding:8px; border:1px solid #ddd; border-radius:5px;' }),
+                el('button', { onclick: () => postComment(post.id),
+                               style: 'margin-left:5px; background:var(--primary-green); color:white; border:none; padding:0 15px; border-radius:5px;' },
+                   'Send'))))));
+
+    const heroes = document.getElementById('heroesList');
+    if (heroes && meta.heroes) {
+        const medals = ['🥇', '🥈', '🥉'];
+        heroes.replaceChildren(...meta.heroes.map(([name, score], i) => el('div', { class: 'hero-item' },
+            el('span', {}, `${medals[i] || '🏅'} ${name || ''}`),
+            el('span', { style: 'font-weight:bold; color:var(--primary-green);' }, `${score} pts`))));
+    }
+}
+
+const RENDERERS = { listings: renderListings, posts: renderPosts };
+
+async function startSync(container) {
+    const kind = container.dataset.sync;
+    const status = document.getElementById('syncStatus');
+    const more = document.querySelector('[data-sync-more]');
+    const db = await KrishiSync.open();
+
+    const render = async meta => {
+        RENDERERS[kind](container, await KrishiSync.load(db, kind), meta);
+        if (more) more.style.display = meta.older ? 'block' : 'none';
+    };
+
+    await render(await KrishiSync.getMeta(db, kind));
+    try {
+        const meta = await KrishiSync.sync(db, kind);
+        if (kind === 'posts') {
+            const onScreen = (await KrishiSync.load(db, kind)).slice(0, 30).map(post => post.id);
+            await KrishiSync.refreshCounts(db, onScreen);
+        }
+        await render(meta);
+        if (status) status.textContent = '';
+    } catch (error) {
+        console.error(error);
+        if (status) status.textContent = 'Offline: showing saved ' + kind + '.';
+    }
+
+    if (more) {
+        more.onclick = async () => {
+            more.disabled = true;
+            try {
+                await render(await KrishiSync.loadOlder(db, kind));
+            } finally {
+                more.disabled = false;
+            }
+        };
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const container = document.querySelector('[data-sync]');
+    if (container && typeof KrishiSync !== 'undefined' && 'indexedDB' in self) {
+        startSync(container);
+    }
+});
@@ -23,20 +23,11 @@ async function callGeminiAPI(base64Image) {
     const cleanBase64 = base64Image.split(',')[1];
 
     try {
-    
-        const response = await fetch('/api/analyze-crop', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ image: cleanBase64 })
-        });
-
-        const result = await response.json();
+        // Streaming shows the disease name as soon as the model writes it;
+        // browsers without fetch streams fall back to a queued job
+        const canStream = window.ReadableStream && window.TextDecoder;
+        const result = canStream ? await streamDiagnosis(cleanBase64) : await queuedDiagnosis(cleanBase64);
 
-        if (!response.ok) {
-            throw new Error(result.error || 'Server Error');
-        }
-
-    
         showResults(result);
 
     } catch (error) {
@@ -45,6 +36,135 @@ async function callGeminiAPI(base64Image) {
         resetUI();
     }
 }
+
+async function streamDiagnosis(cleanBase64) {
+    const response = await fetch('/api/analyze-crop/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ image: cleanBase64 })
+    });
+    if (!response.ok) {
+        const result = await response.json().catch(() => ({}));
+        throw new Error(result.error || 'Server Error');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const partial = { treatments: [] };
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (!line) continue;
+
+            const event = JSON.parse(line);
+            if (event.error) throw new Error(event.error);
+            if (event.done) return event.result;
+            if (event.item === 'treatments') partial.treatments.push(event.value);
+            else if (event.field && event.field !== 'treatments') partial[event.field] = event.value;
+            showPartialResult(partial);
+        }
+    }
+    throw new Error('Connection closed before the diagnosis finished');
+}
+
+async function queuedDiagnosis(cleanBase64) {
+    const response = await fetch('/api/analyze-crop', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ image: cleanBase64, async: true })
+    });
+
+    const result = await response.json();
+
+    if (!response.ok) {
+        throw new Error(result.error || 'Server Error');
+    }
+
+    // 202: diagnosis is queued, poll the job until it finishes
+    if (response.status === 202) {
+        return waitForJob(result.status_url);
+    }
+    return result;
+}
+
+// Fill in the report while the model is still writing it
+function showPartialResult(partial) {
+    if (!partial.name) return;
+
+    loadingSpinner.style.display = 'none';
+    resultsArea.style.display = 'block';
+    document.getElementById('disease-name').textContent = partial.name;
+    if (partial.description) {
+        document.getElementById('disease-desc').textContent = partial.description;
+    }
+    if (partial.confidence !== undefined) {
+        const confidence = parseInt(partial.confidence, 10) || 0;
+        document.getElementById('confidence-val').textContent = confidence + "%";
+        document.getElementById('confidence-bar').style.width = confidence + "%";
+    }
+
+    const list = document.getElementById('treatment-list');
+    list.innerHTML = '';
+    partial.treatments.forEach(t => {
+        const li = document.createElement('li');
+        li.textContent = t;
+        list.appendChild(li);
+    });
+}
+
+const JOB_POLL_MS = 1500;
+const JOB_TIMEOUT_MS = 3 * 60 * 1000;
+
+async function waitForJob(statusUrl) {
+    const deadline = Date.now() + JOB_TIMEOUT_MS;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_MS));
+        let job;
+        try {
+            const response = await fetch(statusUrl);
+            job = await response.json();
+            if (!response.ok) throw new Error(job.error || 'Server Error');
+        } catch (error) {
+            // Flaky connection: keep polling, the job keeps running server-side
+            console.warn("Job poll failed:", error);
+            continue;
+        }
+        if (job.status === 'done') return job.result;
+        if (job.status === 'failed') throw new Error(job.error || 'Diagnosis failed');
+    }
+    throw new Error('Diagnosis is taking too long, please try again');
+}
+
+// Shrink camera photos before upload; the server re-encodes anyway, so
+// sending several MB over 2G/3G buys nothing
+const MAX_UPLOAD_SIDE = 1280;
+
+function downscaleImage(dataUrl) {
+    return new Promise(resolve => {
+        const img = new Image();
+        img.onload = () => {
+            const scale = Math.min(1, MAX_UPLOAD_SIDE / Math.max(img.width, img.height));
+            if (scale === 1 && dataUrl.startsWith('data:image/jpeg')) return resolve(dataUrl);
+
+            const canvas = document.createElement('canvas');
+            canvas.width = Math.round(img.width * scale);
+            canvas.height = Math.round(img.height * scale);
+            canvas.getContext('2d').drawImage(img, 0, 0, canvas.width, canvas.height);
+            resolve(canvas.toDataURL('image/jpeg', 0.85));
+        };
+        img.onerror = () => resolve(dataUrl); // let the server report bad files
+        img.src = dataUrl;
+    });
+}
+
 // Reuseable Image Handler
 function handleImageSelection(e) {
     const file = e.target.files[0];
@@ -60,8 +180,8 @@ function handleImageSelection(e) {
         previewArea.scrollIntoView({ behavior: 'smooth', block: 'center' });
 
         const reader = new FileReader();
-        reader.onload = function (e) {
-            const base64Image = e.target.result;
+        reader.onload = async function (e) {
+            const base64Image = await downscaleImage(e.target.result);
             previewImg.src = base64Image;
 
             // Call API after slight delay to ensure UI updates
@@ -112,7 +232,9 @@ function showResults(result, saveToHistory = true) {
 
     document.getElementById('disease-name').textContent = result.name;
     document.getElementById('disease-name').style.color = isHealthy ? "#2e7d32" : "#d32f2f";
-    document.getElementById('disease-desc').textContent = result.description;
+    document.getElementById('disease-desc').textContent = result.similar_image
+        ? result.description + " (Matched a very similar photo diagnosed earlier.)"
+        : result.description;
     document.getElementById('confidence-val').textContent = result.confidence + "%";
 
     // Animate Bar
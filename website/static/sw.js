@@ -1,55 +1,223 @@
-const CACHE_NAME = 'smart-farmer-v3'; // Increment this version
-const ASSETS = [
-    '/static/style.css',
-    '/static/signup.css',
-    '/static/app.js',
-    '/static/manifest.json',
-    '/static/1.png',
-    '/static/icons/icon-144x144.png',
-    // Do NOT cache '/', '/dashboard', or '/register' HTML here. 
-    // We want those to always be fresh from the server.
-];
-
-self.addEventListener('install', event => {
-    self.skipWaiting();
-    event.waitUntil(
-        caches.open(CACHE_NAME).then(cache => cache.addAll(ASSETS))
-    );
-});
-
-self.addEventListener('activate', event => {
-    event.waitUntil(
-        caches.keys().then(keys => Promise.all(
-            keys.map(key => {
-                if (key !== CACHE_NAME) return caches.delete(key);
-            })
-        ))
-    );
-    return self.clients.claim();
-});
-
-self.addEventListener('fetch', event => {
-    const url = new URL(event.request.url);
-
-    // 1. IGNORE API CALLS (Login, Signup, etc.) - Always go to network
-    if (event.request.method !== 'GET' || url.pathname.startsWith('/login') || url.pathname.startsWith('/signup')) {
-        return; 
-    }
-
-    // 2. NETWORK FIRST strategy for HTML pages (Dashboard, Home, etc.)
-    // This ensures the user always gets the latest page (and correct redirects)
-    if (event.request.mode === 'navigate') {
-        event.respondWith(
-            fetch(event.request)
-                .catch(() => caches.match(event.request)) // Fallback to cache only if offline
-        );
-        return;
-    }
-
-    // 3. CACHE FIRST for static assets (CSS, JS, Images)
-    event.respondWith(
-        caches.match(event.request).then(response => {
-            return response || fetch(event.request);
-        })
-    );
-});
\ No newline at end of file
+// The server fills these in (see http_cache.service_worker_response), so a
+// new build changes this file and the browser installs the new worker.
+const BUILD = /*BUILD*/'dev';
+const ASSET_URLS = /*ASSET_URLS*/{};
+
+importScripts(ASSET_URLS['/static/sync.js'] || '/static/sync.js');
+
+const CACHE_NAME = 'smart-farmer-' + BUILD;
+const PAGES_CACHE = 'smart-farmer-pages';
+const ASSETS = [
+    '/static/style.css',
+    '/static/signup.css',
+    '/static/app.js',
+    '/static/sync.js',
+    '/static/marketplace-style.css',
+    '/static/manifest.json',
+    '/static/1.png',
+    '/static/icons/icon-144x144.png',
+    // Do NOT cache '/', '/dashboard', or '/register' HTML here.
+    // We want those to always be fresh from the server.
+];
+
+// Pages rendered in the browser from IndexedDB: the server only sends a
+// shell without records, and sync.js fetches the changes
+const SHELLS = { '/marketplace': '/marketplace/app', '/community': '/community/app' };
+// Pages answered with ETags: shown from cache at once, then revalidated
+const DATA_PAGES = ['/myfarm'];
+// Requests that change who is logged in, and so every cached page
+const AUTH_PATHS = ['/login', '/signup', '/logout'];
+// Writes that can wait for a connection. When the network fails (or older
+// writes are still waiting, to keep their order) they are queued in the
+// outbox and sent together to /api/v1/batch once back online.
+const OUTBOX_TAG = 'krishimitra-outbox';
+const QUEUEABLE = [/^\/marketplace$/, /^\/community\/post$/, /^\/community\/(like|comment)\/[^/]+$/];
+
+const versioned = path => ASSET_URLS[path] || path;
+
+self.addEventListener('install', event => {
+    self.skipWaiting();
+    event.waitUntil(
+        caches.open(CACHE_NAME).then(cache => cache.addAll(ASSETS.map(versioned)))
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys().then(keys => Promise.all(
+            keys.map(key => {
+                if (key !== CACHE_NAME) return caches.delete(key);
+            })
+        ))
+    );
+    return self.clients.claim();
+});
+
+// Ask the server whether the cached page is still current. A 304 costs a few
+// hundred bytes; only a changed page is downloaded and stored.
+async function revalidate(url, cached) {
+    const headers = new Headers();
+    const etag = cached && cached.headers.get('ETag');
+    if (etag) headers.set('If-None-Match', etag);
+
+    const response = await fetch(url, { headers, credentials: 'same-origin', redirect: 'follow' });
+    if (response.status === 304 && cached) {
+        return cached;
+    }
+    if (response.ok && !response.redirected && response.headers.get('ETag')) {
+        const cache = await caches.open(PAGES_CACHE);
+        await cache.put(url, response.clone());
+    }
+    return response;
+}
+
+async function toBase64(blob) {
+    const bytes = new Uint8Array(await blob.arrayBuffer());
+    let binary = '';
+    for (let i = 0; i < bytes.length; i += 0x8000) {
+        binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+    }
+    return btoa(binary);
+}
+
+// The outbox operation (see website/outbox.py) for a queueable request
+async function toOperation(request, url) {
+    const [, section, action, postId] = url.pathname.split('/');
+    if (section === 'marketplace') {
+        const data = {};
+        for (const [name, value] of await request.formData()) {
+            if (typeof value === 'string') data[name] = value;
+            else if (name === 'image' && value.size) data.image = await toBase64(value);
+        }
+        return { type: 'listing', data };
+    }
+    if (action === 'post') {
+        const { title, content, tag } = await request.json();
+        return { type: 'post', data: { title, content, tag } };
+    }
+    const data = { post_id: decodeURIComponent(postId) };
+    if (action === 'comment') data.comment = (await request.json()).comment;
+    return { type: action, data };
+}
+
+// What the page expects back, for a write that has only been queued
+function queuedReply(op) {
+    if (op.type === 'listing') return Response.redirect('/marketplace', 303);
+    const body = { success: true, queued: true };
+    if (op.type === 'comment') body.comment = { author: 'You', text: op.data.comment };
+    return new Response(JSON.stringify(body), { status: 202, headers: { 'Content-Type': 'application/json' } });
+}
+
+async function sendOrQueue(event, url) {
+    if (!(await KrishiSync.hasPending())) {
+        try {
+            return await fetch(event.request.clone());
+        } catch (err) {
+            // Offline: queue it below
+        }
+    }
+    const op = await toOperation(event.request, url);
+    await KrishiSync.enqueue(op);
+    if (self.registration.sync) {
+        await self.registration.sync.register(OUTBOX_TAG).catch(() => {});
+    }
+    event.waitUntil(KrishiSync.flush().catch(() => {}));
+    return queuedReply(op);
+}
+
+// Stale-while-revalidate: answer from cache, refresh it in the background
+function staleWhileRevalidate(event, url) {
+    return caches.open(PAGES_CACHE)
+        .then(cache => cache.match(url))
+        .then(cached => {
+            const refresh = revalidate(url, cached);
+            if (cached) {
+                event.waitUntil(refresh.catch(() => {}));
+                return cached;
+            }
+            return refresh;
+        });
+}
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url);
+
+    if (url.origin === self.location.origin) {
+        // Logging in or out changes every page; any other write may change
+        // My Farm. Forget them so the next visit waits for fresh content.
+        if (AUTH_PATHS.some(path => url.pathname.startsWith(path))) {
+            event.waitUntil(caches.delete(PAGES_CACHE));
+        } else if (event.request.method !== 'GET') {
+            event.waitUntil(caches.open(PAGES_CACHE).then(cache => Promise.all(DATA_PAGES.map(page => cache.delete(page)))));
+        }
+    }
+
+    // 1. QUEUE writes that fail while offline
+    if (event.request.method === 'POST' && url.origin === self.location.origin &&
+        QUEUEABLE.some(pattern => pattern.test(url.pathname))) {
+        event.respondWith(sendOrQueue(event, url));
+        return;
+    }
+
+    // 2. IGNORE API CALLS (Login, Signup, JSON data, etc.) - Always go to network
+    if (event.request.method !== 'GET' || url.pathname.startsWith('/login') || url.pathname.startsWith('/signup') ||
+        url.pathname.startsWith('/api/')) {
+        return;
+    }
+
+    // 3. STALE-WHILE-REVALIDATE for the shells and data pages (not searches
+    // or later pages, which stay server-rendered)
+    if (event.request.mode === 'navigate' && !url.search) {
+        const page = SHELLS[url.pathname] || (DATA_PAGES.includes(url.pathname) && url.pathname);
+        if (page) {
+            event.respondWith(staleWhileRevalidate(event, page));
+            return;
+        }
+    }
+
+    // 4. NETWORK FIRST strategy for other HTML pages (Dashboard, Home, etc.)
+    // This ensures the user always gets the latest page (and correct redirects)
+    if (event.request.mode === 'navigate') {
+        event.respondWith(
+            fetch(event.request)
+                .catch(() => caches.match(event.request)) // Fallback to cache only if offline
+        );
+        return;
+    }
+
+    // 5. CACHE FIRST for static assets (CSS, JS, Images). Fingerprinted URLs
+    // never change, so they are kept once fetched.
+    event.respondWith(
+        caches.match(event.request).then(response => {
+            return response || fetch(event.request).then(fresh => {
+                if (fresh.ok && url.pathname.startsWith('/static/') && url.searchParams.has('v')) {
+                    const copy = fresh.clone();
+                    caches.open(CACHE_NAME).then(cache => cache.put(event.request, copy));
+                }
+                return fresh;
+            });
+        })
+    );
+});
+
+// Refresh the saved listings and posts in the background where the browser
+// allows it, so the next visit (or an offline one) starts from fresh data
+self.addEventListener('periodicsync', event => {
+    if (event.tag === 'krishimitra-data') {
+        event.waitUntil(KrishiSync.syncAll());
+    }
+});
+
+// Send the writes queued while offline. The browser fires 'sync' once it
+// is back online (and retries while flush fails); pages also ask directly.
+self.addEventListener('sync', event => {
+    if (event.tag === OUTBOX_TAG) {
+        event.waitUntil(KrishiSync.flush());
+    }
+});
+
+self.addEventListener('message', event => {
+    if (event.data === 'flush-outbox') {
+        event.waitUntil(KrishiSync.flush().catch(() => {}));
+    }
+});
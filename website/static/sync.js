@@ -0,0 +1,235 @@
+// Delta sync of listings and posts from /api/v1 into IndexedDB, and the
+// outbox of writes made offline, sent to /api/v1/batch.
+// Loaded by pages (app.js renders from it) and by the service worker
+// (background refresh), so it must not touch the DOM.
+const KrishiSync = (() => {
+    const DB_NAME = 'krishimitra';
+    const KINDS = {
+        listings: { url: '/api/v1/listings', order: 'updated', keep: 300 },
+        posts: { url: '/api/v1/posts', order: 'time', keep: 200 },
+    };
+    const PAGE_LIMIT = 100;
+    // Per /api/v1/batch request; listing photos count towards the bytes
+    const BATCH_OPS = 100;
+    const BATCH_BYTES = 4 * 1024 * 1024;
+
+    function open() {
+        return new Promise((resolve, reject) => {
+            const request = indexedDB.open(DB_NAME, 2);
+            request.onupgradeneeded = event => {
+                const db = request.result;
+                if (event.oldVersion < 1) {
+                    Object.entries(KINDS).forEach(([kind, config]) => {
+                        db.createObjectStore(kind, { keyPath: 'id' }).createIndex('order', config.order);
+                    });
+                    db.createObjectStore('meta');
+                }
+                if (event.oldVersion < 2) {
+                    db.createObjectStore('outbox', { keyPath: 'seq', autoIncrement: true });
+                }
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    // Run fn(tx) in a transaction; resolves with fn's return value once committed
+    function transaction(db, stores, mode, fn) {
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(stores, mode);
+            const result = fn(tx);
+            tx.oncomplete = () => resolve(result);
+            tx.onerror = tx.onabort = () => reject(tx.error);
+        });
+    }
+
+    async function getMeta(db, kind) {
+        const request = await transaction(db, ['meta'], 'readonly', tx => tx.objectStore('meta').get(kind));
+        return request.result || {};
+    }
+
+    function setMeta(db, kind, meta) {
+        return transaction(db, ['meta'], 'readwrite', tx => { tx.objectStore('meta').put(meta, kind); });
+    }
+
+    // Newest first
+    function load(db, kind) {
+        return new Promise((resolve, reject) => {
+            const records = [];
+            const request = db.transaction(kind).objectStore(kind).index('order').openCursor(null, 'prev');
+            request.onsuccess = () => {
+                const cursor = request.result;
+                if (!cursor) return resolve(records);
+                records.push(cursor.value);
+                cursor.continue();
+            };
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    const toRecords = (fields, rows) => rows.map(row => Object.fromEntries(fields.map((f, i) => [f, row[i]])));
+
+    async function fetchPage(kind, params) {
+        const response = await fetch(KINDS[kind].url + '?' + new URLSearchParams(params), { credentials: 'same-origin' });
+        if (!response.ok) throw new Error(kind + ' sync failed: HTTP ' + response.status);
+        return response.json();
+    }
+
+    function store(db, kind, page) {
+        return transaction(db, [kind], 'readwrite', tx => {
+            const records = tx.objectStore(kind);
+            toRecords(page.fields, page.rows).forEach(record => records.put(record));
+            (page.deleted || []).forEach(id => records.delete(id));
+        });
+    }
+
+    // Drop the oldest records beyond the kind's limit
+    function prune(db, kind) {
+        return transaction(db, [kind], 'readwrite', tx => {
+            const records = tx.objectStore(kind);
+            records.count().onsuccess = event => {
+                let excess = event.target.result - KINDS[kind].keep;
+                if (excess <= 0) return;
+                records.index('order').openCursor().onsuccess = e => {
+                    const cursor = e.target.result;
+                    if (!cursor || excess-- <= 0) return;
+                    cursor.delete();
+                    cursor.continue();
+                };
+            };
+        });
+    }
+
+    // Bring the local copy up to date: the newest page on first use, then
+    // only what changed since the last watermark. Returns the stored meta.
+    async function sync(db, kind) {
+        let meta = await getMeta(db, kind);
+        if (!meta.watermark) {
+            const page = await fetchPage(kind, { limit: PAGE_LIMIT });
+            await store(db, kind, page);
+            meta = { watermark: page.watermark, older: page.next, heroes: page.heroes };
+            await setMeta(db, kind, meta);
+            return meta;
+        }
+
+        let cursor = null;
+        do {
+            const params = { since: meta.watermark, limit: PAGE_LIMIT };
+            if (cursor) params.cursor = cursor;
+            const page = await fetchPage(kind, params);
+            if (page.reset) {
+                await transaction(db, [kind], 'readwrite', tx => { tx.objectStore(kind).clear(); });
+                await setMeta(db, kind, {});
+                return sync(db, kind);
+            }
+            await store(db, kind, page);
+            if (page.heroes) meta.heroes = page.heroes;
+            cursor = page.next;
+            if (!cursor) meta.watermark = page.watermark;
+        } while (cursor);
+
+        await setMeta(db, kind, meta);
+        await prune(db, kind);
+        return meta;
+    }
+
+    // Fetch the next page of older records. Returns the stored meta.
+    async function loadOlder(db, kind) {
+        const meta = await getMeta(db, kind);
+        if (!meta.older) return meta;
+        const page = await fetchPage(kind, { cursor: meta.older, limit: PAGE_LIMIT });
+        await store(db, kind, page);
+        meta.older = page.next;
+        await setMeta(db, kind, meta);
+        return meta;
+    }
+
+    // Like and comment counts change without touching the post; refresh
+    // them for the posts on screen
+    async function refreshCounts(db, ids) {
+        if (!ids.length) return;
+        const response = await fetch('/api/v1/posts/counts?ids=' + encodeURIComponent(ids.join(',')),
+                                     { credentials: 'same-origin' });
+        if (!response.ok) return;
+        const { counts } = await response.json();
+        await transaction(db, ['posts'], 'readwrite', tx => {
+            const posts = tx.objectStore('posts');
+            ids.forEach(id => {
+                posts.get(id).onsuccess = event => {
+                    const post = event.target.result;
+                    if (!post || !counts[id]) return;
+                    [post.likes, post.comments] = counts[id];
+                    posts.put(post);
+                };
+            });
+        });
+    }
+
+    async function syncAll() {
+        const db = await open();
+        for (const kind of Object.keys(KINDS)) {
+            const meta = await getMeta(db, kind);
+            if (meta.watermark) await sync(db, kind);  // only what a page has asked for before
+        }
+    }
+
+    // Queue a write ({type, data}) to be sent with the next flush. The key
+    // makes sending it more than once harmless.
+    async function enqueue(op) {
+        const db = await open();
+        const key = self.crypto && crypto.randomUUID ? crypto.randomUUID()
+            : Date.now().toString(36) + Math.random().toString(36).slice(2);
+        await transaction(db, ['outbox'], 'readwrite', tx => { tx.objectStore('outbox').add({ key, ...op }); });
+        return key;
+    }
+
+    async function pending(db) {
+        const request = await transaction(db, ['outbox'], 'readonly', tx => tx.objectStore('outbox').getAll());
+        return request.result;
+    }
+
+    async function hasPending() {
+        const db = await open();
+        const request = await transaction(db, ['outbox'], 'readonly', tx => tx.objectStore('outbox').count());
+        return request.result > 0;
+    }
+
+    // Send queued writes, oldest first, a batch at a time. Applied,
+    // duplicate and rejected writes leave the queue; writes waiting for a
+    // login stay. Throws on a network or server error so the browser
+    // retries the background sync later. Returns the number sent.
+    async function flush() {
+        const db = await open();
+        const queued = await pending(db);
+        let sent = 0;
+        while (sent < queued.length) {
+            const batch = [];
+            let bytes = 0;
+            for (const op of queued.slice(sent)) {
+                const size = JSON.stringify(op.data).length;
+                if (batch.length && (batch.length === BATCH_OPS || bytes + size > BATCH_BYTES)) break;
+                batch.push(op);
+                bytes += size;
+            }
+            const response = await fetch('/api/v1/batch', {
+                method: 'POST',
+                credentials: 'same-origin',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ops: batch.map(({ key, type, data }) => ({ key, type, data })) }),
+            });
+            if (!response.ok) throw new Error('batch failed: HTTP ' + response.status);
+            const { results } = await response.json();
+            await transaction(db, ['outbox'], 'readwrite', tx => {
+                const outbox = tx.objectStore('outbox');
+                results.forEach((result, i) => {
+                    if (result.status !== 'login_required') outbox.delete(batch[i].seq);
+                });
+            });
+            sent += batch.length;
+        }
+        if (sent) await syncAll();
+        return sent;
+    }
+
+    return { open, load, getMeta, sync, loadOlder, refreshCounts, syncAll, transaction, enqueue, hasPending, flush };
+})();
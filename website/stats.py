@@ -0,0 +1,99 @@
+"""Home page stats served from sharded aggregate counters.
+
+Each counter lives at ``stats/<name>/shards/<n>`` and is bumped with
+``firestore.Increment`` on a random shard, so concurrent signups and listings
+never fight over a single document. Reads sum the shards and are cached in
+process for a short TTL, which keeps the landing page at a handful of reads
+no matter how many users or listings exist.
+"""
+import random
+import threading
+
+import click
+from cachetools import TTLCache
+from firebase_admin import firestore
+
+from . import db
+
+STATS_COLLECTION = 'stats'
+NUM_SHARDS = 10
+CACHE_TTL = 60  # seconds
+
+# Counter name -> collection it mirrors (used by the reconcile command)
+COUNTERS = {
+    'farmers': 'users',
+    'listings': 'marketplace_items',
+}
+
+_cache = TTLCache(maxsize=len(COUNTERS), ttl=CACHE_TTL)
+_cache_lock = threading.Lock()
+
+
+def _shards_ref(name):
+    return db.collection(STATS_COLLECTION).document(name).collection('shards')
+
+
+def increment(name, amount=1):
+    """Add ``amount`` (may be negative) to counter ``name``.
+
+    Failures are logged and swallowed: a missed increment only makes the
+    counter drift, and ``reconcile`` brings it back in line.
+    """
+    try:
+        shard_id = str(random.randrange(NUM_SHARDS))
+        _shards_ref(name).document(shard_id).set({'count': firestore.Increment(amount)}, merge=True)
+        with _cache_lock:
+            _cache.pop(name, None)
+    except Exception as e:
+        print(f"Error updating counter {name}: {e}")
+
+
+def get_count(name):
+    with _cache_lock:
+        if name in _cache:
+            return _cache[name]
+
+    total = 0
+    for doc in _shards_ref(name).stream():
+        total += doc.to_dict().get('count', 0)
+
+    with _cache_lock:
+        _cache[name] = total
+    return total
+
+
+def get_home_stats():
+    """Return ``(farmer_count, market_count)`` for the landing page."""
+    return get_count('farmers'), get_count('listings')
+
+
+def reconcile():
+    """Rebuild every counter from its source collection.
+
+    Uses Firestore's server-side ``count()`` aggregation, so a rebuild costs
+    one aggregation query per collection instead of streaming documents.
+    Returns a dict of counter name -> rebuilt value.
+    """
+    results = {}
+    for name, collection in COUNTERS.items():
+        count = db.collection(collection).count().get()[0][0].value
+
+        batch = db.batch()
+        shards = _shards_ref(name)
+        batch.set(shards.document('0'), {'count': count})
+        for i in range(1, NUM_SHARDS):
+            batch.set(shards.document(str(i)), {'count': 0})
+        batch.commit()
+
+        results[name] = count
+
+    with _cache_lock:
+        _cache.clear()
+    return results
+
+
+@click.command('reconcile-stats')
+def reconcile_command():
+    """Rebuild the home page counters from scratch."""
+    for name, count in reconcile().items():
+        click.echo(f"{name}: {count}")
@@ -0,0 +1,111 @@
+"""Delta sync over Firestore collections.
+
+A client keeps a watermark (a server time) and asks for what changed
+after it: documents whose timestamp field is newer, plus the ids deleted
+since, which are recorded as ``tombstones/<collection>:<id>`` when a
+document is removed. Tombstones carry an ``expire_at`` for a Firestore TTL
+policy; a client whose watermark is older than ``RETENTION`` can't be
+caught up from them and has to start over.
+
+Watermarks are moved back by ``SKEW`` so a write committed while a sync
+query ran is sent again next time rather than missed; clients upsert by
+id, so repeats are harmless.
+"""
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+from . import db
+
+TOMBSTONES = 'tombstones'
+RETENTION = timedelta(days=30)
+SKEW = timedelta(seconds=5)
+MAX_DELETED = 500
+
+
+class ResetRequired(Exception):
+    """The client is too far behind to be sent a delta."""
+
+
+def now():
+    return datetime.now(timezone.utc)
+
+
+def to_millis(value):
+    if not isinstance(value, datetime):
+        return None
+    return int(value.timestamp() * 1000)
+
+
+def from_millis(value):
+    return datetime.fromtimestamp(int(value) / 1000, tz=timezone.utc)
+
+
+def tombstone(batch, collection, doc_id):
+    """Record the deletion of ``collection/doc_id`` in ``batch``."""
+    batch.set(db.collection(TOMBSTONES).document(f"{collection}:{doc_id}"), {
+        'collection': collection,
+        'doc_id': doc_id,
+        'deleted_at': firestore.SERVER_TIMESTAMP,
+        'expire_at': now() + RETENTION,
+    })
+
+
+def _projection(fields, field):
+    return list(dict.fromkeys(list(fields) + [field]))
+
+
+def _cursor(query, collection, cursor):
+    if cursor:
+        snapshot = db.collection(collection).document(cursor).get()
+        if snapshot.exists:
+            query = query.start_after(snapshot)
+    return query
+
+
+def newest(collection, field, fields, cursor=None, limit=30):
+    """Newest documents first. Returns ``(docs, next_cursor, watermark)``.
+
+    The watermark is taken before the query, so anything written while it
+    runs is picked up by the first delta.
+    """
+    watermark = now() - SKEW
+    query = (db.collection(collection)
+             .select(_projection(fields, field))
+             .order_by(field, direction=firestore.Query.DESCENDING))
+    docs = list(_cursor(query, collection, cursor).limit(limit + 1).stream())
+    next_cursor = docs[limit - 1].id if len(docs) > limit else None
+    return docs[:limit], next_cursor, watermark
+
+
+def changes(collection, field, fields, since, cursor=None, limit=30):
+    """Documents changed after ``since``, oldest first.
+
+    Returns ``(docs, deleted_ids, next_cursor, watermark)``. Deleted ids
+    come with the first page only. While ``next_cursor`` is set the
+    watermark is None: keep asking with the same ``since``.
+    Raises ResetRequired.
+    """
+    started = now()
+    if since < started - RETENTION:
+        raise ResetRequired()
+
+    query = (db.collection(collection)
+             .select(_projection(fields, field))
+             .where(field, '>', since)
+             .order_by(field))
+    docs = list(_cursor(query, collection, cursor).limit(limit + 1).stream())
+    next_cursor = docs[limit - 1].id if len(docs) > limit else None
+
+    deleted = []
+    if not cursor:
+        tombstones = list(db.collection(TOMBSTONES)
+                          .where('collection', '==', collection)
+                          .where('deleted_at', '>', since)
+                          .limit(MAX_DELETED + 1).stream())
+        if len(tombstones) > MAX_DELETED:
+            raise ResetRequired()
+        deleted = [doc.to_dict()['doc_id'] for doc in tombstones]
+
+    watermark = None if next_cursor else max(since, started - SKEW)
+    return docs[:limit], deleted, next_cursor, watermark
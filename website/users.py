@@ -0,0 +1,207 @@
+"""User documents keyed by normalized phone number.
+
+``users/<phone>`` is found with a single document read instead of a
+``where('phone_number', ...)`` query, and signup creates it inside a
+transaction, so two concurrent signups for one number can't both succeed.
+Resolved profiles (never the password) are kept in a small per-process
+TTL/LRU cache, so later requests in a session skip Firestore entirely.
+
+Documents created before this change have auto ids; until
+``flask migrate-users`` has moved them, a miss on the key falls back to the
+old query. Likewise listings and posts may still hold the number as typed,
+so compare with ``same_phone`` and query with ``phone_variants``.
+"""
+import re
+import threading
+
+import click
+from cachetools import TTLCache
+from firebase_admin import firestore
+
+from . import db
+
+COLLECTION = 'users'
+CACHE_SIZE = 2048
+CACHE_TTL = 300  # seconds
+
+_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+_lock = threading.Lock()
+
+
+class UserExists(Exception):
+    pass
+
+
+def normalize_phone(phone):
+    """Return the number in E.164 form, assuming India (+91) for local
+    numbers, or None if it doesn't look like a phone number."""
+    digits = re.sub(r'\D', '', str(phone or ''))
+    if len(digits) == 11 and digits.startswith('0'):
+        digits = digits[1:]
+    if len(digits) == 10:
+        digits = '91' + digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+
+def same_phone(a, b):
+    """True if two stored or typed numbers are the same phone."""
+    key = normalize_phone(a)
+    return key is not None and key == normalize_phone(b)
+
+
+def phone_variants(phone):
+    """The ways ``phone`` may be spelled in listings and posts written before
+    ``flask migrate-users`` normalized them: the key, the number as given and
+    the usual ways an Indian number is typed. For ``in`` queries."""
+    key = normalize_phone(phone)
+    if key is None:
+        return [str(phone)] if phone else []
+    variants = {key, key[1:], str(phone)}
+    if key.startswith('+91') and len(key) == 13:
+        local = key[3:]
+        variants.update({local, '0' + local, '+91 ' + local, '91 ' + local})
+    return sorted(variants)
+
+
+def _profile(doc_id, data):
+    profile = {k: v for k, v in data.items() if k != 'password'}
+    profile['id'] = doc_id
+    return profile
+
+
+def _remember(key, doc_id, data):
+    with _lock:
+        _cache[key] = _profile(doc_id, data)
+
+
+def fetch(phone):
+    """Read the user straight from Firestore, password included.
+
+    Returns the user dict with its document ``id``, or None. Refreshes the
+    cached profile as a side effect.
+    """
+    key = normalize_phone(phone)
+    if key is None:
+        return None
+    users_ref = db.collection(COLLECTION)
+    doc = users_ref.document(key).get()
+    if not doc.exists:
+        # Not migrated yet: old documents have auto ids and the number as typed
+        candidates = list({str(phone), key})
+        doc = next(users_ref.where('phone_number', 'in', candidates).limit(1).stream(), None)
+        if doc is None:
+            return None
+    data = doc.to_dict()
+    _remember(key, doc.id, data)
+    return dict(data, id=doc.id)
+
+
+def get(phone):
+    """Return the cached profile for ``phone`` (no password), or None."""
+    key = normalize_phone(phone)
+    with _lock:
+        profile = _cache.get(key)
+    if profile is not None:
+        return profile
+    user = fetch(phone)
+    return _profile(user['id'], user) if user else None
+
+
+def create(phone, data):
+    """Create ``users/<phone>`` in a transaction. Raises UserExists."""
+    key = normalize_phone(phone)
+    if key is None:
+        raise ValueError('Invalid phone number')
+    users_ref = db.collection(COLLECTION)
+    user_ref = users_ref.document(key)
+    data = dict(data, phone_number=key)
+
+    @firestore.transactional
+    def _create(transaction):
+        if user_ref.get(transaction=transaction).exists:
+            raise UserExists(key)
+        legacy = users_ref.where('phone_number', 'in', list({str(phone), key})).limit(1)
+        if any(True for _ in transaction.get(legacy)):
+            raise UserExists(key)
+        transaction.create(user_ref, data)
+
+    _create(db.transaction())
+    _remember(key, key, {k: v for k, v in data.items() if v is not firestore.SERVER_TIMESTAMP})
+    return key
+
+
+def update(phone, fields):
+    """Update the user's document, found through the cache."""
+    user = get(phone)
+    if user is None:
+        raise KeyError(phone)
+    db.collection(COLLECTION).document(user['id']).update(fields)
+    invalidate(phone)
+
+
+def invalidate(phone):
+    with _lock:
+        _cache.pop(normalize_phone(phone), None)
+
+
+# Other documents that store a user's phone as typed at signup
+PHONE_FIELDS = [('marketplace_items', 'seller_phone'), ('community_posts', 'author_id')]
+
+
+def _normalize_references():
+    """Rewrite stored phone references to the normalized form."""
+    updated = 0
+    for collection, field in PHONE_FIELDS:
+        batch, pending = db.batch(), 0
+        for doc in db.collection(collection).select([field]).stream():
+            value = doc.to_dict().get(field)
+            key = normalize_phone(value)
+            if key is None or key == value:
+                continue
+            batch.update(doc.reference, {field: key})
+            pending += 1
+            if pending == 450:
+                batch.commit()
+                batch, pending = db.batch(), 0
+            updated += 1
+        if pending:
+            batch.commit()
+    return updated
+
+
+def migrate():
+    """Re-key auto-id user documents by phone number.
+
+    Returns ``(moved, skipped, references)``. A document is skipped when its
+    number is unreadable or another document already holds the key (a
+    duplicate left by the old signup race), and is left in place for manual
+    review. ``references`` counts listings and posts whose stored phone was
+    rewritten to the normalized form.
+    """
+    moved, skipped = 0, []
+    for doc in db.collection(COLLECTION).stream():
+        data = doc.to_dict()
+        key = normalize_phone(data.get('phone_number'))
+        if doc.id == key:
+            continue
+        target = db.collection(COLLECTION).document(key) if key else None
+        if target is None or target.get().exists:
+            skipped.append(doc.id)
+            continue
+        batch = db.batch()
+        batch.create(target, dict(data, phone_number=key))
+        batch.delete(doc.reference)
+        batch.commit()
+        moved += 1
+    return moved, skipped, _normalize_references()
+
+
+@click.command('migrate-users')
+def migrate_command():
+    """Move user documents to ids keyed by normalized phone number."""
+    moved, skipped, references = migrate()
+    click.echo(f"Moved {moved} users, normalized {references} phone references")
+    for doc_id in skipped:
+        click.echo(f"Skipped {doc_id}: missing phone number or duplicate")
@@ -0,0 +1,84 @@
+"""Collection versions for HTTP cache validation.
+
+``versions/<name>`` holds a random token that is replaced whenever a write
+changes the pages built from that collection, so a page's ETag can be
+worked out before any of its data is read. Every worker keeps the tokens in
+memory through one snapshot listener on this small collection. The writer
+updates its own copy straight away, so the page it redirects to after a
+write is never answered with a 304 for the old content.
+
+Likes are deliberately not versioned: they are the hottest write in the
+app and one version document only takes about one write per second.
+"""
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+from . import db
+
+COLLECTION = 'versions'
+
+_versions = {}  # name -> (token, updated_at)
+_lock = threading.Lock()
+_watch = None
+
+
+def _store(name, token, updated_at):
+    with _lock:
+        current = _versions.get(name)
+        # Don't let a late snapshot undo a newer write from this worker
+        if current and current[1] and updated_at and updated_at < current[1]:
+            return
+        _versions[name] = (token, updated_at)
+
+
+def bump(name):
+    """Mark pages built from collection ``name`` as changed.
+
+    Failures are logged and swallowed like counter increments: this worker
+    still sees the new version, other workers catch up on the next bump.
+    """
+    token = uuid.uuid4().hex[:16]
+    updated_at = datetime.now(timezone.utc)
+    try:
+        result = db.collection(COLLECTION).document(name).set({
+            'token': token,
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        })
+        updated_at = result.update_time or updated_at
+    except Exception as e:
+        print(f"Error bumping version {name}: {e}")
+    _store(name, token, updated_at)
+
+
+def get(names):
+    """Return ``{name: (token, updated_at)}``; unversioned names map to ``('', None)``."""
+    with _lock:
+        missing = [name for name in names if name not in _versions]
+    if missing and db.is_configured():
+        # Listener not started or not caught up yet
+        refs = [db.collection(COLLECTION).document(name) for name in missing]
+        for doc in db.get_all(refs):
+            data = doc.to_dict() if doc.exists else {}
+            _store(doc.id, data.get('token', ''), data.get('updated_at'))
+    with _lock:
+        return {name: _versions.get(name, ('', None)) for name in names}
+
+
+def _on_snapshot(col_snapshot, changes, read_time):
+    for doc in col_snapshot:
+        data = doc.to_dict()
+        _store(doc.id, data.get('token', ''), data.get('updated_at'))
+
+
+def start():
+    """Follow version changes made by other workers."""
+    global _watch
+    if _watch is not None or not db.is_configured():
+        return
+    try:
+        _watch = db.collection(COLLECTION).on_snapshot(_on_snapshot)
+    except Exception as e:
+        print(f"Error starting version listener: {e}")
@@ -1,24 +1,36 @@
-from flask import Blueprint, render_template, send_from_directory, session, redirect, url_for, request, current_app, jsonify
-from . import db
-from firebase_admin import firestore
+from flask import Blueprint, render_template, session, redirect, url_for, request, current_app, jsonify, Response
+from . import stats, listings, search_index, diagnosis_cache, diagnosis, images, jobs, model_client, feed, engagement, users, http_cache, mandi, scores, blobs, geo
+from .instrumentation import metrics_token_required
 import os
-import requests
+import time
 import json
-from werkzeug.utils import secure_filename
-from datetime import datetime, date
-from dotenv import load_dotenv  # Import to load .env file
-
-# Load environment variables from .env file
-load_dotenv()
-
+import base64
+import binascii
+import threading
 views = Blueprint('views', __name__)
 
-UPLOAD_FOLDER = 'website/static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+# Each open job event stream holds a server thread for up to two minutes,
+# so only a few may be open per process; past that clients poll
+MAX_EVENT_STREAMS = int(os.environ.get('JOB_EVENT_STREAMS', 2))
+_event_streams = threading.BoundedSemaphore(MAX_EVENT_STREAMS) if MAX_EVENT_STREAMS > 0 else None
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_upload(file):
+    """Re-encode an uploaded listing photo and store it with a thumbnail.
+
+    Returns ``(image_url, thumb_url)``, or None if the file isn't a usable image.
+    """
+    try:
+        full, thumb = images.submit(images.save_listing_photo, file.stream).result()
+    except images.InvalidImage as e:
+        print(f"Rejected upload {file.filename}: {e}")
+        return None
+    return blobs.url(full), blobs.url(thumb)
+
 @views.route('/')
 def home():
     user_name = session.get('user_name') if 'user' in session else None
@@ -28,8 +40,7 @@ def home():
     market_count = 0
     
     try:
-        farmer_count = len(list(db.collection('users').stream()))
-        market_count = len(list(db.collection('marketplace_items').stream()))
+        farmer_count, market_count = stats.get_home_stats()
     except Exception as e:
         print(f"Error fetching stats: {e}")
 
@@ -60,6 +71,12 @@ def profile():
             'phone_number': session.get('user'),
             'role': 'Farmer'
         }
+        try:
+            profile = users.get(session.get('user'))
+            if profile:
+                user_info.update(profile)
+        except Exception as e:
+            print(f"Error loading profile: {e}")
     return render_template('profile.html', user=user_info)
 
 @views.route('/logout')
@@ -69,92 +86,78 @@ def logout():
 
 # --- MARKETPLACE (BUYING) ---
 @views.route('/marketplace', methods=['GET', 'POST'])
+@http_cache.conditional(listings.COLLECTION, mandi.VERSION)
 def marketplace():
-    products_ref = db.collection('marketplace_items')
-
     if request.method == 'POST':
         if 'user' not in session:
             return redirect(url_for('views.login_page'))
             
         try:
-            name = request.form.get('name')
-            price = request.form.get('price')
-            unit = request.form.get('unit')
-            location = request.form.get('location')
-            category = request.form.get('category')
-            description = request.form.get('description')
-            
-            image_url = "https://images.unsplash.com/photo-1574323347407-f5e1ad6d020b?auto=format&fit=crop&w=400&q=80"
-            
+            image_url, thumb_url = listings.DEFAULT_IMAGE, None
             if 'image' in request.files:
                 file = request.files['image']
                 if file and file.filename != '' and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    if not os.path.exists(UPLOAD_FOLDER):
-                        os.makedirs(UPLOAD_FOLDER)
-                    file_path = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(file_path)
-                    image_url = url_for('static', filename=f'uploads/{filename}')
-
-            new_item = {
-                'name': name,
-                'price': int(price) if price else 0,
-                'unit': unit,
-                'location': location,
-                'category': category,
-                'description': description,
-                'seller': session.get('user_name'),
-                'seller_phone': session.get('user'),
-                'image': image_url,
-                'created_at': firestore.SERVER_TIMESTAMP
-            }
-            products_ref.add(new_item)
+                    saved = save_upload(file)
+                    if saved:
+                        image_url, thumb_url = saved
+
+            new_item = listings.new_listing(request.form, session.get('user_name'), session.get('user'),
+                                            image_url, thumb_url)
+            listings.create_listing(new_item)
+            stats.increment('listings')
             return redirect(url_for('views.marketplace'))
         except Exception as e:
             print(f"Error adding item: {e}")
 
-    search_query = request.args.get('search', '').lower()
-    filter_category = request.args.get('category', '')
-    filter_location = request.args.get('location', '').lower()
-    min_price = request.args.get('min_price')
-    max_price = request.args.get('max_price')
-
-    products_list = []
+    filters = {
+        'search': request.args.get('search', ''),
+        'category': request.args.get('category', ''),
+        'location': request.args.get('location', ''),
+        'min_price': listings.parse_price(request.args.get('min_price')),
+        'max_price': listings.parse_price(request.args.get('max_price')),
+        'page_token': request.args.get('page'),
+    }
+    # "Near": a village, town or PIN code, geocoded offline
+    near = request.args.get('near', '').strip()
+    place = geo.geocode(near) if near else None
+    if place:
+        filters['near'] = (place.lat, place.lng)
+        filters['radius_km'] = min(geo.MAX_RADIUS_KM, max(1, request.args.get('radius', geo.DEFAULT_RADIUS_KM, type=int)))
+    page = {'items': [], 'next_page_token': None, 'total_estimate': 0}
     try:
-        docs = products_ref.order_by('created_at', direction=firestore.Query.DESCENDING).stream()
-        for doc in docs:
-            item = doc.to_dict()
-            item['id'] = doc.id
-            
-            if search_query and search_query not in item.get('name', '').lower(): continue
-            if filter_category and filter_category != 'All' and filter_category != item.get('category', ''): continue
-            if filter_location and filter_location not in item.get('location', '').lower(): continue
-            
-            price = item.get('price', 0)
-            if min_price and price < int(min_price): continue
-            if max_price and price > int(max_price): continue
-
-            products_list.append(item)
+        # In-memory index first; Firestore query path if it isn't loaded yet,
+        # which matches fewer fields (see search_index.search)
+        page = search_index.search(**filters) or listings.search_listings(**filters)
     except Exception as e:
         print(f"Database Error: {e}")
 
-    return render_template('marketplace.html', products=products_list, user_logged_in=('user' in session))
+    next_url = None
+    if page['next_page_token']:
+        next_args = request.args.to_dict()
+        next_args['page'] = page['next_page_token']
+        next_url = url_for('views.marketplace', **next_args)
+
+    return render_template('marketplace.html', products=page['items'], total_estimate=page['total_estimate'],
+                           facets=page.get('facets'), next_url=next_url, user_logged_in=('user' in session),
+                           price_hints=mandi.price_hints(page['items']), near_place=place,
+                           near_unknown=bool(near and not place), radius=filters.get('radius_km'))
+
+@views.route('/marketplace/app')
+@http_cache.conditional()
+def marketplace_shell():
+    """The marketplace without listings; app.js renders them from IndexedDB."""
+    return render_template('marketplace.html', products=[], total_estimate=0, facets=None, next_url=None,
+                           user_logged_in=('user' in session), shell=True)
 
 # --- MY FARM (MANAGING) ---
 @views.route('/myfarm')
+@http_cache.conditional(listings.COLLECTION)
 def my_farm():
     if 'user' not in session:
         return redirect(url_for('views.login_page'))
     
-    products_ref = db.collection('marketplace_items')
     try:
-        query = products_ref.where('seller_phone', '==', session.get('user')).stream()
-        my_products = []
-        for doc in query:
-            item = doc.to_dict()
-            item['id'] = doc.id
-            my_products.append(item)
-            
+        my_products = listings.seller_listings(session.get('user'))
     except Exception as e:
         print(f"Error fetching farm items: {e}")
         my_products = []
@@ -166,12 +169,10 @@ def my_farm():
 def edit_item(item_id):
     if 'user' not in session: return redirect(url_for('views.login_page'))
     
-    doc_ref = db.collection('marketplace_items').document(item_id)
-    doc = doc_ref.get()
+    item = listings.get_listing(item_id)
     
-    if doc.exists:
-        item = doc.to_dict()
-        if item.get('seller_phone') == session.get('user'):
+    if item:
+        if users.same_phone(item.get('seller_phone'), session.get('user')):
             try:
                 updates = {
                     'name': request.form.get('name'),
@@ -180,19 +181,15 @@ def edit_item(item_id):
                     'location': request.form.get('location'),
                     'category': request.form.get('category'),
                     'description': request.form.get('description'),
-                    'updated_at': firestore.SERVER_TIMESTAMP
                 }
                 if 'image' in request.files:
                     file = request.files['image']
                     if file and file.filename != '' and allowed_file(file.filename):
-                        filename = secure_filename(file.filename)
-                        if not os.path.exists(UPLOAD_FOLDER):
-                            os.makedirs(UPLOAD_FOLDER)
-                        file_path = os.path.join(UPLOAD_FOLDER, filename)
-                        file.save(file_path)
-                        updates['image'] = url_for('static', filename=f'uploads/{filename}')
-
-                doc_ref.update(updates)
+                        saved = save_upload(file)
+                        if saved:
+                            updates['image'], updates['thumb'] = saved
+
+                listings.update_listing(item_id, updates, previous=item)
             except Exception as e:
                 print(f"Error updating: {e}")
     
@@ -202,48 +199,50 @@ def edit_item(item_id):
 def delete_item(item_id):
     if 'user' not in session: return redirect(url_for('views.login_page'))
     try:
-        doc_ref = db.collection('marketplace_items').document(item_id)
-        doc = doc_ref.get()
-        if doc.exists and doc.to_dict().get('seller_phone') == session.get('user'):
-            doc_ref.delete()
+        item = listings.get_listing(item_id)
+        if item and users.same_phone(item.get('seller_phone'), session.get('user')):
+            listings.delete_listing(item_id, item)
+            stats.increment('listings', -1)
     except Exception as e:
         print(f"Error: {e}")
     return redirect(url_for('views.my_farm'))
 
 # --- COMMUNITY ROUTES ---
 @views.route('/community')
+@http_cache.conditional(feed.COLLECTION, scores.COLLECTION, bucket=feed.CACHE_TTL)
 def community():
     posts_list = []
     heroes_list = []
+    next_page = None
     
-    # 1. Fetch Posts
+    # 1. Fetch Posts (one page, without comments)
     try:
-        posts_ref = db.collection('community_posts')
-        docs = posts_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).stream()
-        for doc in docs:
-            post = doc.to_dict()
-            post['id'] = doc.id
-            if 'timestamp' in post and post['timestamp']:
-                post['time_ago'] = post['timestamp'].strftime('%d %b %Y')
-            posts_list.append(post)
+        posts_list, next_page = feed.get_page(request.args.get('page'))
     except Exception as e:
         print(f"Error fetching posts: {e}")
 
-    # 2. Fetch Harvest Heroes (Top 3 by score)
+    # 2. Fetch Harvest Heroes (Top 3 from the leaderboard document)
     try:
-        users_ref = db.collection('users')
-        # Order by community_score descending, limit 3
-        hero_docs = users_ref.order_by('community_score', direction=firestore.Query.DESCENDING).limit(3).stream()
-        
-        for doc in hero_docs:
-            hero = doc.to_dict()
-            # If score doesn't exist, default to 0
-            hero['score'] = hero.get('community_score', 0)
-            heroes_list.append(hero)
+        heroes_list = feed.get_heroes()
     except Exception as e:
         print(f"Error fetching heroes: {e}")
 
-    return render_template('community.html', posts=posts_list, heroes=heroes_list, user=('user' in session))
+    next_url = url_for('views.community', page=next_page) if next_page else None
+    return render_template('community.html', posts=posts_list, heroes=heroes_list, next_url=next_url, user=('user' in session))
+
+@views.route('/community/app')
+@http_cache.conditional()
+def community_shell():
+    """The community page without posts; app.js renders them from IndexedDB."""
+    return render_template('community.html', posts=[], heroes=[], next_url=None, user=('user' in session), shell=True)
+
+@views.route('/community/comments/<string:post_id>')
+def post_comments(post_id):
+    try:
+        comments, next_page = engagement.get_comments(post_id, request.args.get('page'))
+        return jsonify({'success': True, 'comments': comments, 'next_page': next_page})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @views.route('/community/post', methods=['POST'])
 def create_post():
@@ -252,71 +251,12 @@ def create_post():
     
     try:
         data = request.get_json()
-        title = data.get('title')
-        content = data.get('content')
-        tag = data.get('tag', 'General')
-        phone = session.get('user')
-        
-        # --- HARVEST HERO SCORE CALCULATION ---
-        users_ref = db.collection('users')
-        query = users_ref.where('phone_number', '==', phone).stream()
-        user_doc = None
-        user_id = None
-        
-        for doc in query:
-            user_doc = doc.to_dict()
-            user_id = doc.id
-            break
-            
-        if user_doc and user_id:
-            current_score = user_doc.get('community_score', 0)
-            last_post_date = user_doc.get('last_post_date') # Firestore timestamp
-            
-            today = datetime.now().date()
-            
-            points_change = 0
-            
-            if last_post_date:
-                # Convert Firestore timestamp to date
-                last_date = last_post_date.date()
-                delta = (today - last_date).days
-                
-                if delta > 0:
-                    # It's a new day!
-                    # 1. Deduct points for missed days (if any)
-                    missed_days = delta - 1
-                    if missed_days > 0:
-                        points_change -= missed_days
-                    
-                    # 2. Add points for posting today (First post of the day)
-                    points_change += 2
-            else:
-                # First ever post
-                points_change += 2
-                
-            # Apply Score Update
-            new_score = current_score + points_change
-            
-            # Update User Doc
-            users_ref.document(user_id).update({
-                'community_score': new_score,
-                'last_post_date': firestore.SERVER_TIMESTAMP
-            })
-
-        # --- CREATE POST ---
-        new_post = {
-            'author': session.get('user_name', 'Farmer'),
-            'author_id': phone,
-            'title': title,
-            'content': content,
-            'tag': tag,
-            'likes': 0,
-            'comments': [],
-            'timestamp': firestore.SERVER_TIMESTAMP,
-            'avatar': f"https://api.dicebear.com/7.x/avataaars/svg?seed={session.get('user_name')}"
-        }
-        
-        db.collection('community_posts').add(new_post)
+
+        # One write: the post and its Harvest Hero activity entry; the
+        # score itself is worked out later by the scores job
+        new_post = feed.new_post(data, session.get('user_name', 'Farmer'), session.get('user'))
+        feed.add_post(new_post)
+        feed.invalidate()
         
         return jsonify({'success': True, 'message': 'Post created!'})
     except Exception as e:
@@ -326,8 +266,7 @@ def create_post():
 @views.route('/community/like/<string:post_id>', methods=['POST'])
 def like_post(post_id):
     try:
-        post_ref = db.collection('community_posts').document(post_id)
-        post_ref.update({'likes': firestore.Increment(1)})
+        engagement.like(post_id)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -340,21 +279,15 @@ def comment_post(post_id):
         data = request.get_json()
         comment_text = data.get('comment')
         
-        comment = {
-            'author': session.get('user_name'),
-            'text': comment_text,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M')
-        }
-        
-        post_ref = db.collection('community_posts').document(post_id)
-        post_ref.update({'comments': firestore.ArrayUnion([comment])})
-        return jsonify({'success': True})
+        comment = engagement.add_comment(post_id, session.get('user_name'), comment_text)
+        feed.invalidate(post_id)
+        return jsonify({'success': True, 'comment': comment})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @views.route('/sw.js')
 def service_worker():
-    return send_from_directory('static', 'sw.js')
+    return http_cache.service_worker_response(os.path.join(current_app.static_folder, 'sw.js'))
 
 # --- DISEASE DETECTION (Updated) ---
 @views.route('/disease-detection')
@@ -363,67 +296,174 @@ def disease_detection():
     # api_key = os.environ.get('GEMINI_API_KEY')
     return render_template('disease_detection.html', )
 
-@views.route('api/analyze-crop',methods=['POST'] )
-def analyze_crop():
+def _read_crop_image():
+    """Decode the posted photo. Returns ``(data, image_bytes, error_response)``."""
     api_key=os.environ.get('GEMINI_API_KEY')
     if not api_key:
-        return jsonify({'error': 'Server configuration error: API key is missing'}),500
+        return None, None, (jsonify({'error': 'Server configuration error: API key is missing'}),500)
     
     data=request.get_json()
     if not data:
-        return jsonify({'error': 'Invalid JSON data'}), 400
+        return None, None, (jsonify({'error': 'Invalid JSON data'}), 400)
     image_data=data.get('image')
     if not image_data:
-        return jsonify({'error':'No images data provide'}),400
-    
-   
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-3-flash-preview:generateContent?key={api_key}"
-    prompt = """
-    You are an expert agricultural plant pathologist. Analyze this image of a crop/plant.
-    1. Identify if there is a disease, pest, or if it is healthy.
-    2. If diseased, name the disease and explain the symptoms visible.
-    3. Provide a confidence score (0-100) based on visual clarity.
-    4. Suggest 7 practical treatments or preventative measures.
-    5. Answer with respect to an Indian Farmer. You can use simple language and provide practical solutions with Indian Solution too.
-    
-    Return ONLY valid JSON in this format, with no markdown formatting:
-    {
-        "name": "Disease Name or 'Healthy'",
-        "description": "Brief description of the issue.",
-        "confidence": 85,
-        "treatments": ["Treatment 1", "Treatment 2", "Treatment 3", "Treatment 4", "Treatment 5", "Treatment 6", "Treatment 7"]
-    }
-    """
+        return None, None, (jsonify({'error':'No images data provide'}),400)
 
-    payload = {
-        "contents": [{
-            "parts": [
-                { "text": prompt },
-                { "inline_data": { "mime_type": "image/jpeg", "data": image_data } }
-            ]
-        }]
-    }
     try:
-            response = requests.post(url, json=payload, headers={'Content-Type': 'application/json'})
-            response_data = response.json()
-            
-            # 4. Parse and Clean the Response on the Server
-            if 'candidates' in response_data:
-                text_response = response_data['candidates'][0]['content']['parts'][0]['text']
-                # Remove Markdown code blocks if present
-                clean_json = text_response.replace('```json', '').replace('```', '').strip()
-                result = json.loads(clean_json)
-                return jsonify(result)
-            else:
-                print("Gemini API Error:", response_data)
-                return jsonify({'error': 'AI could not analyze the image'}), 500
+        image_bytes = base64.b64decode(image_data, validate=True)
+    except (binascii.Error, ValueError):
+        return None, None, (jsonify({'error': 'Image data is not valid base64'}), 400)
+    return data, image_bytes, None
+
+@views.route('api/analyze-crop',methods=['POST'] )
+def analyze_crop():
+    data, image_bytes, error = _read_crop_image()
+    if error:
+        return error
+
+    # Same photo (retry, PWA re-upload) -> earlier diagnosis
+    cached, cache_key = diagnosis.find_cached(image_bytes)
+    if cached is not None:
+        return jsonify(cached)
 
+    # Downsize and re-encode before sending upstream; also rejects non-images
+    try:
+        model_image = images.submit(images.process, image_bytes, 'model').result()
+    except images.InvalidImage:
+        return jsonify({'error': 'Unsupported or corrupt image'}), 400
+
+    # Near-identical photo of the same leaf -> earlier diagnosis
+    cached, image_hash = diagnosis.find_similar(image_bytes)
+    if cached is not None:
+        return jsonify(cached)
+    image_b64 = diagnosis.encode_image(model_image)
+
+    # Job mode: answer right away, the client polls or listens for the result
+    if data.get('async'):
+        try:
+            job_id = jobs.enqueue(image_b64, model_image.mime_type, cache_key, image_hash)
+        except jobs.QueueFull:
+            return jsonify({'error': 'Too many diagnoses in progress, please retry shortly'}), 503
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('views.job_status', job_id=job_id),
+            'events_url': url_for('views.job_events', job_id=job_id),
+        }), 202
+
+    try:
+        result = diagnosis.call_model(image_b64, model_image.mime_type)
+    except diagnosis.DiagnosisError as e:
+        print(f"Diagnosis Error: {e}")
+        if e.unavailable:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'error': str(e)}), 504 if e.retryable else 500
     except Exception as e:
-            print(f"Server Error: {e}")
-            return jsonify({'error': str(e)}), 500
-        
+        print(f"Server Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    diagnosis.remember(cache_key, image_hash, result)
+    return jsonify(result)
+
+@views.route('/api/analyze-crop/stream', methods=['POST'])
+def analyze_crop_stream():
+    """Like analyze_crop, but answers with newline-delimited JSON events so
+    the disease name and confidence show up before the treatments are written."""
+    data, image_bytes, error = _read_crop_image()
+    if error:
+        return error
+
+    cached, cache_key = diagnosis.find_cached(image_bytes)
+    if cached is None:
+        try:
+            model_image = images.submit(images.process, image_bytes, 'model').result()
+        except images.InvalidImage:
+            return jsonify({'error': 'Unsupported or corrupt image'}), 400
+        cached, image_hash = diagnosis.find_similar(image_bytes)
+    if cached is not None:
+        return Response(json.dumps({'done': True, 'result': cached}) + '\n', mimetype='application/x-ndjson')
+    image_b64 = diagnosis.encode_image(model_image)
+
+    def stream():
+        try:
+            for event in diagnosis.stream_model(image_b64, model_image.mime_type, cache_key, image_hash):
+                yield json.dumps(event) + '\n'
+        except diagnosis.DiagnosisError as e:
+            print(f"Diagnosis Error: {e}")
+            yield json.dumps({'error': str(e)}) + '\n'
+    # X-Accel-Buffering: stop nginx from holding the events back
+    return Response(stream(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@views.route('/api/jobs/<string:job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+@views.route('/api/jobs/<string:job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events: one 'status' event per change, then the final job.
+
+    At most ``MAX_EVENT_STREAMS`` (``JOB_EVENT_STREAMS``, 0 turns them off)
+    are open per process; beyond that the answer is 503 and the client
+    should poll ``job_status`` instead."""
+    if _event_streams is None or not _event_streams.acquire(blocking=False):
+        response = jsonify({'error': 'Too many open event streams, poll the status URL instead',
+                            'status_url': url_for('views.job_status', job_id=job_id)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    def stream():
+        last_status = None
+        deadline = time.time() + 120
+        while time.time() < deadline:
+            job = jobs.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Unknown job'})}\n\n"
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            if job['status'] in ('done', 'failed'):
+                return
+            time.sleep(jobs.POLL_INTERVAL)
+        yield "event: timeout\ndata: {}\n\n"
+    response = Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    # Released when the server closes the response, even if it never started
+    response.call_on_close(_event_streams.release)
+    return response
+
+@views.route('/api/jobs/metrics')
+@metrics_token_required
+def job_metrics():
+    return jsonify(jobs.metrics())
+
+@views.route('/api/model/metrics')
+@metrics_token_required
+def model_metrics():
+    return jsonify(model_client.metrics())
+
+@views.route('/api/diagnosis-cache/stats')
+@metrics_token_required
+def diagnosis_cache_stats():
+    return jsonify(diagnosis_cache.metrics())
+
 @views.route('/news')
 def news(): return "<h3>Coming Soon</h3><a href='/'>Back Home</a>"
-@views.route('/mandi')
-def mandi(): return "<h3>Coming Soon</h3><a href='/'>Back Home</a>"
\ No newline at end of file
+@views.route('/mandi', endpoint='mandi')
+def mandi_prices():
+    commodities = mandi.commodities()
+    commodity = request.args.get('commodity') or (commodities[0] if commodities else None)
+    market = request.args.get('market') or None
+    markets, trend, comparison, error = [], None, None, None
+    if commodity:
+        try:
+            markets = mandi.markets(commodity)
+            trend = mandi.trend(commodity, market, days=request.args.get('days', 90, type=int))
+            if market:
+                comparison = mandi.compare(commodity, market)
+        except mandi.UnknownName as e:
+            error = f"No prices for {e.args[0]}"
+    return render_template('mandi.html', commodities=commodities, commodity=commodity, market=market,
+                           markets=markets, trend=trend, comparison=comparison, error=error)
\ No newline at end of file